@@ -0,0 +1,12 @@
+"""Helpers shared by the benchmarks."""
+import asyncio
+
+
+async def wait_until(predicate, timeout: float = 10, interval: float = 0.005):
+    """Poll ``predicate`` every ``interval`` seconds until it is true."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        if loop.time() > deadline:
+            raise TimeoutError("Condition not met in time")
+        await asyncio.sleep(interval)
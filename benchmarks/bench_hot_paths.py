@@ -0,0 +1,232 @@
+"""Benchmark the hot paths and compare them with a stored baseline.
+
+Measures frame encoding, status parsing, MQTT message dispatch across N
+listeners, state fan-out to all entities and the end-to-end latency from an
+MQTT command to the confirmed state coming back over MQTT, with the stand-in
+broker and the soundbar simulator in place of the real things.
+
+    python -m benchmarks.bench_hot_paths             # compare with baseline.json
+    python -m benchmarks.bench_hot_paths --save      # record a new baseline
+
+Every number is "lower is better". A run fails if any of them exceeds the
+baseline by more than ``--tolerance`` times.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import types
+
+from paho.mqtt.client import MQTTMessage
+
+from benchmarks._util import wait_until
+from benchmarks.broker import StandInBroker
+from yamaha_bt.mqtt import MQTTClient
+from yamaha_bt.mqtt_asyncio import AsyncioMQTTClient
+from yamaha_bt.simulator import SoundBarSimulator
+from yamaha_bt.yamaha import COMMANDS, SoundBar, encode
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+STATUS_FRAME = encode("0500013f000a0c0000000a0024")
+DISPATCH_LISTENERS = (10, 100, 1000)
+
+
+def per_call(func, number: int) -> float:
+    """Return the best time per call of ``func`` in nanoseconds over a few repeats."""
+    best = None
+    for _ in range(5):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter_ns() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_encode(number: int) -> float:
+    """Encode every command once per call."""
+    commands = list(COMMANDS.values())
+
+    def run():
+        for command in commands:
+            encode(command)
+
+    return per_call(run, number) / len(commands)
+
+
+def bench_parse(number: int) -> float:
+    """Parse one status frame per call, as the receive path hands it over."""
+    frame = memoryview(STATUS_FRAME)
+    return per_call(lambda: SoundBar.parse_device_status(frame), number)
+
+
+async def bench_dispatch(listeners: int, messages: int) -> float:
+    """Return microseconds per message from paho's callback to the listener."""
+    loop = asyncio.get_running_loop()
+    client = MQTTClient(types.SimpleNamespace(loop=loop), "127.0.0.1", 1883, None, None)
+    received = []
+    done = asyncio.Event()
+
+    def listener(topic, payload):
+        received.append(topic)
+        if len(received) == messages:
+            done.set()
+
+    for index in range(listeners):
+        client.add_msg_listner(lambda topic, payload: None, f"bench/{index}/set")
+    client.add_msg_listner(listener, "bench/target/set")
+
+    msg = MQTTMessage(topic=b"bench/target/set")
+    msg.payload = b"ON"
+    start = time.perf_counter()
+    for _ in range(messages):
+        client._mqtt_on_message(None, None, msg)
+    await done.wait()
+    return (time.perf_counter() - start) / messages * 1e6
+
+
+def make_bridge(broker_port: int, transport: str):
+    """Create a Bridge with one soundbar talking to the stand-ins."""
+    os.environ.update(
+        MQTT_HOST="127.0.0.1",
+        MQTT_PORT=str(broker_port),
+        MQTT_USERNAME="bench",
+        MQTT_PASSWORD="bench",
+        MQTT_ENGINE="asyncio",
+        SOUNDBAR_TRANSPORT=transport,
+        DISCOVERY_CHECK_TIMEOUT="0",
+    )
+    from yamaha_bt.device import Bridge  # pylint: disable=import-outside-toplevel
+
+    return Bridge()
+
+
+async def bench_fanout(device, updates: int) -> float:
+    """Return microseconds per state change that touches every entity."""
+    published = []
+
+    async def publish(topic, payload, qos, retain):
+        published.append(topic)
+
+    real_publish, device.mqtt.publish = device.mqtt.publish, publish
+    real_state, old_state = device.yam.state, device.old_state
+    states = [dict(real_state), dict(real_state)]
+    for key in ("power", "mute", "bass_ext", "clearvoice"):
+        states[1][key] = not states[0][key]
+    states[1].update(volume=states[0]["volume"] + 1, input="tv", surround="movie")
+
+    start = time.perf_counter()
+    for index in range(updates):
+        device.yam.state = states[index % 2]
+        await device.state_updated(device.yam.state)
+        # Let the entity updates run.
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+
+    device.mqtt.publish = real_publish
+    device.yam.state, device.old_state = real_state, old_state
+    return elapsed / updates * 1e6
+
+
+async def bench_end_to_end(device, broker_port: int, rounds: int) -> dict:
+    """Toggle mute over MQTT and time until the confirmed state comes back."""
+    loop = asyncio.get_running_loop()
+    mute = next(entity for entity in device.entities if entity.name == "Mute")
+    state_topic = mute.discovery_msg["state_topic"]
+    command_topic = mute.discovery_msg["command_topic"]
+
+    home_assistant = AsyncioMQTTClient(
+        types.SimpleNamespace(loop=loop), "127.0.0.1", broker_port, None, None
+    )
+    states = asyncio.Queue()
+    home_assistant.add_msg_listner(lambda topic, payload: states.put_nowait(payload), state_topic)
+    await home_assistant.connect()
+    await home_assistant.perform_subscription(state_topic, 0)
+    current = await states.get()  # the retained state
+
+    latencies = []
+    for _ in range(rounds):
+        wanted = "OFF" if current == "ON" else "ON"
+        start = time.perf_counter()
+        await home_assistant.publish(command_topic, wanted, 0, False)
+        while current != wanted:
+            current = await asyncio.wait_for(states.get(), 5)
+        latencies.append(time.perf_counter() - start)
+
+    await home_assistant.disconnect()
+    latencies.sort()
+    return {
+        "e2e_p50_ms": statistics.median(latencies) * 1000,
+        "e2e_p99_ms": latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000,
+    }
+
+
+async def main(scale: float) -> dict:
+    """Run every benchmark and return the results."""
+    results = {
+        "encode_ns": bench_encode(int(2000 * scale)),
+        "parse_ns": bench_parse(int(20000 * scale)),
+    }
+    for listeners in DISPATCH_LISTENERS:
+        results[f"dispatch_{listeners}_us"] = await bench_dispatch(listeners, int(5000 * scale))
+
+    broker = StandInBroker()
+    await broker.start()
+    simulator = SoundBarSimulator()
+    host, port = await simulator.start_tcp()
+    bridge = make_bridge(broker.port, f"tcp://{host}:{port}")
+    device = bridge.devices[0]
+    run_task = asyncio.create_task(bridge.run())
+    try:
+        await wait_until(lambda: bridge.time_to_ready is not None and device.yam.state)
+        results["fanout_us"] = await bench_fanout(device, int(2000 * scale))
+        results.update(await bench_end_to_end(device, broker.port, int(200 * scale)))
+    finally:
+        await bridge.stop()
+        await run_task
+        await simulator.stop()
+        await broker.stop()
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Print each result next to its baseline, return the names that regressed."""
+    regressions = []
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:20} {value:12.2f}")
+            continue
+        ratio = value / base if base else float("inf")
+        flag = "  REGRESSION" if ratio > tolerance else ""
+        print(f"{name:20} {value:12.2f}  baseline {base:12.2f}  x{ratio:5.2f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the iteration counts")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args.scale))
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+            file.write("\n")
+        print(f"Saved baseline to {args.baseline}")
+        sys.exit(0)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+    if compare(results, baseline, args.tolerance):
+        sys.exit(1)
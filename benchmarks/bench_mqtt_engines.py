@@ -0,0 +1,89 @@
+"""Compare the paho and asyncio MQTT engines against the stand-in broker.
+
+Each engine publishes ``--messages`` messages to a topic it is subscribed to
+and we measure the time from ``publish()`` to the listener being called.
+
+    python -m benchmarks.bench_mqtt_engines --messages 5000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import types
+
+from benchmarks.broker import StandInBroker
+from yamaha_bt.mqtt import MQTTClient
+from yamaha_bt.mqtt_asyncio import AsyncioMQTTClient
+
+ENGINES = {
+    "paho": MQTTClient,
+    "asyncio": AsyncioMQTTClient,
+}
+
+TOPIC = "bench/echo"
+
+
+async def run_engine(client_cls, port: int, messages: int) -> dict:
+    """Publish ``messages`` round trips through the broker and time them."""
+    loop = asyncio.get_running_loop()
+    client = client_cls(types.SimpleNamespace(loop=loop), "127.0.0.1", port, None, None)
+    latencies = []
+    done = asyncio.Event()
+
+    def listener(topic, payload):
+        latencies.append(time.perf_counter() - float(payload))
+        if len(latencies) == messages:
+            loop.call_soon_threadsafe(done.set)
+
+    client.add_msg_listner(listener, TOPIC)
+    await client.connect()
+    await client.perform_subscription(TOPIC, 0)
+    # Give the subscription a moment to reach the broker.
+    await asyncio.sleep(0.2)
+
+    start = time.perf_counter()
+    for _ in range(messages):
+        await client.publish(TOPIC, repr(time.perf_counter()), 0, False)
+    await asyncio.wait_for(done.wait(), 60)
+    elapsed = time.perf_counter() - start
+
+    if hasattr(client, "disconnect"):
+        await client.disconnect()
+    else:
+        client._mqttc.disconnect()
+        client._mqttc.loop_stop()
+
+    latencies.sort()
+    return {
+        "messages": messages,
+        "seconds": elapsed,
+        "msg_per_sec": messages / elapsed,
+        "latency_p50_ms": statistics.median(latencies) * 1000,
+        "latency_p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def main(messages: int, engines) -> dict:
+    """Run the benchmark for each engine."""
+    broker = StandInBroker()
+    await broker.start()
+    results = {}
+    try:
+        for name in engines:
+            results[name] = await run_engine(ENGINES[name], broker.port, messages)
+    finally:
+        await broker.stop()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--engine", choices=ENGINES, action="append")
+    args = parser.parse_args()
+
+    for engine, result in asyncio.run(main(args.messages, args.engine or list(ENGINES))).items():
+        print(
+            f"{engine:8} {result['msg_per_sec']:10.0f} msg/s  "
+            f"p50 {result['latency_p50_ms']:7.2f} ms  p99 {result['latency_p99_ms']:7.2f} ms"
+        )
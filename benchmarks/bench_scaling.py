@@ -0,0 +1,148 @@
+"""Measure bridge CPU and memory against the number of soundbars.
+
+Starts the stand-in broker and one simulated soundbar per device in this
+process, then runs the real bridge (``python -m yamaha_bt``) as a child
+process managing all of them over one MQTT connection. While a Home
+Assistant stand-in presses a volume button on every soundbar ``--rate``
+times per second, the child's CPU time and resident memory are read from
+``/proc`` (Linux only).
+
+    python -m benchmarks.bench_scaling --devices 1 2 4 8 16 --seconds 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import types
+
+from benchmarks._util import wait_until
+from benchmarks.broker import StandInBroker
+from yamaha_bt.const import PAYLOAD_AVAILABLE
+from yamaha_bt.mqtt_asyncio import AsyncioMQTTClient
+from yamaha_bt.simulator import SoundBarSimulator
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def cpu_seconds(pid: int) -> float:
+    """Return the user plus system CPU time of ``pid``."""
+    with open(f"/proc/{pid}/stat", encoding="ascii") as stat:
+        # The command name may contain spaces, the fields after it do not.
+        fields = stat.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def rss_bytes(pid: int) -> int:
+    """Return the resident memory of ``pid``."""
+    with open(f"/proc/{pid}/statm", encoding="ascii") as statm:
+        return int(statm.read().split()[1]) * PAGE_SIZE
+
+
+async def run_devices(count: int, seconds: float, rate: float, engine: str) -> dict:
+    """Run the bridge with ``count`` simulated soundbars and measure it."""
+    loop = asyncio.get_running_loop()
+    broker = StandInBroker()
+    await broker.start()
+
+    simulators, soundbars = [], []
+    for index in range(count):
+        simulator = SoundBarSimulator(latency=0.02, jitter=0.01, seed=index)
+        host, port = await simulator.start_tcp()
+        simulators.append(simulator)
+        soundbars.append(
+            {
+                "name": f"Soundbar {index}",
+                "unique_id": f"bench_soundbar_{index}",
+                "transport": f"tcp://{host}:{port}",
+            }
+        )
+
+    env = dict(
+        os.environ,
+        MQTT_HOST=broker.host,
+        MQTT_PORT=str(broker.port),
+        MQTT_USERNAME="bench",
+        MQTT_PASSWORD="bench",
+        MQTT_ENGINE=engine,
+        DISCOVERY_CHECK_TIMEOUT="0",
+        SOUNDBARS=json.dumps(soundbars),
+    )
+    child = subprocess.Popen(
+        [sys.executable, "-m", "yamaha_bt"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    home_assistant = AsyncioMQTTClient(
+        types.SimpleNamespace(loop=loop), broker.host, broker.port, None, None
+    )
+    try:
+        availability = [f"home/{soundbar['unique_id']}/availability" for soundbar in soundbars]
+        await wait_until(
+            lambda: all(
+                broker.retained.get(topic) == PAYLOAD_AVAILABLE.encode() for topic in availability
+            ),
+            timeout=30,
+            interval=0.05,
+        )
+        await home_assistant.connect()
+        buttons = [
+            f"home/{soundbar['unique_id']}/{soundbar['unique_id']}_volume_up/command"
+            for soundbar in soundbars
+        ]
+
+        commands_before = sum(simulator.commands for simulator in simulators)
+        cpu_before = cpu_seconds(child.pid)
+        start = time.perf_counter()
+        presses = 0
+        while time.perf_counter() - start < seconds:
+            for topic in buttons:
+                await home_assistant.publish(topic, "PRESS", 0, False)
+                presses += 1
+            await asyncio.sleep(1 / rate if rate else seconds)
+        elapsed = time.perf_counter() - start
+        cpu = cpu_seconds(child.pid) - cpu_before
+
+        return {
+            "devices": count,
+            "cpu_percent": cpu / elapsed * 100,
+            "rss_mib": rss_bytes(child.pid) / 2**20,
+            "presses": presses,
+            "commands_seen": sum(simulator.commands for simulator in simulators) - commands_before,
+        }
+    finally:
+        await home_assistant.disconnect()
+        child.terminate()
+        child.wait()
+        for simulator in simulators:
+            await simulator.stop()
+        await broker.stop()
+
+
+async def main(device_counts, seconds: float, rate: float, engine: str) -> list:
+    """Measure every device count in turn."""
+    return [await run_devices(count, seconds, rate, engine) for count in device_counts]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--rate", type=float, default=2, help="button presses per soundbar per second")
+    parser.add_argument("--engine", choices=("paho", "asyncio"), default="asyncio")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args.devices, args.seconds, args.rate, args.engine))
+    for result in results:
+        print(
+            f"{result['devices']:4} soundbars  cpu {result['cpu_percent']:6.1f} %  "
+            f"rss {result['rss_mib']:6.1f} MiB  {result['commands_seen']}/{result['presses']} commands"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,191 @@
+"""Stand-in MQTT broker for benchmarks.
+
+Just enough of MQTT 3.1.1 to exercise the bridge locally: CONNECT with last
+will, QoS 0/1 PUBLISH, retained messages, SUBSCRIBE/UNSUBSCRIBE with
+``+``/``#`` filters and PINGREQ. Everything is delivered at QoS 0.
+"""
+import asyncio
+import logging
+import struct
+
+from yamaha_bt.mqtt_asyncio import (
+    CONNACK,
+    CONNECT,
+    DISCONNECT,
+    PINGREQ,
+    PINGRESP,
+    PUBACK,
+    PUBLISH,
+    SUBACK,
+    UNSUBACK,
+    build_packet,
+    build_publish,
+    read_packet,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+SUBSCRIBE_TYPE = 0x80
+UNSUBSCRIBE_TYPE = 0xA0
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """Return True if ``topic`` matches the subscription ``topic_filter``."""
+    filter_parts = topic_filter.split("/")
+    topic_parts = topic.split("/")
+    for index, part in enumerate(filter_parts):
+        if part == "#":
+            return True
+        if index >= len(topic_parts):
+            return False
+        if part not in ("+", topic_parts[index]):
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+def _read_string(body: bytes, pos: int):
+    """Read a length prefixed field, return ``(value, new_pos)``."""
+    (length,) = struct.unpack("!H", body[pos:pos + 2])
+    pos += 2
+    return body[pos:pos + length], pos + length
+
+
+class Session:
+    """A connected client."""
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        """Initialize the session."""
+        self.writer = writer
+        self.client_id = None
+        self.filters = []
+        self.will = None
+
+
+class StandInBroker:
+    """Minimal in-process MQTT broker."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        """Initialize the broker, port 0 picks a free port."""
+        self.host = host
+        self.port = port
+        self.sessions = set()
+        self.retained = {}
+        self.published = 0
+        self.connects = 0
+        self._server: asyncio.AbstractServer = None
+        self._client_tasks = set()
+
+    async def start(self):
+        """Start listening."""
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop listening and drop every client."""
+        self._server.close()
+        self.drop_clients()
+        await asyncio.gather(*self._client_tasks, return_exceptions=True)
+        await self._server.wait_closed()
+
+    def drop_clients(self):
+        """Close every client connection as if the network went away."""
+        for session in list(self.sessions):
+            session.writer.transport.abort()
+
+    async def _handle_client(self, reader, writer):
+        """Serve one client connection."""
+        task = asyncio.current_task()
+        self._client_tasks.add(task)
+        session = Session(writer)
+        clean = False
+        try:
+            while True:
+                header, body = await read_packet(reader)
+                packet_type = header & 0xF0
+                if packet_type == CONNECT:
+                    self._handle_connect(session, body)
+                elif packet_type == PUBLISH:
+                    self._handle_publish(session, header, body)
+                elif packet_type == SUBSCRIBE_TYPE:
+                    self._handle_subscribe(session, body)
+                elif packet_type == UNSUBSCRIBE_TYPE:
+                    self._handle_unsubscribe(session, body)
+                elif packet_type == PINGREQ:
+                    writer.write(build_packet(PINGRESP, b""))
+                elif packet_type == DISCONNECT:
+                    clean = True
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._client_tasks.discard(task)
+            self.sessions.discard(session)
+            if not clean and session.will is not None:
+                self.route(*session.will)
+            writer.close()
+
+    def _handle_connect(self, session: Session, body: bytes):
+        """Handle CONNECT."""
+        _name, pos = _read_string(body, 0)
+        flags = body[pos + 1]
+        pos += 4
+        client_id, pos = _read_string(body, pos)
+        session.client_id = client_id.decode()
+        if flags & 0x04:
+            will_topic, pos = _read_string(body, pos)
+            will_payload, pos = _read_string(body, pos)
+            session.will = (will_topic.decode(), will_payload, bool(flags & 0x20))
+
+        self.sessions.add(session)
+        self.connects += 1
+        session.writer.write(build_packet(CONNACK, b"\x00\x00"))
+
+    def _handle_publish(self, session: Session, header: int, body: bytes):
+        """Handle PUBLISH."""
+        qos = (header >> 1) & 0x03
+        topic, pos = _read_string(body, 0)
+        if qos:
+            session.writer.write(build_packet(PUBACK, body[pos:pos + 2]))
+            pos += 2
+        self.route(topic.decode(), body[pos:], bool(header & 0x01))
+
+    def _handle_subscribe(self, session: Session, body: bytes):
+        """Handle SUBSCRIBE, retained messages are sent after the SUBACK."""
+        mid = body[:2]
+        pos = 2
+        new_filters = []
+        while pos < len(body):
+            topic_filter, pos = _read_string(body, pos)
+            pos += 1
+            new_filters.append(topic_filter.decode())
+        session.filters.extend(new_filters)
+        session.writer.write(build_packet(SUBACK, mid + bytes(len(new_filters))))
+
+        for topic, payload in self.retained.items():
+            if any(topic_matches(flt, topic) for flt in new_filters):
+                session.writer.write(build_publish(topic, payload, 0, True))
+
+    def _handle_unsubscribe(self, session: Session, body: bytes):
+        """Handle UNSUBSCRIBE."""
+        pos = 2
+        while pos < len(body):
+            topic_filter, pos = _read_string(body, pos)
+            if topic_filter.decode() in session.filters:
+                session.filters.remove(topic_filter.decode())
+        session.writer.write(build_packet(UNSUBACK, body[:2]))
+
+    def route(self, topic: str, payload: bytes, retain: bool):
+        """Deliver a message to every matching subscriber."""
+        self.published += 1
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+
+        packet = None
+        for session in self.sessions:
+            if any(topic_matches(flt, topic) for flt in session.filters):
+                if packet is None:
+                    packet = build_publish(topic, payload, 0, False)
+                session.writer.write(packet)
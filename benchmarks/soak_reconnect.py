@@ -0,0 +1,105 @@
+"""Soak test: hundreds of broker reconnects must not leak listeners, tasks or memory.
+
+Runs a full Bridge (without the soundbar link) against the stand-in broker,
+drops the connection ``--reconnects`` times and checks that the listener
+count, the number of asyncio tasks and the traced memory stay flat.
+
+    python -m benchmarks.soak_reconnect --engine asyncio --reconnects 300
+"""
+import argparse
+import asyncio
+import gc
+import os
+import sys
+import tracemalloc
+
+from benchmarks._util import wait_until
+from benchmarks.broker import StandInBroker
+
+WARMUP = 10
+# Allowed growth of traced memory between warm-up and the end of the run.
+MEMORY_SLACK = 256 * 1024
+
+
+def snapshot(bridge) -> dict:
+    """Collect the numbers that must stay flat."""
+    gc.collect()
+    return {
+        "listeners": bridge.mqtt.listener_count,
+        "tasks": len(asyncio.all_tasks()),
+        "memory": tracemalloc.get_traced_memory()[0],
+    }
+
+
+async def main(engine: str, reconnects: int) -> dict:
+    """Run the soak test and return the snapshots before and after."""
+    broker = StandInBroker()
+    await broker.start()
+    os.environ.update(
+        MQTT_HOST=broker.host,
+        MQTT_PORT=str(broker.port),
+        MQTT_USERNAME="soak",
+        MQTT_PASSWORD="soak",
+        MQTT_ENGINE=engine,
+        BT_ATTR="00:00:00:00:00:00",
+        DISCOVERY_CHECK_TIMEOUT="0",
+    )
+    from yamaha_bt.device import Bridge  # pylint: disable=import-outside-toplevel
+
+    bridge = Bridge()
+
+    async def no_soundbar():
+        """Leave the soundbar disconnected."""
+
+    for device in bridge.devices:
+        device.yam.connect = no_soundbar
+    run_task = asyncio.create_task(bridge.run())
+
+    registered = 0
+
+    def ready():
+        return broker.connects == registered + 1 and bridge.time_to_ready is not None
+
+    before = None
+    try:
+        for attempt in range(reconnects + 1):
+            await wait_until(ready)
+            bridge.time_to_ready = None
+            registered += 1
+            if attempt == WARMUP:
+                tracemalloc.start()
+                before = snapshot(bridge)
+            if attempt < reconnects:
+                broker.drop_clients()
+        after = snapshot(bridge)
+    finally:
+        run_task.cancel()
+        tracemalloc.stop()
+        await broker.stop()
+
+    return {"before": before, "after": after}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--engine", choices=("paho", "asyncio"), default="asyncio")
+    parser.add_argument("--reconnects", type=int, default=300)
+    args = parser.parse_args()
+
+    result = asyncio.run(main(args.engine, max(args.reconnects, WARMUP)))
+    before, after = result["before"], result["after"]
+    print(f"listeners {before['listeners']} -> {after['listeners']}")
+    print(f"tasks     {before['tasks']} -> {after['tasks']}")
+    print(f"memory    {before['memory']} -> {after['memory']} bytes")
+
+    failures = []
+    if after["listeners"] != before["listeners"]:
+        failures.append("listener count grew")
+    if after["tasks"] > before["tasks"]:
+        failures.append("task count grew")
+    if after["memory"] - before["memory"] > MEMORY_SLACK:
+        failures.append("memory grew")
+    if failures:
+        print("FAIL: " + ", ".join(failures))
+        sys.exit(1)
+    print("OK")
@@ -0,0 +1,31 @@
+"""Helpers shared by the tests."""
+import asyncio
+import contextlib
+
+from yamaha_bt.simulator import SoundBarSimulator
+from yamaha_bt.transport import TcpTransport
+from yamaha_bt.yamaha import SoundBar
+
+
+async def wait_for_state(soundbar: SoundBar, timeout: float = 2.0):
+    """Wait until the soundbar reported its state."""
+    async def poll():
+        while not soundbar.state:
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+@contextlib.asynccontextmanager
+async def connected_soundbar(**simulator_args):
+    """Yield a simulator and a soundbar connected to it over TCP."""
+    simulator = SoundBarSimulator(**simulator_args)
+    host, port = await simulator.start_tcp()
+    soundbar = SoundBar(None, transport=TcpTransport(host, port))
+    await soundbar.connect()
+    try:
+        await wait_for_state(soundbar)
+        yield simulator, soundbar
+    finally:
+        await soundbar.close()
+        await simulator.stop()
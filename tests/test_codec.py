@@ -0,0 +1,142 @@
+"""Tests of the wire protocol codec."""
+import itertools
+import random
+
+import pytest
+
+from yamaha_bt.codec import (
+    COMMANDS,
+    INPUT_NAMES,
+    SURROUND_NAMES,
+    VOLUME_MAX,
+    FrameDecoder,
+    csum,
+    decode_status,
+    encode,
+    is_status_frame,
+)
+from yamaha_bt.simulator import SoundBarSimulator
+
+
+def status_frame(**state) -> bytes:
+    simulator = SoundBarSimulator()
+    for field, value in state.items():
+        setattr(simulator, field, value)
+    return simulator.status_frame()
+
+
+def decode_all(decoder, *chunks) -> list:
+    return [bytes(frame) for chunk in chunks for frame in decoder.feed(chunk)]
+
+
+STATUS = status_frame()
+VOLUME_UP = encode(COMMANDS["volume_up"])
+
+
+@pytest.mark.parametrize("name", COMMANDS)
+def test_encode_command(name):
+    frame = encode(COMMANDS[name])
+    payload = bytes.fromhex(COMMANDS[name])
+    assert frame == b"\xcc\xaa" + bytes([len(payload)]) + payload + bytes([csum(len(payload), payload)])
+    assert encode(COMMANDS[name]) is frame
+
+
+@pytest.mark.parametrize("payload", [b"\x40\x78\x1e", bytearray(b"\x40\x78\x1e"), [0x40, 0x78, 0x1e]])
+def test_encode_bytes_like(payload):
+    assert encode(payload) == VOLUME_UP
+
+
+def test_encode_too_long():
+    with pytest.raises(ValueError):
+        encode(bytes(256))
+
+
+@pytest.mark.parametrize(
+    "power, input, surround",
+    list(itertools.product((True, False), INPUT_NAMES.values(), SURROUND_NAMES.values())),
+)
+def test_status_round_trip(power, input, surround):
+    state = {
+        "power": power,
+        "input": input,
+        "mute": power,
+        "volume": VOLUME_MAX if power else 0,
+        "subwoofer": 16,
+        "surround": surround,
+        "bass_ext": not power,
+        "clearvoice": power,
+    }
+    frame = status_frame(**state)
+    assert is_status_frame(frame)
+    assert dict(decode_status(frame)) == state
+    assert decode_status(memoryview(frame)) == state
+
+
+def test_status_equal_reports_share_record():
+    assert decode_status(status_frame(volume=12)) is decode_status(status_frame(volume=12))
+    assert decode_status(status_frame(volume=12)) != decode_status(status_frame(volume=13))
+
+
+def test_is_status_frame():
+    assert not is_status_frame(VOLUME_UP)
+    assert not is_status_frame(STATUS[:-2])
+
+
+def test_decoder_single_frame():
+    decoder = FrameDecoder()
+    assert decode_all(decoder, STATUS) == [STATUS]
+    assert decoder.discarded_bytes == 0
+    assert decoder.checksum_errors == 0
+
+
+def test_decoder_split():
+    decoder = FrameDecoder()
+    assert decode_all(decoder, *(STATUS[i:i + 1] for i in range(len(STATUS)))) == [STATUS]
+    assert decode_all(decoder, STATUS[:2], STATUS[2:3], STATUS[3:]) == [STATUS]
+
+
+def test_decoder_coalesced():
+    frames = [STATUS, VOLUME_UP, status_frame(volume=11)]
+    assert decode_all(FrameDecoder(), b"".join(frames)) == frames
+
+
+def test_decoder_garbage():
+    decoder = FrameDecoder()
+    garbage = b"\x00\xff\xcc\x12\xaa"
+    assert decode_all(decoder, garbage + STATUS + garbage + VOLUME_UP + b"\xcc") == [STATUS, VOLUME_UP]
+    assert decoder.discarded_bytes == 2 * len(garbage)
+    # The trailing 0xcc may start the next header.
+    assert decode_all(decoder, STATUS[1:]) == [STATUS]
+
+
+def test_decoder_bad_checksum():
+    decoder = FrameDecoder()
+    corrupt = STATUS[:-1] + bytes([STATUS[-1] ^ 0xff])
+    assert decode_all(decoder, corrupt + STATUS) == [STATUS]
+    assert decoder.checksum_errors == 1
+
+
+def test_decoder_bogus_length():
+    decoder = FrameDecoder()
+    assert decode_all(decoder, b"\xcc\xaa\xff" + STATUS) == [STATUS]
+    assert decode_all(decoder, b"\xcc\xaa\xff", STATUS[:5], STATUS[5:]) == [STATUS]
+
+
+def test_decoder_long_frame_waits():
+    frame = encode(bytes(range(200)))
+    decoder = FrameDecoder()
+    assert decode_all(decoder, *(frame[i:i + 7] for i in range(0, len(frame), 7))) == [frame]
+
+
+def test_decoder_fuzz():
+    rng = random.Random(20)
+    frames = [status_frame(volume=volume) for volume in range(VOLUME_MAX + 1)]
+    decoder = FrameDecoder()
+    received = []
+    for frame in frames:
+        noise = bytes(rng.choice((0x00, 0xcc, 0xaa, 0xff, rng.randrange(256))) for _ in range(rng.randrange(8)))
+        # Noise must not end in a header, that would claim the start of the frame.
+        data = noise.rstrip(b"\xcc") + frame
+        cuts = sorted(rng.sample(range(1, len(data)), 3))
+        received += decode_all(decoder, *(data[a:b] for a, b in zip([0] + cuts, cuts + [len(data)])))
+    assert received == frames
@@ -0,0 +1,172 @@
+"""Tests of the command scheduler."""
+import asyncio
+
+import pytest
+
+from yamaha_bt.commands import CommandScheduler
+
+DEBOUNCE = 0.05
+MAX_DELAY = 0.2
+
+
+class FakeSoundBar:
+    def __init__(self, volume=10):
+        self.state = {"volume": volume}
+        self.sent = []
+        self.status_requests = 0
+        self.reconnects = 0
+
+    async def _send_command(self, command):
+        self.sent.append((asyncio.get_running_loop().time(), command))
+
+    async def request_status(self):
+        self.status_requests += 1
+        return {**self.state, "request": self.status_requests}
+
+    async def reconnect(self):
+        self.reconnects += 1
+
+    @property
+    def commands(self):
+        return [command for _sent_at, command in self.sent]
+
+
+def run(test, soundbar=None):
+    async def main():
+        bar = soundbar or FakeSoundBar()
+        scheduler = CommandScheduler(bar, "up", "down", debounce=DEBOUNCE, max_delay=MAX_DELAY)
+        await test(scheduler, bar)
+
+    asyncio.run(main())
+
+
+def test_burst_is_debounced():
+    async def test(scheduler, bar):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        first = asyncio.ensure_future(scheduler.set("input", "hdmi"))
+        await asyncio.sleep(DEBOUNCE / 2)
+        second = asyncio.ensure_future(scheduler.set("input", "tv"))
+        third = asyncio.ensure_future(scheduler.toggle("standby"))
+        states = await asyncio.gather(first, second, third)
+
+        # Only the last input is sent, once the burst was quiet for the debounce.
+        assert bar.commands == ["tv", "standby"]
+        assert bar.sent[0][0] - start >= DEBOUNCE * 1.5
+        assert bar.status_requests == 1
+        assert states == [{"volume": 10, "request": 1}] * 3
+        assert scheduler.submitted == 3
+        assert scheduler.sent == 2
+        assert scheduler.latency.count == 3
+
+    run(test)
+
+
+def test_max_delay():
+    async def test(scheduler, bar):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        commands = []
+        # Keep the burst busy for longer than the max delay.
+        while loop.time() - start < MAX_DELAY * 1.5:
+            commands.append(asyncio.ensure_future(scheduler.toggle("standby")))
+            await asyncio.sleep(DEBOUNCE / 2)
+        await asyncio.gather(*commands)
+
+        assert MAX_DELAY <= bar.sent[0][0] - start < MAX_DELAY + DEBOUNCE
+        # The commands submitted after the first burst was sent form a second one.
+        assert bar.status_requests == 2
+        assert len(bar.sent) == len(commands)
+
+    run(test)
+
+
+def test_separate_bursts():
+    async def test(scheduler, bar):
+        await scheduler.set("mute", "mute_on")
+        await scheduler.set("mute", "mute_off")
+        assert bar.commands == ["mute_on", "mute_off"]
+        assert bar.status_requests == 2
+
+    run(test)
+
+
+def test_setting_order():
+    async def test(scheduler, bar):
+        await asyncio.gather(
+            scheduler.set("power_off", "off"),
+            scheduler.set("mute", "mute_on"),
+            scheduler.toggle("standby"),
+            scheduler.step_volume(2),
+            scheduler.set("input", "tv"),
+        )
+        # Power off goes last, the other settings in SETTING_ORDER first.
+        assert bar.commands == ["tv", "mute_on", "up", "up", "standby", "off"]
+
+    run(test)
+
+
+@pytest.mark.parametrize(
+    "steps, expected",
+    [
+        ((1, 1, -1), ["up"]),
+        ((1, -1), []),
+        ((-2,), ["down", "down"]),
+    ],
+)
+def test_volume_steps_are_summed(steps, expected):
+    async def test(scheduler, bar):
+        await asyncio.gather(*(scheduler.step_volume(step) for step in steps))
+        assert bar.commands == expected
+        assert bar.status_requests == 1
+
+    run(test)
+
+
+def test_volume_target():
+    async def test(scheduler, bar):
+        await asyncio.gather(
+            scheduler.step_volume(5),
+            scheduler.set_volume(13),
+            scheduler.step_volume(-1),
+        )
+        # The target replaces the earlier steps, later steps move the target.
+        assert bar.commands == ["up", "up"]
+        assert scheduler.volume_target == 12
+
+    run(test, FakeSoundBar(volume=10))
+
+
+def test_volume_target_unknown_volume():
+    async def test(scheduler, bar):
+        await scheduler.set_volume(13)
+        assert bar.commands == []
+        assert bar.status_requests == 1
+
+    run(test, FakeSoundBar(volume=None))
+
+
+def test_power_off_reconnects():
+    async def test(scheduler, bar):
+        state = await asyncio.gather(scheduler.set("power_on", "on"), scheduler.set("power_off", "off"))
+        # Power off replaces power on, the link drops so no status is requested.
+        assert bar.commands == ["off"]
+        assert state == [None, None]
+        assert bar.reconnects == 1
+        assert bar.status_requests == 0
+
+    run(test)
+
+
+def test_failed_burst():
+    class BrokenSoundBar(FakeSoundBar):
+        async def _send_command(self, command):
+            raise ConnectionError("Soundbar disconnected")
+
+    async def test(scheduler, bar):
+        with pytest.raises(ConnectionError):
+            await scheduler.set("mute", "mute_on")
+        assert not scheduler.pending
+        assert bar.status_requests == 0
+
+    run(test, BrokenSoundBar())
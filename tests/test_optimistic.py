@@ -0,0 +1,62 @@
+"""Tests of the optimistic state publishing."""
+import asyncio
+from types import SimpleNamespace
+
+from tests.helpers import connected_soundbar
+from yamaha_bt.optimistic import OptimisticState
+
+LATENCY = 0.1
+
+
+class FakeMQTT:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, topic, payload, qos, retain):
+        self.published.append((topic, payload))
+
+
+class FakeEntity:
+    discovery_msg = {"state_topic": "input/state"}
+
+    def __init__(self):
+        self.updates = 0
+
+    async def update(self):
+        self.updates += 1
+
+
+def make_optimistic():
+    device = SimpleNamespace(loop=asyncio.get_running_loop(), mqtt=FakeMQTT(), name="test")
+    return OptimisticState(device, enabled=True)
+
+
+def test_heartbeat_reply_during_command_is_no_mismatch():
+    async def run():
+        async with connected_soundbar(latency=LATENCY) as (_simulator, soundbar):
+            optimistic = make_optimistic()
+            entity = FakeEntity()
+            # The reply to this poll still says hdmi and arrives while the command is in flight.
+            await soundbar.report_status()
+            optimistic.send(entity, "input", "tv", "TV", soundbar.set_input("tv"))
+            await asyncio.sleep(5 * LATENCY)
+            assert optimistic.device.mqtt.published == [("input/state", "TV")]
+            assert optimistic.mismatches == 0
+            assert entity.updates == 0
+
+    asyncio.run(run())
+
+
+def test_ignored_command_is_corrected():
+    async def run():
+        async with connected_soundbar(latency=LATENCY) as (simulator, soundbar):
+            optimistic = make_optimistic()
+            entity = FakeEntity()
+            # In standby the soundbar ignores everything but power commands.
+            simulator.power = False
+            optimistic.send(entity, "input", "tv", "TV", soundbar.set_input("tv"))
+            await asyncio.sleep(5 * LATENCY)
+            assert optimistic.mismatches == 1
+            assert entity.updates == 1
+
+    asyncio.run(run())
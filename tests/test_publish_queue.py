@@ -0,0 +1,189 @@
+"""Tests of the outbound publish queue."""
+import asyncio
+
+from yamaha_bt.publish_queue import PublishQueue
+
+
+class FakeSend:
+    def __init__(self, accept=True):
+        self.accept = accept
+        self.sent = []
+
+    def __call__(self, topic, payload, qos, retain):
+        self.sent.append((topic, payload))
+        return self.accept
+
+    @property
+    def topics(self):
+        return [topic for topic, _payload in self.sent]
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def run(test, **queue_args):
+    async def main():
+        send = FakeSend(queue_args.pop("accept", True))
+        queue = PublishQueue(send, **queue_args)
+        queue.start()
+        try:
+            await test(queue, send)
+        finally:
+            queue.stop()
+
+    asyncio.run(main())
+
+
+def test_nothing_sent_before_resume():
+    async def test(queue, send):
+        await queue.put("a", "1", 0, False)
+        await settle()
+        assert send.sent == []
+        assert queue.depth == 1
+
+        queue.resume()
+        await asyncio.wait_for(queue.join(), 1)
+        assert send.sent == [("a", "1")]
+        assert queue.sent == 1
+        assert queue.depth == 0
+
+    run(test, accept=False)
+
+
+def test_hold_and_resume():
+    async def test(queue, send):
+        queue.resume()
+        queue.hold()
+        await queue.put("a", "1", 0, False)
+        await settle()
+        assert send.sent == []
+        # Held is not offline, a flush waits for the messages.
+        join = asyncio.ensure_future(queue.join())
+        await settle()
+        assert not join.done()
+
+        queue.resume()
+        await asyncio.wait_for(join, 1)
+        assert send.sent == [("a", "1")]
+
+    run(test, accept=False)
+
+
+def test_pause_releases_join():
+    async def test(queue, send):
+        queue.resume()
+        queue.hold()
+        await queue.put("a", "1", 0, False)
+        join = asyncio.ensure_future(queue.join())
+        await settle()
+        assert not join.done()
+
+        queue.pause()
+        await asyncio.wait_for(join, 1)
+        assert send.sent == []
+        assert queue.depth == 1
+
+    run(test, accept=False)
+
+
+def test_drop_oldest_while_offline():
+    async def test(queue, send):
+        for index in range(5):
+            await asyncio.wait_for(queue.put(f"topic/{index}", str(index), 0, False), 1)
+        assert queue.depth == 3
+        assert queue.dropped == 2
+
+        queue.resume()
+        await asyncio.wait_for(queue.join(), 1)
+        assert send.topics == ["topic/2", "topic/3", "topic/4"]
+
+    run(test, maxsize=3, accept=False)
+
+
+def test_full_queue_waits_while_online():
+    async def test(queue, send):
+        queue.resume()
+        queue.hold()
+        for index in range(2):
+            await queue.put(f"topic/{index}", str(index), 0, False)
+        put = asyncio.ensure_future(queue.put("topic/2", "2", 0, False))
+        await settle()
+        assert not put.done()
+
+        queue.resume()
+        await asyncio.wait_for(put, 1)
+        await asyncio.wait_for(queue.join(), 1)
+        assert queue.dropped == 0
+        assert send.topics == ["topic/0", "topic/1", "topic/2"]
+
+    run(test, maxsize=2, accept=False)
+
+
+def test_retained_coalesced_by_topic():
+    async def test(queue, send):
+        await queue.put("volume", "1", 0, True)
+        await queue.put("event", "a", 0, False)
+        await queue.put("volume", "2", 0, True)
+        await queue.put("event", "b", 0, False)
+        await queue.put("volume", "3", 0, True)
+        assert queue.depth == 3
+        assert queue.coalesced == 2
+
+        queue.resume()
+        await asyncio.wait_for(queue.join(), 1)
+        # The retained message keeps its place, with the newest payload.
+        assert send.sent == [("volume", "3"), ("event", "a"), ("event", "b")]
+
+    run(test, accept=False)
+
+
+def test_inflight_limit():
+    async def test(queue, send):
+        for index in range(5):
+            await queue.put(f"topic/{index}", str(index), 1, False)
+        queue.resume()
+        await settle()
+        assert send.topics == ["topic/0", "topic/1"]
+        assert queue.inflight == 2
+
+        queue.ack()
+        await settle()
+        assert send.topics == ["topic/0", "topic/1", "topic/2"]
+
+        # A new connection forgets what the old one never acknowledged.
+        queue.clear_inflight()
+        await asyncio.wait_for(queue.join(), 1)
+        assert send.topics == [f"topic/{index}" for index in range(5)]
+        assert queue.inflight == 2
+
+    run(test, max_inflight=2)
+
+
+def test_refused_messages_are_not_inflight():
+    async def test(queue, send):
+        queue.resume()
+        for index in range(5):
+            await queue.put(f"topic/{index}", str(index), 0, False)
+        await asyncio.wait_for(queue.join(), 1)
+        assert len(send.sent) == 5
+        assert queue.inflight == 0
+
+    run(test, max_inflight=2, accept=False)
+
+
+def test_batches_yield_to_the_loop():
+    async def test(queue, send):
+        for index in range(10):
+            await queue.put(f"topic/{index}", str(index), 0, False)
+        queue.resume()
+        # Whatever else runs on the loop only ever sees whole batches sent.
+        seen = set()
+        while len(send.sent) < 10:
+            seen.add(len(send.sent))
+            await asyncio.sleep(0)
+        assert seen <= {0, 4, 8}
+        assert 4 in seen
+
+    run(test, batch_size=4, accept=False)
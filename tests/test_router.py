@@ -0,0 +1,112 @@
+"""Tests of the topic router."""
+import asyncio
+
+import pytest
+
+from yamaha_bt.router import TopicRouter
+
+
+def handler(name):
+    def handle(topic, payload):
+        pass
+
+    handle.__name__ = name
+    return handle
+
+
+EXACT = handler("exact")
+SINGLE = handler("single")
+MULTI = handler("multi")
+ROOT = handler("root")
+
+
+@pytest.fixture
+def router():
+    router = TopicRouter()
+    router.add("home/bar/volume/set", EXACT)
+    router.add("home/+/volume/set", SINGLE)
+    router.add("home/#", MULTI)
+    router.add("#", ROOT)
+    return router
+
+
+@pytest.mark.parametrize(
+    "topic, expected",
+    [
+        ("home/bar/volume/set", [EXACT, SINGLE, MULTI, ROOT]),
+        ("home/other/volume/set", [SINGLE, MULTI, ROOT]),
+        ("home/bar/volume", [MULTI, ROOT]),
+        ("home/bar/volume/set/extra", [MULTI, ROOT]),
+        ("home", [MULTI, ROOT]),
+        ("other/bar/volume/set", [ROOT]),
+    ],
+)
+def test_match(router, topic, expected):
+    assert sorted(router.match(topic), key=id) == sorted(expected, key=id)
+
+
+def test_single_level_wildcard_matches_one_level():
+    router = TopicRouter()
+    router.add("home/+", SINGLE)
+    assert router.match("home/bar") == [SINGLE]
+    assert router.match("home/bar/volume") == []
+    assert router.match("home") == []
+
+
+def test_add_twice(router):
+    assert len(router) == 4
+    assert not router.add("home/bar/volume/set", EXACT)
+    assert not router.add("home/#", MULTI)
+    assert router.add("home/bar/volume/set", SINGLE)
+    assert len(router) == 5
+
+
+def test_remove(router):
+    assert router.remove("home/bar/volume/set", EXACT)
+    assert router.remove("home/+/volume/set", SINGLE)
+    assert sorted(router.match("home/bar/volume/set"), key=id) == sorted([MULTI, ROOT], key=id)
+    assert len(router) == 2
+
+
+def test_remove_unknown(router):
+    assert not router.remove("home/bar/volume/set", SINGLE)
+    assert not router.remove("home/bar/power/set", EXACT)
+    assert not router.remove("home/+/power/set", SINGLE)
+    assert not router.remove("home/+/volume/set", MULTI)
+    assert not router.remove("home/+", SINGLE)
+    assert len(router) == 4
+
+
+def test_remove_prunes_empty_levels():
+    router = TopicRouter()
+    router.add("home/+/volume/set", SINGLE)
+    router.remove("home/+/volume/set", SINGLE)
+    assert not router._wildcards.children
+    assert not router.remove("home/+/volume/set", SINGLE)
+
+
+def test_dispatch():
+    received = []
+
+    async def handle_async(topic, payload):
+        await asyncio.sleep(0)
+        received.append(("async", topic, payload))
+
+    def handle_broken(topic, payload):
+        raise RuntimeError("broken handler")
+
+    async def run():
+        router = TopicRouter()
+        router.add("home/+/set", handle_broken)
+        router.add("home/+/set", lambda topic, payload: received.append(("sync", topic, payload)))
+        router.add("home/#", handle_async)
+        router.dispatch("home/bar/set", "ON")
+        # Plain handlers run inline, a broken one does not stop the others.
+        assert received == [("sync", "home/bar/set", "ON")]
+        assert len(router._tasks) == 1
+        await asyncio.gather(*router._tasks)
+        await asyncio.sleep(0)
+        assert not router._tasks
+
+    asyncio.run(run())
+    assert received == [("sync", "home/bar/set", "ON"), ("async", "home/bar/set", "ON")]
@@ -0,0 +1,75 @@
+"""Tests of the soundbar link against the simulator."""
+import asyncio
+
+import pytest
+
+from tests.helpers import connected_soundbar
+
+LATENCY = 0.1
+
+
+def test_status_replies_answer_their_own_request():
+    async def run():
+        async with connected_soundbar(latency=LATENCY) as (simulator, soundbar):
+            first = asyncio.create_task(soundbar.request_status())
+            await asyncio.sleep(LATENCY / 4)
+            simulator.volume = 20
+            second = asyncio.create_task(soundbar.request_status())
+            await asyncio.sleep(LATENCY / 4)
+            simulator.volume = 30
+            third = asyncio.create_task(soundbar.request_status())
+            states = await asyncio.gather(first, second, third)
+            assert [state["volume"] for state in states] == [10, 20, 30]
+
+    asyncio.run(run())
+
+
+def test_command_not_confirmed_by_earlier_poll():
+    async def run():
+        async with connected_soundbar(latency=LATENCY) as (simulator, soundbar):
+            # A heartbeat poll is in flight while the command is sent.
+            await soundbar.report_status()
+            state = await soundbar.set_input("tv")
+            assert state["input"] == "tv"
+            assert simulator.input == "tv"
+
+    asyncio.run(run())
+
+
+def test_request_status_fails_when_link_drops():
+    async def run():
+        async with connected_soundbar(latency=LATENCY) as (_simulator, soundbar):
+            request = asyncio.create_task(soundbar.request_status())
+            await asyncio.sleep(LATENCY / 4)
+            await soundbar.reconnect()
+            with pytest.raises(ConnectionError):
+                await request
+
+    asyncio.run(run())
+
+
+def test_set_volume_with_poll_in_flight():
+    async def run():
+        async with connected_soundbar(latency=LATENCY) as (simulator, soundbar):
+            await soundbar.report_status()
+            state = await soundbar.set_volume(30)
+            assert state["volume"] == 30
+            # Wait for the replies of any extra burst.
+            await asyncio.sleep(3 * LATENCY)
+            assert simulator.volume == 30
+
+    asyncio.run(run())
+
+
+def test_set_volume_stops_when_moving_away():
+    async def run():
+        async with connected_soundbar(latency=LATENCY) as (simulator, soundbar):
+            apply = simulator.apply
+            swapped = {"volume_up": "volume_down", "volume_down": "volume_up"}
+            simulator.apply = lambda name: apply(swapped.get(name, name))
+            state = await soundbar.set_volume(15)
+            # One burst turned it down, correcting again would turn it down further.
+            assert state["volume"] == 5
+            assert simulator.volume == 5
+
+    asyncio.run(run())
@@ -1,4 +1,4 @@
-from yamaha_bt.device import Device
+from yamaha_bt.device import Bridge
 import anyio
 import logging
 import argparse
@@ -24,8 +24,8 @@ def install_service():
     # subprocess.call(['sudo', 'systemctl', 'start', 'yamaha_bt'])
 
 async def run():
-    device = Device()
-    await device.run()
+    bridge = Bridge()
+    await bridge.run()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,40 @@
+"""Availability Module."""
+import logging
+
+from yamaha_bt.const import DEFAULT_QOS, PAYLOAD_AVAILABLE, PAYLOAD_NOT_AVAILABLE
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class AvailabilityManager:
+    """Publish the device availability topic when the soundbar connection changes."""
+
+    def __init__(self, device):
+        """Initialize the availability manager."""
+        self.device = device
+        self.topic = device.availability_topic
+        self.available = None
+
+    async def set_available(self, available: bool, force: bool = False):
+        """Publish the availability if it differs from the last published value."""
+        if available == self.available and not force:
+            return
+        self.available = available
+
+        payload = PAYLOAD_AVAILABLE if available else PAYLOAD_NOT_AVAILABLE
+        _LOGGER.info("%s is %s", self.device.name, payload)
+        await self.device.mqtt.publish(self.topic, payload, DEFAULT_QOS, True)
+
+    async def publish_current(self):
+        """Publish the current availability unconditionally.
+
+        Called after every broker connect, as the retained last will may have
+        replaced our last message while we were away.
+        """
+        await self.set_available(self.device.yam.connected, force=True)
+
+
+async def publish_bridge_available(mqtt, topic: str, available: bool):
+    """Publish the availability of the bridge on ``topic``, the counterpart of its last will."""
+    payload = PAYLOAD_AVAILABLE if available else PAYLOAD_NOT_AVAILABLE
+    await mqtt.publish(topic, payload, DEFAULT_QOS, True)
@@ -0,0 +1,30 @@
+"""Backoff Module."""
+import random
+
+
+class Backoff:
+    """Exponential backoff with jitter, bounded by ``maximum`` seconds."""
+
+    def __init__(self, initial: float, maximum: float, factor: float = 2.0, jitter: float = 0.2):
+        """Initialize the backoff policy.
+
+        Each delay is randomized by up to ``jitter`` (as a fraction) so that
+        many clients retrying at once spread out.
+        """
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = 0
+
+    def reset(self):
+        """Start over from the initial delay."""
+        self.attempts = 0
+
+    def next(self) -> float:
+        """Return the delay before the next attempt."""
+        delay = min(self.initial * self.factor**self.attempts, self.maximum)
+        self.attempts += 1
+        if self.jitter:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return min(delay, self.maximum)
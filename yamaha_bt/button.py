@@ -1,5 +1,5 @@
 """Sensor Module."""
-from yamaha_bt.const import DEVICE_INFO, BASE_TOPIC, DEFAULT_QOS, DEVICE_UNIQUE_ID
+from yamaha_bt.const import DEFAULT_QOS
 from yamaha_bt.util import slugify
 from yamaha_bt.entity import Entity
 import json
@@ -9,36 +9,28 @@ import asyncio
 LOGGER = logging.getLogger(__name__)
 
 class ButtonEntity(Entity):
+    component = "button"
+
     async def register(self):
         self.discovery_msg.update({
-            "command_topic": f"{BASE_TOPIC}{self.unique_id}/command",
+            "command_topic": f"{self.device.base_topic}{self.unique_id}/command",
         })
-        
-        
-        discovery_topic = f"homeassistant/button/{self.unique_id}/config"
-        await self.device.mqtt.publish(
-            discovery_topic, json.dumps(self.discovery_msg), DEFAULT_QOS, True
-        )
+        await self.device.discovery.publish(self.discovery_topic, self.discovery_msg)
 
-        self.device.mqtt.add_msg_listner(self._handle_message)
-        await self.device.mqtt.perform_subscription(
-            self.discovery_msg["command_topic"], DEFAULT_QOS
+        self.device.mqtt.add_msg_listner(
+            self._handle_message, self.discovery_msg["command_topic"]
         )
-
-        await self.send_availability()
-
         await self.update()
     
     
     def _handle_message(self, topic, payload):
-        if topic == self.discovery_msg["command_topic"]:
-            return self.handle_command(payload)
+        return self.handle_command(payload)
     
     def handle_command(self, payload):
         return 
     
     async def update(self):
-        await self.send_availability()
+        return
 
 class VolumeUpButton(ButtonEntity):
 
@@ -0,0 +1,287 @@
+"""Codec Module.
+
+The wire protocol of the soundbar: ``cc aa <len> <payload> <csum>`` frames,
+the command table and the status report layout.
+"""
+from collections.abc import Mapping
+import struct
+
+# Mapping of input values to names
+INPUT_NAMES = {
+    0x0: 'hdmi',
+    0xc: 'analog',
+    0x5: 'bluetooth',
+    0x7: 'tv',
+}
+
+# Mapping of surround values to names
+SURROUND_NAMES = {
+    0x0d: '3d',
+    0x0a: 'tv',
+    0x0100: 'stereo',
+    0x03: 'movie',
+    0x08: 'music',
+    0x09: 'sports',
+    0x0c: 'game',
+}
+
+COMMANDS = {
+    # power management
+    'power_toggle': "4078cc",
+    'power_on': "40787e",
+    'power_off': "40787f",
+
+    # input management
+    'set_input_hdmi': "40784a",
+    'set_input_analog': "4078d1",
+    'set_input_bluetooth': "407829",
+    'set_input_tv': "4078df",
+
+    # surround management
+    'set_surround_3d': "4078c9", # -- 3d surround
+    'set_surround_tv': "407ef1", # -- tv program
+    'set_surround_stereo': "407850",
+    'set_surround_movie': "4078d9",
+    'set_surround_music': "4078da",
+    'set_surround_sports': "4078db",
+    'set_surround_game': "4078dc",
+    'surround_toggle': "4078b4", # -- sets surround to `:movie` (or `:"3d"` if already `:movie`)
+    'clearvoice_toggle': "40785c",
+    'clearvoice_on': "407e80",
+    'clearvoice_off': "407e82",
+    'bass_ext_toggle': "40788b",
+    'bass_ext_on': "40786e",
+    'bass_ext_off': "40786f",
+
+    # volume management
+    'subwoofer_up': "40784c",
+    'subwoofer_down': "40784d",
+    'mute_toggle': "40789c",
+    'mute_on': "407ea2",
+    'mute_off': "407ea3",
+    'volume_up': "40781e",
+    'volume_down': "40781f",
+
+    # extra -- IR -- don't use?
+    'bluetooth_standby_toggle': "407834",
+    'dimmer': "4078ba",
+
+    # status report (query, soundbar returns a message)
+    'report_status': "0305"
+}
+
+FRAME_HEADER = b"\xcc\xaa"
+# <ccaa><length> ... <checksum>
+FRAME_OVERHEAD = 4
+
+# Status replies carry a 13 byte payload starting with 0x05
+STATUS_REPLY_TYPE = 0x05
+STATUS_FRAME_LENGTH = 13 + FRAME_OVERHEAD
+MAX_PAYLOAD = 0xff
+
+# <type> <?> <power> <input> <mute> <volume> <subwoofer> <?> <?> <?> <surround:2> <flags>
+STATUS_LAYOUT = struct.Struct(">xxBBBBBxxxHB")
+BASS_EXT_FLAG = 0x20
+CLEARVOICE_FLAG = 0x04
+# Highest volume the soundbar reports, each volume_up/volume_down moves it by one
+VOLUME_MAX = 50
+# Distinct status payloads remembered so repeated replies decode to the same record
+STATUS_CACHE_SIZE = 256
+
+
+def csum(len, pload):
+    return -(len + sum(pload)) & 0xff
+
+def encode_payload(pload) -> bytes:
+    """Frame a payload given as bytes, bytearray, memoryview or a list of ints."""
+    pload = bytes(pload)
+    if len(pload) > MAX_PAYLOAD:
+        raise ValueError(f"Payload of {len(pload)} bytes does not fit in a frame")
+    return FRAME_HEADER + bytes([len(pload)]) + pload + bytes([csum(len(pload), pload)])
+
+def encode(packet) -> bytes:
+    """Frame ``packet``, a hex string or a bytes-like payload."""
+    if isinstance(packet, str):
+        frame = COMMAND_FRAMES.get(packet)
+        if frame is not None:
+            return frame
+        return encode_payload(bytes.fromhex(packet))
+    return encode_payload(packet)
+
+
+def is_status_frame(frame) -> bool:
+    """Return True if ``frame`` is a device status report."""
+    return len(frame) >= STATUS_FRAME_LENGTH and frame[3] == STATUS_REPLY_TYPE
+
+
+class DeviceStatus(Mapping):
+    """Decoded status report.
+
+    Behaves like a read-only dict of the fields, records must not be changed
+    because equal reports share one instance.
+    """
+
+    __slots__ = FIELDS = (
+        "power",
+        "input",
+        "mute",
+        "volume",
+        "subwoofer",
+        "surround",
+        "bass_ext",
+        "clearvoice",
+    )
+    KEYS = frozenset(FIELDS)
+
+    def __init__(self, power, input, mute, volume, subwoofer, surround, bass_ext, clearvoice):
+        self.power = power
+        self.input = input
+        self.mute = mute
+        self.volume = volume
+        self.subwoofer = subwoofer
+        self.surround = surround
+        self.bass_ext = bass_ext
+        self.clearvoice = clearvoice
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def _values(self):
+        return tuple(getattr(self, key) for key in self.FIELDS)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, DeviceStatus):
+            return self._values() == other._values()
+        return Mapping.__eq__(self, other)
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        return f"DeviceStatus({dict(self)})"
+
+
+_status_cache = {}
+
+def decode_status(frame) -> DeviceStatus:
+    """Decode a status frame (bytes or memoryview) without copying it."""
+    key = bytes(frame[3:STATUS_FRAME_LENGTH - 1])
+    status = _status_cache.get(key)
+    if status is not None:
+        return status
+
+    power, input_, mute, volume, subwoofer, surround, flags = STATUS_LAYOUT.unpack_from(frame, 3)
+    status = DeviceStatus(
+        power != 0,
+        INPUT_NAMES.get(input_),
+        mute != 0,
+        volume,
+        subwoofer,
+        SURROUND_NAMES.get(surround, surround),
+        bool(flags & BASS_EXT_FLAG),
+        bool(flags & CLEARVOICE_FLAG),
+    )
+    if len(_status_cache) >= STATUS_CACHE_SIZE:
+        _status_cache.clear()
+    _status_cache[key] = status
+    return status
+
+
+class FrameDecoder:
+    """Incremental decoder for the ``cc aa <len> <payload> <csum>`` framing.
+
+    The RFCOMM link does not preserve message boundaries, so a single read can
+    hold several frames or only part of one. Bytes are fed in as they arrive
+    and the unconsumed tail is kept in a rolling buffer until the rest of the
+    frame shows up.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.checksum_errors = 0
+        self.discarded_bytes = 0
+
+    def reset(self):
+        """Drop any partially received frame."""
+        self._buffer.clear()
+
+    def feed(self, data):
+        """Append ``data`` and yield every complete frame with a valid checksum.
+
+        Frames are ``memoryview`` slices of the internal buffer and are only
+        valid until the generator is resumed; copy them if they need to outlive
+        the loop body.
+        """
+        buf = self._buffer
+        buf += data
+        end = len(buf)
+        pos = 0
+        view = memoryview(buf)
+        try:
+            while True:
+                start = buf.find(FRAME_HEADER, pos)
+                if start < 0:
+                    # A trailing 0xcc may be the first half of the next header.
+                    keep = 1 if end and buf[end - 1] == FRAME_HEADER[0] else 0
+                    self.discarded_bytes += max(end - keep - pos, 0)
+                    pos = max(end - keep, pos)
+                    break
+
+                self.discarded_bytes += start - pos
+                pos = start
+                if end - start < 3:
+                    break
+
+                length = buf[start + 2]
+                frame_end = start + length + FRAME_OVERHEAD
+                if frame_end > end:
+                    # A header in line noise may claim up to 255 bytes and would hold
+                    # back every frame behind it. Skip it once a valid frame follows.
+                    if self._frame_follows(buf, view, start + 1, end):
+                        self.discarded_bytes += 1
+                        pos = start + 1
+                        continue
+                    break
+
+                if csum(length, view[start + 3:frame_end - 1]) != buf[frame_end - 1]:
+                    # Not a real frame boundary, resync on the next header.
+                    self.checksum_errors += 1
+                    self.discarded_bytes += 1
+                    pos = start + 1
+                    continue
+
+                frame = view[start:frame_end]
+                pos = frame_end
+                try:
+                    yield frame
+                finally:
+                    frame.release()
+        finally:
+            view.release()
+            del buf[:pos]
+
+    @staticmethod
+    def _frame_follows(buf, view, pos, end) -> bool:
+        """Return True if a complete frame with a valid checksum starts at or after ``pos``."""
+        while True:
+            start = buf.find(FRAME_HEADER, pos)
+            if start < 0 or end - start < 3:
+                return False
+            frame_end = start + buf[start + 2] + FRAME_OVERHEAD
+            if frame_end <= end and csum(buf[start + 2], view[start + 3:frame_end - 1]) == buf[frame_end - 1]:
+                return True
+            pos = start + 1
+
+
+# Every command frame is built once, encode() hands out these bytes.
+COMMAND_FRAMES = {command: encode_payload(bytes.fromhex(command)) for command in COMMANDS.values()}
@@ -0,0 +1,193 @@
+"""Command Scheduler Module."""
+import asyncio
+import logging
+
+from yamaha_bt import tracing
+from yamaha_bt.codec import VOLUME_MAX
+from yamaha_bt.metrics import Histogram
+
+LOGGER = logging.getLogger(__name__)
+
+# Wait this long after the last command before sending the burst
+COMMAND_DEBOUNCE = 0.05
+# but never hold a command back for longer than this
+COMMAND_MAX_DELAY = 0.25
+
+# Settings where only the last requested value matters, in the order they are sent.
+# Power on goes first so the soundbar accepts the rest, power off goes last.
+SETTING_ORDER = ("power_on", "input", "surround", "mute", "bass_ext", "clearvoice")
+POWER_SLOTS = ("power_on", "power_off")
+
+
+class CommandScheduler:
+    """Merge bursts of soundbar commands before they go over the link.
+
+    Settings are keyed by slot so only the last value requested during a
+    burst is sent, volume steps are summed so opposite steps cancel out (an
+    absolute volume becomes the steps from the last known volume) and a
+    single status report is requested once the burst has been sent. Every
+    command of the burst resolves with the state from that report.
+    """
+
+    def __init__(
+        self,
+        soundbar,
+        volume_up: str,
+        volume_down: str,
+        debounce: float = COMMAND_DEBOUNCE,
+        max_delay: float = COMMAND_MAX_DELAY,
+    ):
+        """Initialize the scheduler with the commands used for volume steps."""
+        self.soundbar = soundbar
+        self.volume_up = volume_up
+        self.volume_down = volume_down
+        self.debounce = debounce
+        self.max_delay = max_delay
+
+        self._settings = {}
+        self._volume_steps = 0
+        self._volume_target = None
+        # Absolute volume last asked for, including steps merged into it.
+        # None once plain steps were requested after it.
+        self.volume_target = None
+        self._toggles = []
+        self._waiters = []
+        # Traces of the commands in the pending burst
+        self._traces = []
+        self._first_submit = None
+        self._last_submit = None
+        self._flush_task: asyncio.Task = None
+
+        self.submitted = 0
+        self.sent = 0
+        # Seconds from submitting a command until its state was confirmed
+        self.latency = Histogram()
+
+    @property
+    def pending(self) -> bool:
+        """Return True if commands are waiting to be sent."""
+        return bool(
+            self._settings or self._volume_steps or self._volume_target is not None or self._toggles
+        )
+
+    async def set(self, slot: str, command: str):
+        """Request ``command`` for ``slot``, replacing a pending one.
+
+        Returns the soundbar state confirmed after the burst was sent.
+        """
+        if slot in POWER_SLOTS:
+            # Power on and off are sent at different points, but still replace each other.
+            for power_slot in POWER_SLOTS:
+                self._settings.pop(power_slot, None)
+        self._settings[slot] = command
+        return await self._submit()
+
+    async def step_volume(self, steps: int):
+        """Request ``steps`` volume steps, negative steps turn it down."""
+        if self._volume_target is not None:
+            self._volume_target = min(max(self._volume_target + steps, 0), VOLUME_MAX)
+        else:
+            self._volume_steps += steps
+        self.volume_target = self._volume_target
+        return await self._submit()
+
+    async def set_volume(self, target: int):
+        """Request an absolute volume, replacing pending steps and targets.
+
+        The steps are worked out from the last known volume when the burst
+        is sent.
+        """
+        self._volume_target = self.volume_target = target
+        self._volume_steps = 0
+        return await self._submit()
+
+    async def toggle(self, command: str):
+        """Request a toggle command, these are sent in order and never merged."""
+        self._toggles.append(command)
+        return await self._submit()
+
+    async def _submit(self):
+        """Schedule a flush and wait for the state confirmed after this command's burst."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self.submitted += 1
+        if self._first_submit is None:
+            self._first_submit = now
+        self._last_submit = now
+
+        waiter = loop.create_future()
+        self._waiters.append((waiter, now))
+        traces = tracing.current()
+        if traces:
+            tracing.mark("scheduled")
+            self._traces.extend(traces)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_when_settled())
+        return await waiter
+
+    async def _flush_when_settled(self):
+        """Wait for each burst to settle, then send it."""
+        loop = asyncio.get_running_loop()
+        # Commands submitted while a burst is being sent form the next burst.
+        while self._waiters:
+            while True:
+                now = loop.time()
+                deadline = min(self._last_submit + self.debounce, self._first_submit + self.max_delay)
+                if now >= deadline:
+                    break
+                await asyncio.sleep(deadline - now)
+
+            waiters, self._waiters = self._waiters, []
+            traces, self._traces = self._traces, []
+            self._first_submit = self._last_submit = None
+            # The burst is sent on behalf of every command in it.
+            tracing.activate(traces)
+            tracing.mark("debounced")
+            try:
+                state = await self._flush()
+            except Exception as err:  # pylint: disable=broad-except
+                tracing.finish("failed")
+                for waiter, _submitted in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(err)
+                continue
+            now = loop.time()
+            for waiter, submitted in waiters:
+                self.latency.observe(now - submitted)
+                if not waiter.done():
+                    waiter.set_result(state)
+
+    def _take_burst(self) -> list:
+        """Return the commands of the pending burst and clear it."""
+        settings, self._settings = self._settings, {}
+        steps, self._volume_steps = self._volume_steps, 0
+        target, self._volume_target = self._volume_target, None
+        if target is not None:
+            volume = self.soundbar.state.get("volume")
+            # Without a known volume only the status is read, the caller corrects from it.
+            steps = target - volume if volume is not None else 0
+        toggles, self._toggles = self._toggles, []
+
+        burst = [settings[slot] for slot in SETTING_ORDER if slot in settings]
+        step_command = self.volume_up if steps > 0 else self.volume_down
+        burst.extend([step_command] * abs(steps))
+        burst.extend(toggles)
+        if "power_off" in settings:
+            burst.append(settings["power_off"])
+        return burst
+
+    async def _flush(self):
+        """Send the pending burst and return the state from one status request."""
+        powering_off = "power_off" in self._settings
+        burst = self._take_burst()
+        LOGGER.debug("Sending %d commands", len(burst))
+        for command in burst:
+            await self.soundbar._send_command(command)
+            self.sent += 1
+
+        if powering_off:
+            # The soundbar drops the link when it powers off, reconnect with
+            # backoff so it can be switched on again.
+            await self.soundbar.reconnect()
+            return None
+        return await self.soundbar.request_status()
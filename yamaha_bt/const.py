@@ -1,17 +1,45 @@
-# Define the device name and unique ID
+# Define the device name and unique ID, used when a single soundbar is configured
 DEVICE_NAME = "Kitchen Soundbar"
 DEVICE_UNIQUE_ID = "yas_106_4512321"
+DEVICE_AREA = "Kitchen"
+DEVICE_MODEL = "YAS-106"
 
 DEFAULT_QOS = 0
 
+
+def device_info(unique_id: str, name: str, area: str = None, model: str = DEVICE_MODEL) -> dict:
+    """Return the Home Assistant device info of one soundbar."""
+    info = {
+        "identifiers": [unique_id],
+        "name": name,
+        "model": model,
+        "manufacturer": "Yamaha",
+        "sw_version": "1.0",
+    }
+    if area:
+        info["suggested_area"] = area
+    return info
+
+
+def base_topic(unique_id: str) -> str:
+    """Return the topic prefix of one soundbar."""
+    return f"home/{unique_id}/"
+
+
+def bridge_availability_topic(bridge_id: str) -> str:
+    """Return the availability topic of one bridge process."""
+    return f"{base_topic(bridge_id)}availability"
+
+
 # Define the device info
-DEVICE_INFO = {
-    "identifiers": [DEVICE_UNIQUE_ID],
-    "name": DEVICE_NAME,
-    "model": "YAS-106",
-    "manufacturer": "Yamaha",
-    "suggested_area": "Kitchen",
-    "sw_version": "1.0",
-}
-
-BASE_TOPIC = f"home/{DEVICE_UNIQUE_ID}/"
\ No newline at end of file
+DEVICE_INFO = device_info(DEVICE_UNIQUE_ID, DEVICE_NAME, DEVICE_AREA)
+
+BASE_TOPIC = base_topic(DEVICE_UNIQUE_ID)
+
+# Availability of the bridge process itself, the MQTT last will. Every entity
+# also follows the availability topic of its own soundbar link. Each bridge on
+# a broker needs its own id, or one's last will marks the other's entities
+# unavailable.
+DEFAULT_BRIDGE_ID = "yamaha_bt"
+PAYLOAD_AVAILABLE = "online"
+PAYLOAD_NOT_AVAILABLE = "offline"
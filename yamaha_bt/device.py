@@ -1,11 +1,29 @@
+from yamaha_bt.availability import AvailabilityManager, publish_bridge_available
+from yamaha_bt.discovery import DiscoveryCache
+from yamaha_bt.metrics import MetricsServer, monitor_loop_lag, registry
 from yamaha_bt.mqtt import MQTTClient
+from yamaha_bt.mqtt_asyncio import AsyncioMQTTClient
+from yamaha_bt.optimistic import OptimisticState
+from yamaha_bt.transport import create_transport
+from yamaha_bt import tracing
 from yamaha_bt.yamaha import SoundBar
 import logging
 import json
-from yamaha_bt.const import DEVICE_INFO, DEVICE_NAME, DEVICE_UNIQUE_ID, DEFAULT_QOS, BASE_TOPIC
+from yamaha_bt.const import (
+    DEFAULT_BRIDGE_ID,
+    DEFAULT_QOS,
+    DEVICE_AREA,
+    DEVICE_NAME,
+    DEVICE_UNIQUE_ID,
+    base_topic,
+    bridge_availability_topic,
+    device_info,
+)
 import os
 import asyncio
+from datetime import timedelta
 from yamaha_bt.sensor import VolumeSensor
+from yamaha_bt.number import VolumeNumber
 from yamaha_bt.select import InputSelect, SurroundSelect
 from yamaha_bt.switch import PowerSwitch, MuteSwitch, ClearVoiceSwitch, BassBoostSwitch
 from yamaha_bt.button import VolumeDownButton, VolumeUpButton, ToggleBluetoothStandbyButton
@@ -13,83 +31,378 @@ import anyio
 
 _LOGGER = logging.getLogger(__name__)
 
-MEDIA_PLAYER_ID = "media_player"
-MEDIA_PLAYER_DEVICE_ID = DEVICE_UNIQUE_ID + "_" + MEDIA_PLAYER_ID
-
-# Define the MQTT discovery message
-discovery_msg = {
-    "name": DEVICE_NAME,
-    "unique_id": MEDIA_PLAYER_DEVICE_ID,
-    "state_topic": f"home/{DEVICE_UNIQUE_ID}/{MEDIA_PLAYER_ID}/state",
-    "command_topic": f"home/{DEVICE_UNIQUE_ID}/{MEDIA_PLAYER_ID}/set",
-    "payload_on": "ON",
-    "payload_off": "OFF",
-    "device": DEVICE_INFO,
-    "availability_topic": f"home/{DEVICE_UNIQUE_ID}/{MEDIA_PLAYER_ID}/availability",
-    "payload_available": "online",
-    "payload_not_available": "offline",
-    "json_attributes_topic": f"home/{DEVICE_UNIQUE_ID}/{MEDIA_PLAYER_ID}/attributes",
+MQTT_ENGINES = {
+    "paho": MQTTClient,
+    "asyncio": AsyncioMQTTClient,
 }
 
 class Device:
+    """One soundbar with its entities, sharing the MQTT client of the bridge."""
+
+    def __init__(self, bridge, conf: dict):
+        self.bridge = bridge
+        self.conf = conf
+        self.loop = bridge.loop
+        self.mqtt = bridge.mqtt
+        self.discovery = bridge.discovery
+        self.old_state = {}
+        self.full_resync_interval = bridge.conf["full_resync_interval"]
+        self._last_full_sync = 0.0
+
+        self.name = conf["name"]
+        self.unique_id = conf["unique_id"]
+        self.device_info = device_info(self.unique_id, self.name, conf.get("area"))
+        self.base_topic = base_topic(self.unique_id)
+        self.availability_topic = f"{self.base_topic}availability"
+        self.diagnostics_topic = f"{self.base_topic}diagnostics"
+
+        self.yam = SoundBar(
+            conf["bt_addr"],
+            loop=self.loop,
+            heartbeat_max_interval=timedelta(seconds=bridge.conf["heartbeat_max_interval"]),
+            transport=conf["transport"],
+        )
+        self.yam.state_update_callback = self.state_updated
+
+        self.availability = AvailabilityManager(self)
+        self.yam.connection_callback = self.availability.set_available
+        self.optimistic = OptimisticState(self, bridge.conf["optimistic"])
+
+        self.entities = [
+            VolumeSensor(self),
+            VolumeNumber(self),
+            InputSelect(self),
+            SurroundSelect(self),
+            PowerSwitch(self),
+            MuteSwitch(self),
+            BassBoostSwitch(self),
+            ClearVoiceSwitch(self),
+            VolumeUpButton(self),
+            VolumeDownButton(self),
+            ToggleBluetoothStandbyButton(self),
+        ]
+        self._register_metrics()
+
+    def _register_metrics(self):
+        """Export the soundbar's counters, they are read when a snapshot is taken."""
+        yam = self.yam
+        labels = {"device": self.unique_id}
+        counters = {
+            "yamaha_bt_frames_sent_total": ("Frames written to the soundbar", lambda: yam.frames_sent),
+            "yamaha_bt_frames_received_total": (
+                "Valid frames received from the soundbar", lambda: yam.frames_received
+            ),
+            "yamaha_bt_checksum_errors_total": (
+                "Frames dropped for a bad checksum", lambda: yam.decoder.checksum_errors
+            ),
+            "yamaha_bt_discarded_bytes_total": (
+                "Received bytes that were not part of a frame", lambda: yam.decoder.discarded_bytes
+            ),
+            "yamaha_bt_soundbar_reconnects_total": (
+                "Times the soundbar link was re-established", lambda: yam.reconnects
+            ),
+            "yamaha_bt_missed_polls_total": (
+                "Status requests that went unanswered", lambda: yam.monitor.missed_polls
+            ),
+            "yamaha_bt_polls_skipped_total": (
+                "Heartbeat polls skipped because the soundbar spoke recently",
+                lambda: yam.polls_skipped,
+            ),
+            "yamaha_bt_commands_submitted_total": (
+                "Commands requested over MQTT", lambda: yam.scheduler.submitted
+            ),
+            "yamaha_bt_commands_sent_total": (
+                "Commands sent after merging bursts", lambda: yam.scheduler.sent
+            ),
+        }
+        for name, (help_text, func) in counters.items():
+            registry.counter(name, help_text, func=func, **labels)
+        registry.counter(
+            "yamaha_bt_optimistic_mismatches_total",
+            "Optimistic states the soundbar did not confirm",
+            func=lambda: self.optimistic.mismatches, **labels,
+        )
+        registry.gauge(
+            "yamaha_bt_soundbar_connected", "1 while the soundbar link is up",
+            func=lambda: int(yam.connected), **labels,
+        )
+        # Link health as seen by the link monitor, None (NaN) before the first reply.
+        gauges = {
+            "yamaha_bt_last_rx_age_seconds": (
+                "Seconds since anything was received from the soundbar",
+                lambda: yam.monitor.last_rx_age,
+            ),
+            "yamaha_bt_rtt_p50_seconds": (
+                "Median status round trip time of recent polls", lambda: yam.monitor.rtt_p50
+            ),
+            "yamaha_bt_rtt_p99_seconds": (
+                "99th percentile status round trip time of recent polls",
+                lambda: yam.monitor.rtt_p99,
+            ),
+            "yamaha_bt_rtt_timeout_seconds": (
+                "How long a status request may stay unanswered", lambda: yam.monitor.rtt_timeout
+            ),
+            "yamaha_bt_consecutive_missed_polls": (
+                "Unanswered status requests in a row", lambda: yam.monitor.consecutive_missed
+            ),
+        }
+        for name, (help_text, func) in gauges.items():
+            registry.gauge(name, help_text, func=func, **labels)
+        registry.add_histogram(
+            "yamaha_bt_heartbeat_rtt_seconds", "Status request round trip time",
+            yam.rtt_histogram, **labels,
+        )
+        registry.add_histogram(
+            "yamaha_bt_command_latency_seconds", "Time from a command to its confirmed state",
+            yam.scheduler.latency, **labels,
+        )
+
+    async def publish_metrics(self):
+        """Publish a JSON snapshot of this soundbar's and the bridge's metrics."""
+        snapshot = {
+            "soundbar": registry.snapshot(device=self.unique_id),
+            "bridge": registry.snapshot(device=None),
+        }
+        await self.mqtt.publish(self.diagnostics_topic, json.dumps(snapshot), DEFAULT_QOS, False)
+
+    async def state_updated(self, new_state):
+        old_state = self.old_state
+        self.old_state = new_state
+
+        changed = self._changed_fields(old_state, new_state)
+        if changed is not None and not changed:
+            tracing.finish("state_unchanged")
+            return
+        _LOGGER.debug(f"New State: {new_state}, changed: {changed}")
+
+        for entity in self.entities:
+            if changed is None or changed.intersection(entity.state_fields):
+                asyncio.create_task(entity.update())
+
+    def _changed_fields(self, old_state, new_state):
+        """Return the set of fields that differ, or None if every entity should update."""
+        now = self.loop.time()
+        # Connecting or losing the soundbar affects every entity.
+        if not old_state or not new_state:
+            self._last_full_sync = now
+            return None
+        if self.full_resync_interval and now - self._last_full_sync >= self.full_resync_interval:
+            self._last_full_sync = now
+            return None
+
+        return {
+            key
+            for key in old_state.keys() | new_state.keys()
+            if old_state.get(key) != new_state.get(key)
+        }
+
+    @property
+    def subscriptions(self) -> list:
+        return [topic for entity in self.entities for topic in entity.subscriptions]
+
+    async def register(self):
+        """Publish discovery and state of every entity."""
+        await asyncio.gather(*(entity.register() for entity in self.entities))
+
+
+class Bridge:
+    """Runs every configured soundbar over one MQTT connection and one event loop."""
+
     def __init__(self):
         self.conf = get_config()
         self.loop = asyncio.get_event_loop()
-        self.old_state = {}
+        self.availability_topic = bridge_availability_topic(self.conf["bridge_id"])
 
-        self.mqtt = MQTTClient(
+        self.mqtt = MQTT_ENGINES[self.conf["mqtt_engine"]](
             self,
             self.conf["host"],
             self.conf["port"],
             self.conf["username"],
             self.conf["password"],
+            fallback_brokers=self.conf["fallback_brokers"],
+            will_topic=self.availability_topic,
         )
+        self.discovery = DiscoveryCache(
+            self,
+            path=self.conf["discovery_cache_path"],
+            check_timeout=self.conf["discovery_check_timeout"],
+        )
+        self.devices = [Device(self, conf) for conf in self.conf["soundbars"]]
 
-        self.yam = SoundBar(self.conf["bt_addr"], loop=self.loop)
-        self.yam.state_update_callback = self.state_updated
-
-        self.entities = []
+        # Seconds from broker connect until every entity was registered.
+        self.time_to_ready: float = None
 
         self.shutdown: asyncio.Event = None
-    
+        tracing.tracer.enabled = self.conf["tracing"]
+        self.metrics_server = None
+        if self.conf["metrics_port"]:
+            self.metrics_server = MetricsServer(
+                registry, self.conf["metrics_host"], self.conf["metrics_port"]
+            )
+        self._register_metrics()
+
+    @property
+    def entities(self) -> list:
+        return [entity for device in self.devices for entity in device.entities]
+
+    def _register_metrics(self):
+        mqtt = self.mqtt
+        registry.counter(
+            "yamaha_bt_mqtt_publishes_total", "Messages taken from the outbound queue",
+            func=lambda: mqtt.publishes_sent,
+        )
+        registry.counter(
+            "yamaha_bt_mqtt_publish_drops_total", "Messages refused by the connection or dropped while offline",
+            func=lambda: mqtt.publishes_dropped,
+        )
+        registry.counter(
+            "yamaha_bt_mqtt_publishes_coalesced_total", "Retained messages replaced before sending",
+            func=lambda: mqtt.publishes_coalesced,
+        )
+        registry.counter(
+            "yamaha_bt_mqtt_reconnects_total", "Times the broker connection was re-established",
+            func=lambda: mqtt.reconnects,
+        )
+        registry.gauge(
+            "yamaha_bt_mqtt_time_to_reconnect_seconds", "How long the last broker reconnect took",
+            func=lambda: mqtt.time_to_reconnect,
+        )
+        registry.gauge(
+            "yamaha_bt_mqtt_queue_depth", "Messages waiting in the outbound queue",
+            func=lambda: mqtt.queue_depth,
+        )
+        registry.gauge(
+            "yamaha_bt_mqtt_flush_latency_seconds", "Wait of the oldest message of the last batch",
+            func=lambda: mqtt.flush_latency,
+        )
+        registry.counter(
+            "yamaha_bt_discovery_skipped_total", "Discovery configs not republished because they were unchanged",
+            func=lambda: self.discovery.skipped,
+        )
+        registry.gauge(
+            "yamaha_bt_time_to_ready_seconds", "Seconds from broker connect until every entity was registered",
+            func=lambda: self.time_to_ready,
+        )
+
     async def run(self):
-        """Run the ScreenManager."""
+        """Run the bridge until stop() is called."""
         async def on_connect():
             await self.register()
 
+        self.shutdown = asyncio.Event()
         self.mqtt.on_connect = on_connect
-        await self.yam.connect()
+        await asyncio.gather(*(device.yam.connect() for device in self.devices))
         await self.mqtt.connect()
 
-        self.shutdown = asyncio.Event()
+        tasks = [asyncio.create_task(monitor_loop_lag())]
+        if self.conf["metrics_interval"]:
+            tasks.append(asyncio.create_task(self._publish_metrics()))
+        if tracing.tracer.enabled and self.conf["trace_report_interval"]:
+            tasks.append(asyncio.create_task(self._report_traces()))
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
 
-        self.entities.append(VolumeSensor(self))
-        self.entities.append(InputSelect(self))
-        self.entities.append(SurroundSelect(self))
-        self.entities.append(PowerSwitch(self))
-        self.entities.append(MuteSwitch(self))
-        self.entities.append(BassBoostSwitch(self))
-        self.entities.append(ClearVoiceSwitch(self))
-        self.entities.append(VolumeUpButton(self))
-        self.entities.append(VolumeDownButton(self))
-        self.entities.append(ToggleBluetoothStandbyButton(self))
-        
         await self.shutdown.wait()
+        for task in tasks:
+            task.cancel()
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        if tracing.tracer.enabled:
+            self._log_traces()
+        await publish_bridge_available(self.mqtt, self.availability_topic, False)
+        await self.mqtt.flush()
+        await self.mqtt.disconnect()
+        await asyncio.gather(*(device.yam.close() for device in self.devices))
 
-    
-    async def state_updated(self, new_state):
-        # if new_state == self.old_state:
-        #     return
-        _LOGGER.debug(f"New State: {new_state}")
+    async def _publish_metrics(self):
+        while True:
+            await asyncio.sleep(self.conf["metrics_interval"])
+            await asyncio.gather(*(device.publish_metrics() for device in self.devices))
+
+    async def _report_traces(self):
+        while True:
+            await asyncio.sleep(self.conf["trace_report_interval"])
+            self._log_traces()
+
+    def _log_traces(self):
+        _LOGGER.info(
+            "Command stage latencies over %d traces:\n%s",
+            tracing.tracer.finished,
+            tracing.tracer.summary(),
+        )
+
+    async def stop(self):
+        """Stop running, pending reconnects are cancelled."""
+        if self.shutdown is not None:
+            self.shutdown.set()
 
-        self.old_state = new_state
-        for entity in self.entities:
-            asyncio.create_task(entity.update())
-    
     async def register(self):
-        # Publish the discovery message to Home Assistant
-        for entity in self.entities:
-            await entity.register()
+        start = self.loop.time()
+
+        await self.discovery.check_retained(
+            [entity.discovery_topic for entity in self.entities]
+        )
+        # Publish the discovery message to Home Assistant, the publish queue
+        # sends them together.
+        await asyncio.gather(*(device.register() for device in self.devices))
+        self.discovery.save()
+
+        topics = [
+            (topic, DEFAULT_QOS)
+            for device in self.devices
+            for topic in device.subscriptions
+        ]
+        await self.mqtt.perform_subscriptions(topics)
+        await asyncio.gather(*(device.availability.publish_current() for device in self.devices))
+        await publish_bridge_available(self.mqtt, self.availability_topic, True)
+        await self.mqtt.flush()
+
+        self.time_to_ready = self.loop.time() - start
+        _LOGGER.info(
+            "Registered %d entities of %d soundbars in %.3f seconds",
+            len(self.entities),
+            len(self.devices),
+            self.time_to_ready,
+        )
+
+def parse_brokers(value: str, default_port: int):
+    """Parse a comma separated list of ``host[:port]`` into ``(host, port)`` pairs."""
+    brokers = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _, port = entry.partition(":")
+        brokers.append((host, int(port) if port else default_port))
+    return brokers
+
+def parse_soundbars(value: str):
+    """Parse and validate the JSON list of soundbars."""
+    try:
+        soundbars = json.loads(value)
+    except ValueError as err:
+        raise ValueError(f"SOUNDBARS is not valid JSON: {err}") from err
+    if not isinstance(soundbars, list) or not soundbars:
+        raise ValueError("SOUNDBARS must be a non-empty JSON list.")
+
+    unique_ids = set()
+    for soundbar in soundbars:
+        if not soundbar.get("name") or not soundbar.get("unique_id"):
+            raise ValueError("Every soundbar needs a name and a unique_id.")
+        if soundbar["unique_id"] in unique_ids:
+            raise ValueError(f"Duplicate soundbar unique_id {soundbar['unique_id']}.")
+        unique_ids.add(soundbar["unique_id"])
+
+        soundbar.setdefault("bt_addr", None)
+        if soundbar.get("transport"):
+            soundbar["transport"] = create_transport(soundbar["transport"])
+        elif not soundbar["bt_addr"]:
+            raise ValueError(
+                f"{soundbar['name']}: set bt_addr or transport (BT_ATTR or SOUNDBAR_TRANSPORT)."
+            )
+        else:
+            soundbar["transport"] = None
+    return soundbars
 
 def get_config():
     """Get MQTT config from environment."""
@@ -99,6 +412,38 @@ def get_config():
         "username": os.environ.get("MQTT_USERNAME"),
         "password": os.environ.get("MQTT_PASSWORD"),
         "bt_addr": os.environ.get("BT_ATTR"),
+        # Reach the soundbar another way than RFCOMM to BT_ATTR, e.g.
+        # "tcp://gateway:7000", "unix:///run/soundbar.sock" or "serial:///dev/ttyUSB0?baud=115200".
+        "soundbar_transport": os.environ.get("SOUNDBAR_TRANSPORT"),
+        # JSON list of soundbars, replaces BT_ATTR/SOUNDBAR_TRANSPORT, e.g.
+        # [{"name": "Kitchen Soundbar", "unique_id": "yas_106_4512321", "bt_addr": "...", "area": "Kitchen"},
+        #  {"name": "Bedroom Soundbar", "unique_id": "yas_106_bedroom", "transport": "tcp://gateway:7000"}]
+        "soundbars": os.environ.get("SOUNDBARS"),
+        "mqtt_engine": os.environ.get("MQTT_ENGINE", "paho"),
+        # Id of this bridge process, its availability is published on home/<BRIDGE_ID>/availability.
+        # Bridges sharing a broker need different ids.
+        "bridge_id": os.environ.get("BRIDGE_ID", DEFAULT_BRIDGE_ID),
+        # Brokers tried in order when MQTT_HOST is unreachable, e.g. "backup:1883,10.0.0.2".
+        "fallback_brokers": os.environ.get("MQTT_FALLBACK_HOSTS", ""),
+        # Longest gap between status polls while the soundbar state is stable (seconds).
+        "heartbeat_max_interval": float(os.environ.get("HEARTBEAT_MAX_INTERVAL", 10)),
+        # Optional file to remember published discovery configs across restarts.
+        "discovery_cache_path": os.environ.get("DISCOVERY_CACHE_PATH"),
+        # Seconds to wait for retained discovery configs on connect, 0 skips the check.
+        "discovery_check_timeout": float(os.environ.get("DISCOVERY_CHECK_TIMEOUT", 0.5)),
+        # Republish every entity this often (seconds) even if nothing changed, 0 disables.
+        "full_resync_interval": int(os.environ.get("FULL_RESYNC_INTERVAL", 0)),
+        # Publish the state a switch or select command leads to before the soundbar confirms it.
+        "optimistic": os.environ.get("OPTIMISTIC", "").lower() in ("1", "true", "yes"),
+        # Trace commands from MQTT to the confirmed state publish and log the stage latencies.
+        "tracing": os.environ.get("TRACING", "").lower() in ("1", "true", "yes"),
+        # Log the stage latency histograms this often while tracing (seconds), 0 only at exit.
+        "trace_report_interval": int(os.environ.get("TRACE_REPORT_INTERVAL", 300)),
+        # Publish a metrics snapshot to <base topic>diagnostics this often (seconds), 0 disables.
+        "metrics_interval": int(os.environ.get("METRICS_INTERVAL", 60)),
+        # Serve Prometheus metrics on http://METRICS_HOST:METRICS_PORT/metrics, port 0 disables.
+        "metrics_host": os.environ.get("METRICS_HOST", "127.0.0.1"),
+        "metrics_port": int(os.environ.get("METRICS_PORT", 9106)),
     }
 
     # Validate the configuration
@@ -108,6 +453,24 @@ def get_config():
         raise ValueError("MQTT_USERNAME environment variable is not set.")
     if not mqtt_conf["password"]:
         raise ValueError("MQTT_PASSWORD environment variable is not set.")
+    if mqtt_conf["soundbars"]:
+        mqtt_conf["soundbars"] = parse_soundbars(mqtt_conf["soundbars"])
+    else:
+        mqtt_conf["soundbars"] = parse_soundbars(json.dumps([{
+            "name": DEVICE_NAME,
+            "unique_id": DEVICE_UNIQUE_ID,
+            "area": DEVICE_AREA,
+            "bt_addr": mqtt_conf["bt_addr"],
+            "transport": mqtt_conf["soundbar_transport"],
+        }]))
+    if not mqtt_conf["bridge_id"] or any(char in mqtt_conf["bridge_id"] for char in "/+#"):
+        raise ValueError("BRIDGE_ID must be a non-empty topic level without '/', '+' or '#'.")
+    if mqtt_conf["mqtt_engine"] not in MQTT_ENGINES:
+        raise ValueError(f"MQTT_ENGINE must be one of {', '.join(MQTT_ENGINES)}.")
+
+    mqtt_conf["fallback_brokers"] = parse_brokers(
+        mqtt_conf["fallback_brokers"], mqtt_conf["port"]
+    )
 
     # Additional validation and type conversion can be added as needed
 
@@ -0,0 +1,103 @@
+"""Discovery Cache Module."""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+from yamaha_bt.const import DEFAULT_QOS
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def payload_digest(payload: str) -> str:
+    """Return the content hash of a discovery payload."""
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class DiscoveryCache:
+    """Publish Home Assistant discovery configs only when they are needed.
+
+    Keeps a hash of every config we published, optionally persisted to
+    ``path``. Before registering, :meth:`check_retained` briefly subscribes to
+    our own config topics to learn what the broker still holds; a config is
+    then republished only if the broker's retained copy is missing or differs.
+    If the check is disabled the cached hashes are used instead.
+    """
+
+    def __init__(self, bridge, path: str = None, check_timeout: float = 0.5):
+        """Initialize the cache and load it from ``path`` if it exists."""
+        self.bridge = bridge
+        self.path = path
+        self.check_timeout = check_timeout
+
+        self._hashes = {}
+        self._retained = None
+        self._pending_retained = None
+        self._dirty = False
+        self.skipped = 0
+
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as cache_file:
+                    self._hashes = json.load(cache_file)
+            except (OSError, ValueError) as err:
+                _LOGGER.warning("Ignoring discovery cache %s: %s", path, err)
+
+    async def check_retained(self, topics):
+        """Record which of ``topics`` have a retained copy on the broker."""
+        self._retained = None
+        if not self.check_timeout or not topics:
+            return
+
+        mqtt = self.bridge.mqtt
+        for topic in topics:
+            mqtt.add_msg_listner(self._handle_retained, topic)
+
+        retained = {}
+        self._pending_retained = retained
+        try:
+            result = await mqtt.perform_subscriptions([(topic, DEFAULT_QOS) for topic in topics])
+            if result != 0:
+                _LOGGER.warning("Could not check retained discovery configs: %s", result)
+                return
+            # The broker sends retained messages right after the SUBACK.
+            await asyncio.sleep(self.check_timeout)
+            await mqtt.perform_unsubscriptions(topics)
+        finally:
+            self._pending_retained = None
+        self._retained = retained
+        _LOGGER.debug("Broker holds %d of %d discovery configs", len(retained), len(topics))
+
+    def _handle_retained(self, topic, payload):
+        """Collect a retained config during the check."""
+        if self._pending_retained is not None and payload:
+            self._pending_retained[topic] = payload_digest(payload)
+
+    async def publish(self, topic: str, discovery_msg: dict):
+        """Publish ``discovery_msg`` on ``topic`` unless the broker already has it."""
+        payload = json.dumps(discovery_msg)
+        digest = payload_digest(payload)
+
+        known = self._retained if self._retained is not None else self._hashes
+        if known.get(topic) == digest:
+            self.skipped += 1
+        else:
+            await self.bridge.mqtt.publish(topic, payload, DEFAULT_QOS, True)
+
+        if self._hashes.get(topic) != digest:
+            self._hashes[topic] = digest
+            self._dirty = True
+
+    def save(self):
+        """Write the cache to disk if it changed."""
+        if self.path is None or not self._dirty:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as cache_file:
+                json.dump(self._hashes, cache_file)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except OSError as err:
+            _LOGGER.warning("Unable to write discovery cache %s: %s", self.path, err)
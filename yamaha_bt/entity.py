@@ -1,21 +1,35 @@
-from yamaha_bt.const import BASE_TOPIC, DEFAULT_QOS, DEVICE_UNIQUE_ID, DEVICE_INFO
+from yamaha_bt.const import (
+    PAYLOAD_AVAILABLE,
+    PAYLOAD_NOT_AVAILABLE,
+)
 from yamaha_bt.util import slugify
 import json
 
 class Entity:
+    # Home Assistant component used in the discovery topic.
+    component = None
+    # Soundbar state fields this entity renders, used to skip unchanged updates.
+    state_fields = ()
 
     def __init__(self, device):
         """Init Entity."""
         self.device = device
+        # Available only while both the bridge and this soundbar's link are up.
         self.discovery_msg = {
-            "device": DEVICE_INFO,
-            "availability_topic": f"{BASE_TOPIC}{self.unique_id}/availability",
-            "payload_available": "online",
-            "payload_not_available": "offline",
+            "device": device.device_info,
+            "availability": [
+                {
+                    "topic": topic,
+                    "payload_available": PAYLOAD_AVAILABLE,
+                    "payload_not_available": PAYLOAD_NOT_AVAILABLE,
+                }
+                for topic in (device.bridge.availability_topic, device.availability_topic)
+            ],
+            "availability_mode": "all",
             "name": self.name,
             "icon": self.icon,
             "unique_id": self.unique_id,
-            "state_topic": f"{BASE_TOPIC}{self.unique_id}/state",
+            "state_topic": f"{device.base_topic}{self.unique_id}/state",
         }
 
     
@@ -24,7 +38,7 @@ class Entity:
     
     @property
     def unique_id(self) -> str:
-        return f"{DEVICE_UNIQUE_ID}_{slugify(self.name)}"
+        return f"{self.device.unique_id}_{slugify(self.name)}"
     
     @property
     def name(self) -> str:
@@ -33,20 +47,16 @@ class Entity:
     @property
     def icon(self) -> str:
         return None
+
+    @property
+    def discovery_topic(self) -> str:
+        return f"homeassistant/{self.component}/{self.unique_id}/config"
+
+    @property
+    def subscriptions(self) -> list:
+        """Topics to subscribe to, the device subscribes to all entities at once."""
+        command_topic = self.discovery_msg.get("command_topic")
+        return [command_topic] if command_topic is not None else []
     
     async def update(self) -> str:
         raise NotImplementedError
-    
-    async def send_availability(self, available=None) -> str:
-        # Publish the discovery message to Home Assistant
-        if available is None:
-            available = self.device.yam.connected
-
-        availability_topic = self.discovery_msg["availability_topic"]
-        if available is True:
-            payload = self.discovery_msg["payload_available"]
-        else:
-            payload = self.discovery_msg["payload_not_available"]
-        await self.device.mqtt.publish(
-            availability_topic, payload, DEFAULT_QOS, False
-        )
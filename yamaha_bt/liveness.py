@@ -0,0 +1,141 @@
+"""Link Liveness Module."""
+from collections import deque
+import time
+
+# Number of round trip times kept for statistics
+RTT_HISTORY = 100
+# A status request is missed once it has gone unanswered for this multiple of the p99 RTT,
+RTT_TIMEOUT_MULTIPLIER = 4
+# clamped to these bounds (seconds). The upper bound is used until we have samples.
+MIN_RTT_TIMEOUT = 0.5
+MAX_RTT_TIMEOUT = 5.0
+# The link is declared dead after this many status requests in a row went unanswered
+MISSED_POLLS_LIMIT = 3
+
+
+def percentile(samples, fraction: float):
+    """Return the ``fraction`` percentile of ``samples`` (nearest rank)."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+class LinkMonitor:
+    """Track receive timestamps and round trip times of the soundbar link.
+
+    Every status request is matched with the next status frame to measure
+    the round trip time. The soundbar answers in order, so the frame also
+    answers that request and is handed to whatever was attached to it. A request that stays unanswered for longer than a
+    timeout derived from the observed p99 RTT counts as a missed poll, and
+    the link is considered dead after ``missed_limit`` missed polls in a row
+    or when nothing at all was received for ``max_silence`` seconds.
+    """
+
+    def __init__(self, max_silence: float, missed_limit: int = MISSED_POLLS_LIMIT):
+        """Initialize the monitor."""
+        self.max_silence = max_silence
+        self.missed_limit = missed_limit
+
+        self.round_trips = deque(maxlen=RTT_HISTORY)
+        self._outstanding = deque()
+        self._rtt_p99 = None
+
+        self.last_rx = None
+        self.connected_at = None
+        self.missed_polls = 0
+        self.consecutive_missed = 0
+
+    def reset(self):
+        """Start monitoring a fresh connection, RTT history is kept."""
+        self._outstanding.clear()
+        self.last_rx = None
+        self.connected_at = time.monotonic()
+        self.consecutive_missed = 0
+
+    def request_sent(self, request=None):
+        """Record that a status request was written, ``request`` is returned with its reply."""
+        self._outstanding.append((time.monotonic(), request))
+
+    def received(self):
+        """Record that bytes arrived on the link."""
+        self.last_rx = time.monotonic()
+
+    def status_received(self):
+        """Match a status frame to the oldest outstanding request.
+
+        Returns the RTT and the ``request`` given for it, both None for a
+        frame nobody asked for.
+        """
+        self.consecutive_missed = 0
+        if not self._outstanding:
+            return None, None
+        sent_at, request = self._outstanding.popleft()
+        rtt = time.monotonic() - sent_at
+        self.round_trips.append(rtt)
+        self._rtt_p99 = None
+        return rtt, request
+
+    def expire(self) -> list:
+        """Drop requests that are overdue and return those that were missed."""
+        deadline = time.monotonic() - self.rtt_timeout
+        missed = []
+        while self._outstanding and self._outstanding[0][0] < deadline:
+            missed.append(self._outstanding.popleft()[1])
+        self.missed_polls += len(missed)
+        self.consecutive_missed += len(missed)
+        return missed
+
+    def abandon(self) -> list:
+        """Forget outstanding requests, e.g. because the link was closed, and return them."""
+        abandoned = [request for _sent_at, request in self._outstanding]
+        self._outstanding.clear()
+        return abandoned
+
+    @property
+    def rtt_p50(self):
+        """Return the median round trip time in seconds."""
+        return percentile(self.round_trips, 0.5)
+
+    @property
+    def rtt_p99(self):
+        """Return the 99th percentile round trip time in seconds."""
+        if self._rtt_p99 is None:
+            self._rtt_p99 = percentile(self.round_trips, 0.99)
+        return self._rtt_p99
+
+    @property
+    def rtt_timeout(self) -> float:
+        """Return how long a status request may stay unanswered."""
+        p99 = self.rtt_p99
+        if p99 is None:
+            return MAX_RTT_TIMEOUT
+        return min(max(p99 * RTT_TIMEOUT_MULTIPLIER, MIN_RTT_TIMEOUT), MAX_RTT_TIMEOUT)
+
+    @property
+    def last_rx_age(self):
+        """Return the seconds since anything was received on this connection."""
+        since = self.last_rx if self.last_rx is not None else self.connected_at
+        if since is None:
+            return None
+        return time.monotonic() - since
+
+    def is_dead(self) -> bool:
+        """Return True if the link should be torn down."""
+        if self.consecutive_missed >= self.missed_limit:
+            return True
+        age = self.last_rx_age
+        return age is not None and age > self.max_silence
+
+    def metrics(self) -> dict:
+        """Return link health numbers for diagnostics."""
+        return {
+            "last_rx_age": self.last_rx_age,
+            "rtt_p50": self.rtt_p50,
+            "rtt_p99": self.rtt_p99,
+            "rtt_timeout": self.rtt_timeout,
+            "missed_polls": self.missed_polls,
+            "consecutive_missed": self.consecutive_missed,
+            "outstanding": len(self._outstanding),
+        }
@@ -0,0 +1,280 @@
+"""Metrics Module.
+
+A small registry of counters, gauges and histograms, exported as a JSON
+snapshot (published to MQTT by the bridge) and in the Prometheus text format
+by :class:`MetricsServer`.
+
+Most values already exist as plain attributes on the objects doing the work
+(e.g. ``FrameDecoder.checksum_errors``); those are registered with a ``func``
+and only read when a snapshot is taken, so the hot paths pay nothing extra.
+"""
+import asyncio
+from bisect import bisect_left
+import contextlib
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in seconds, the last bucket is open ended
+DEFAULT_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds a client may take to send its request
+REQUEST_TIMEOUT = 5
+# How often the event loop lag is sampled (seconds)
+LOOP_LAG_INTERVAL = 0.5
+
+
+class Counter:
+    """Monotonic count, either incremented or read from ``func``."""
+
+    __slots__ = ("value", "func")
+
+    def __init__(self, func=None):
+        self.value = 0
+        self.func = func
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get(self):
+        return self.func() if self.func is not None else self.value
+
+
+class Gauge(Counter):
+    """Value that goes up and down, either set or read from ``func``."""
+
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    """Fixed bucket histogram of observed values."""
+
+    __slots__ = ("buckets", "counts", "count", "total")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, fraction: float):
+        """Return the upper bound of the bucket holding the ``fraction`` quantile."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def get(self) -> dict:
+        # JSON has no infinity, a quantile in the open bucket is reported as "inf".
+        p50, p99 = (
+            "inf" if q == float("inf") else q for q in (self.quantile(0.5), self.quantile(0.99))
+        )
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "p50": p50,
+            "p99": p99,
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["inf"], self.counts)),
+        }
+
+
+class _Family:
+    """Metrics sharing a name, one per label set."""
+
+    __slots__ = ("name", "kind", "help", "children")
+
+    def __init__(self, name: str, kind: str, help_text: str):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.children = {}
+
+
+class MetricsRegistry:
+    """Holds every metric by name and labels."""
+
+    def __init__(self):
+        self._families = {}
+
+    def _get(self, kind: str, name: str, help_text: str, labels: dict, create):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = _Family(name, kind, help_text)
+        elif family.kind != kind:
+            raise ValueError(f"Metric {name} is a {family.kind}, not a {kind}")
+        key = tuple(sorted(labels.items()))
+        metric = family.children.get(key)
+        if metric is None:
+            metric = family.children[key] = create()
+        return metric
+
+    def counter(self, name: str, help_text: str, func=None, **labels) -> Counter:
+        """Return the counter ``name`` with ``labels``, creating it if needed."""
+        metric = self._get("counter", name, help_text, labels, Counter)
+        if func is not None:
+            metric.func = func
+        return metric
+
+    def gauge(self, name: str, help_text: str, func=None, **labels) -> Gauge:
+        """Return the gauge ``name`` with ``labels``, creating it if needed."""
+        metric = self._get("gauge", name, help_text, labels, Gauge)
+        if func is not None:
+            metric.func = func
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS, **labels) -> Histogram:
+        """Return the histogram ``name`` with ``labels``, creating it if needed."""
+        return self._get("histogram", name, help_text, labels, lambda: Histogram(buckets))
+
+    def add_histogram(self, name: str, help_text: str, histogram: Histogram, **labels):
+        """Register a histogram owned by someone else, e.g. the soundbar's RTT."""
+        self._get("histogram", name, help_text, labels, lambda: histogram)
+        # Replace an earlier one, e.g. of a soundbar created again.
+        self._families[name].children[tuple(sorted(labels.items()))] = histogram
+
+    def snapshot(self, **match) -> dict:
+        """Return the values of the metrics whose labels match as a JSON-able dict.
+
+        A label matched with None must be absent. Values of labels not matched
+        on become nested keys, e.g. ``{"yamaha_bt_command_stage_seconds":
+        {"bt_write": {...}}}``.
+        """
+        result = {}
+        for family in self._families.values():
+            for key, metric in family.children.items():
+                labels = dict(key)
+                if any(
+                    labels.get(label) != value if value is not None else label in labels
+                    for label, value in match.items()
+                ):
+                    continue
+                rest = [value for label, value in key if label not in match]
+                value = metric.get()
+                if not rest:
+                    result[family.name] = value
+                else:
+                    result.setdefault(family.name, {})[",".join(rest)] = value
+        return result
+
+    def prometheus(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        for family in self._families.values():
+            if not family.children:
+                continue
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for key, metric in family.children.items():
+                if family.kind != "histogram":
+                    lines.append(f"{family.name}{_labels(key)} {_number(metric.get())}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), metric.counts):
+                    cumulative += count
+                    le = _labels(key + (("le", _number(bound)),))
+                    lines.append(f"{family.name}_bucket{le} {cumulative}")
+                lines.append(f"{family.name}_sum{_labels(key)} {_number(metric.total)}")
+                lines.append(f"{family.name}_count{_labels(key)} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(key) -> str:
+    if not key:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in key
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _number(value) -> str:
+    if value is None:
+        return "NaN"
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, bool):
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+registry = MetricsRegistry()
+
+
+async def monitor_loop_lag(metrics: MetricsRegistry = registry, interval: float = LOOP_LAG_INTERVAL):
+    """Sample how late the event loop wakes up a sleeping task, runs until cancelled."""
+    loop = asyncio.get_running_loop()
+    histogram = metrics.histogram(
+        "yamaha_bt_loop_lag_seconds", "How late the event loop ran a timer"
+    )
+    gauge = metrics.gauge("yamaha_bt_loop_lag_max_seconds", "Largest event loop lag seen")
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - start - interval, 0.0)
+        histogram.observe(lag)
+        if lag > gauge.value:
+            gauge.set(lag)
+
+
+class MetricsServer:
+    """Serve ``GET /metrics`` in the Prometheus text format."""
+
+    def __init__(self, metrics: MetricsRegistry, host: str, port: int):
+        """Initialize the server, :meth:`start` starts listening."""
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server: asyncio.AbstractServer = None
+
+    async def start(self):
+        """Start listening, a port that is in use is logged and skipped."""
+        try:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as err:
+            _LOGGER.error("Cannot serve metrics on %s:%s: %s", self.host, self.port, err)
+            return
+        self.port = self._server.sockets[0].getsockname()[1]
+        _LOGGER.info("Serving metrics on http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), REQUEST_TIMEOUT)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+            writer.close()
+            return
+        except ConnectionError:
+            return
+        request = head.split(b"\r\n", 1)[0].split()
+        if len(request) >= 2 and request[0] == b"GET" and request[1].split(b"?")[0] == b"/metrics":
+            status, body = "200 OK", self.metrics.prometheus().encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {PROMETHEUS_CONTENT_TYPE}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        with contextlib.suppress(ConnectionError):
+            await writer.drain()
+        writer.close()
@@ -1,117 +1,119 @@
 """MQTT Module."""
 import asyncio
 import logging
-import socket
-import time
 
 import paho.mqtt.client as mqtt
 
+from yamaha_bt.const import PAYLOAD_NOT_AVAILABLE
+from yamaha_bt.mqtt_base import MQTTClientBase
+
 _LOGGER = logging.getLogger(__name__)
 
+KEEP_ALIVE = 60
+# Seconds to wait for the CONNACK after the socket connected
+CONNECT_TIMEOUT = 10
+
 
-class MQTTClient:
+class MQTTClient(MQTTClientBase):
     """MQTT Client Wrapper."""
 
     def __init__(
-        self, screen_manager, host: str, port: str, username: str, password: str
+        self,
+        screen_manager,
+        host: str,
+        port: str,
+        username: str,
+        password: str,
+        fallback_brokers=(),
+        will_topic: str = None,
     ):
-        """Initialize the MQTT client."""
-        self._mqttc = mqtt.Client()
-        self.screen_manager = screen_manager
-        self.loop = self.screen_manager.loop
+        """Initialize the MQTT client, ``fallback_brokers`` are tried in order after ``host``.
+
+        The broker publishes ``offline`` on ``will_topic`` if we disappear.
+        """
+        super().__init__(screen_manager, host, port, fallback_brokers, will_topic)
+        # Reconnects are scheduled on the event loop, paho must not retry on its own.
+        self._mqttc = mqtt.Client(reconnect_on_failure=False)
 
         # Enable logging
         self._mqttc.enable_logger()
 
-        self._msg_listners = []
-        self.connected = False
-
-        self.host = host
-        self.port = port
-        self._paho_lock = asyncio.Lock()
-
-        self._connect_event: asyncio.Event = None
-        
-
-        self.on_connect = None
+        self._connect_result: asyncio.Future = None
 
         if username is not None:
             self._mqttc.username_pw_set(username, password)
 
-        # Set keep-alive interval to 60 seconds
-        self._mqttc.keep_alive = 60
-        self._mqttc.reconnect_delay_set(
-            min_delay=1, max_delay=1800
-        )  # Set reconnect delay between 1 and 1800 seconds
-
         self._mqttc.on_connect = self._mqtt_on_connect
         self._mqttc.on_disconnect = self._mqtt_on_disconnect
         self._mqttc.on_message = self._mqtt_on_message
-        self._mqttc.on_publish = self._mqtt_on_callback
-        self._mqttc.on_subscribe = self._mqtt_on_callback
+        self._mqttc.on_publish = self._mqtt_on_publish
+        self._mqttc.on_subscribe = self._mqtt_on_subscribe
         self._mqttc.on_unsubscribe = self._mqtt_on_callback
-        # self._mqttc.will_set(
-        #     discovery_msg["availability_topic"],
-        #     payload=discovery_msg["payload_not_available"],
-        #     qos=1,
-        #     retain=True,
-        # )
+        if will_topic is not None:
+            self._mqttc.will_set(
+                will_topic,
+                payload=PAYLOAD_NOT_AVAILABLE,
+                qos=1,
+                retain=True,
+            )
 
         _LOGGER.info("Client Init Complete")
 
-    async def connect(self):
-        """Connect to the MQTT broker."""
-
-        self._connect_event = asyncio.Event()
-
-        result = await self.loop.run_in_executor(
-            None, self._mqttc.connect, self.host, self.port, 60
-        )
-
-        self._mqttc.loop_start()
-
-        await self._connect_event.wait()
-        self._connect_event = None
-
-        return result
-
-    async def perform_subscription(self, topic: str, qos: int):
-        """Perform subscription to the given topic with the specified quality of service."""
-
-        async with self._paho_lock:
-            result, mid = await self.loop.run_in_executor(
-                None, self._mqttc.subscribe, topic, qos
+    async def disconnect(self):
+        """Disconnect cleanly, the broker will not publish our last will."""
+        self._reconnector.cancel()
+        self._outbound.stop()
+        self._mqttc.disconnect()
+        await self.loop.run_in_executor(None, self._mqttc.loop_stop)
+
+    async def _open(self, host: str, port: int):
+        """Connect to one broker and wait for the CONNACK."""
+        # Join the network thread of the previous connection, it exits on its own.
+        await self.loop.run_in_executor(None, self._mqttc.loop_stop)
+
+        self._connect_result = self.loop.create_future()
+        try:
+            await self.loop.run_in_executor(
+                None, self._mqttc.connect, host, port, KEEP_ALIVE
             )
-            _LOGGER.info("Subscribing to %s, mid: %s", topic, mid)
-        return result
-
-    async def publish(self, topic: str, payload, qos: int, retain: bool):
-        """Publish a MQTT payload."""
+            self._mqttc.loop_start()
+            result_code = await asyncio.wait_for(self._connect_result, CONNECT_TIMEOUT)
+        finally:
+            self._connect_result = None
+        if result_code != mqtt.CONNACK_ACCEPTED:
+            raise ConnectionRefusedError(mqtt.connack_string(result_code))
+        self.host = host
+        self.port = port
 
-        return asyncio.run_coroutine_threadsafe(
-            self._publish(topic, payload, qos, retain),
-            self.loop,
+    def _subscribe(self, topics: list):
+        """Queue a SUBSCRIBE with paho, no need for the executor."""
+        return self._mqttc.subscribe(topics)
+
+    def _unsubscribe(self, topics: list):
+        """Queue an UNSUBSCRIBE with paho."""
+        return self._mqttc.unsubscribe(topics)
+
+    def _send(self, topic: str, payload, qos: int, retain: bool) -> bool:
+        """Hand a message to paho, called from the publish queue writer."""
+        msg_info = self._mqttc.publish(topic, payload, qos, retain)
+        _LOGGER.debug(
+            "Transmitting message on %s: '%s', mid: %s",
+            topic,
+            payload,
+            msg_info.mid,
         )
+        if msg_info.rc != mqtt.MQTT_ERR_SUCCESS:
+            self._publishes_dropped += 1
+            return False
+        return True
 
-    async def _publish(self, topic: str, payload, qos: int, retain: bool):
-        """Publish a message to the MQTT broker."""
-        async with self._paho_lock:
-            msg_info = await self.loop.run_in_executor(
-                None, self._mqttc.publish, topic, payload, qos, retain
-            )
-            _LOGGER.debug(
-                "Transmitting message on %s: '%s', mid: %s",
-                topic,
-                payload,
-                msg_info.mid,
-            )
-
-    def add_msg_listner(self, func):
-        """Add a function to the listener."""
-        self._msg_listners.append(func)
+    def _call_on_loop(self, callback, *args, context=None):
+        """Hop from paho's network thread onto the event loop."""
+        self.loop.call_soon_threadsafe(callback, *args, context=context)
 
     def _mqtt_on_connect(self, _mqttc, _userdata, _flags, result_code: int):
         """Handle the on_connect event of the MQTT client."""
+        self.loop.call_soon_threadsafe(self._connack, result_code)
         if result_code != mqtt.CONNACK_ACCEPTED:
             _LOGGER.error(
                 "Unable to connect to the MQTT broker: %s",
@@ -119,9 +121,6 @@ class MQTTClient:
             )
             return
 
-        if self._connect_event is not None:
-            self.loop.call_soon_threadsafe(self._connect_event.set)
-
         self.connected = True
         _LOGGER.info(
             "Connected to MQTT server %s:%s (%s)",
@@ -129,62 +128,36 @@ class MQTTClient:
             self.port,
             result_code,
         )
-
-        if self.on_connect is not None:
-            if asyncio.iscoroutinefunction(self.on_connect):
-                asyncio.run_coroutine_threadsafe(self.on_connect(), self.loop)
-            else:
-                self.loop.run_in_executor(None, self.on_connect)
+        self.loop.call_soon_threadsafe(self._connected)
 
     def _mqtt_on_disconnect(self, _mqttc, _userdata, result_code: int):
         """Handle the on_disconnect event of the MQTT client."""
 
         self.connected = False
+        self.loop.call_soon_threadsafe(self._connection_lost)
         _LOGGER.error("Client Got Disconnected")
-        if result_code != 0:
+        if result_code != mqtt.MQTT_ERR_SUCCESS:
             _LOGGER.error("Trying to Reconnect")
-            self.reconnect_mqtt()
+            self.loop.call_soon_threadsafe(self._reconnector.schedule)
         else:
             _LOGGER.error("rc value: %s", str(result_code))
 
+    def _connack(self, result_code: int):
+        """Resolve a pending connect attempt with the CONNACK result."""
+        if self._connect_result is not None and not self._connect_result.done():
+            self._connect_result.set_result(result_code)
+
     def _mqtt_on_message(self, _mqttc, _userdata, msg):
         """Handle the on_message event of the MQTT client."""
+        self._on_message(msg)
 
-        _LOGGER.info(
-            "Received message on %s%s: %s",
-            msg.topic,
-            " (retained)" if msg.retain else "",
-            msg.payload,
-        )
-
-        topic = msg.topic
-        payload = msg.payload.decode()
+    def _mqtt_on_publish(self, _mqttc, _userdata, mid):
+        """Handle the on_publish event of the MQTT client."""
+        self.loop.call_soon_threadsafe(self._outbound.ack)
 
-        for func in self._msg_listners:
-            if asyncio.iscoroutinefunction(func):
-                asyncio.run_coroutine_threadsafe(func(topic, payload), self.loop)
-            else:
-                self.loop.run_in_executor(None, func, topic, payload)
+    def _mqtt_on_subscribe(self, _mqttc, _userdata, mid, granted_qos):
+        """Handle the on_subscribe event of the MQTT client."""
+        self.loop.call_soon_threadsafe(self._subscribed, mid, granted_qos)
 
     def _mqtt_on_callback(self, _mqttc, _userdata, mid, _granted_qos=None):
         """Handle the on_callback event of the MQTT client."""
-
-    def reconnect_mqtt(self):
-        """Attempt to reconnect to MQTT broker."""
-        retry_count = 0
-        max_retries = 10
-        while retry_count < max_retries:
-            try:
-                self._mqttc.reconnect()
-                self.connected = True
-                _LOGGER.info("Reconnected successfully")
-                break  # Exit the retry loop on successful reconnection
-            except (ConnectionRefusedError, socket.timeout) as err:
-                _LOGGER.warning("Error occurred during reconnection: %s", str(err))
-                delay = 2**retry_count  # Exponential backoff
-                _LOGGER.warning("Retrying in %d seconds...", delay)
-                time.sleep(delay)
-                retry_count += 1
-        else:
-            _LOGGER.error("Failed to reconnect after %d attempts", max_retries)
-            asyncio.run_coroutine_threadsafe(self.screen_manager.stop(), self.loop)
\ No newline at end of file
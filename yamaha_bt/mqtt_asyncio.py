@@ -0,0 +1,414 @@
+"""Asyncio MQTT Module.
+
+A minimal MQTT 3.1.1 client that runs entirely on the event loop using
+asyncio streams. It exposes the same interface as
+:class:`yamaha_bt.mqtt.MQTTClient` without the paho network thread, so
+callbacks and publishes never cross a thread boundary.
+"""
+import asyncio
+import itertools
+import logging
+import struct
+import uuid
+
+from yamaha_bt.const import PAYLOAD_NOT_AVAILABLE
+from yamaha_bt.mqtt_base import MQTT_ERR_NO_CONN, MQTT_ERR_SUCCESS, MQTTClientBase
+
+_LOGGER = logging.getLogger(__name__)
+
+# Pause the publish queue while more than this many bytes wait in the socket buffer
+WRITE_BUFFER_HIGH_WATER = 64 * 1024
+
+KEEP_ALIVE = 60
+
+# Control packet types
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+SUBSCRIBE = 0x82
+SUBACK = 0x90
+UNSUBSCRIBE = 0xA2
+UNSUBACK = 0xB0
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+CONNACK_ACCEPTED = 0
+
+CONNACK_CODES = {
+    1: "Connection Refused: unacceptable protocol version.",
+    2: "Connection Refused: identifier rejected.",
+    3: "Connection Refused: broker unavailable.",
+    4: "Connection Refused: bad user name or password.",
+    5: "Connection Refused: not authorised.",
+}
+
+
+class MQTTProtocolError(Exception):
+    """Raised when the broker sends something we do not understand."""
+
+
+def encode_length(length: int) -> bytes:
+    """Encode the variable length remaining length field."""
+    out = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        if length:
+            byte |= 0x80
+        out.append(byte)
+        if not length:
+            return bytes(out)
+
+
+def encode_string(value) -> bytes:
+    """Encode a length prefixed UTF-8 string or binary field."""
+    if isinstance(value, str):
+        value = value.encode()
+    return struct.pack("!H", len(value)) + value
+
+
+def encode_payload(payload) -> bytes:
+    """Convert a publish payload the same way paho does."""
+    if payload is None:
+        return b""
+    if isinstance(payload, (bytes, bytearray)):
+        return bytes(payload)
+    if isinstance(payload, str):
+        return payload.encode()
+    if isinstance(payload, (int, float)):
+        return str(payload).encode()
+    raise TypeError("payload must be a string, bytearray, int, float or None.")
+
+
+def build_packet(header: int, body: bytes) -> bytes:
+    """Prefix ``body`` with the fixed header."""
+    return bytes([header]) + encode_length(len(body)) + body
+
+
+def build_connect(
+    client_id: str,
+    keep_alive: int,
+    username: str = None,
+    password: str = None,
+    will_topic: str = None,
+    will_payload=None,
+    will_qos: int = 0,
+    will_retain: bool = False,
+) -> bytes:
+    """Build a CONNECT packet with a clean session."""
+    flags = 0x02
+    payload = encode_string(client_id)
+    if will_topic is not None:
+        flags |= 0x04 | (will_qos << 3) | (0x20 if will_retain else 0)
+        payload += encode_string(will_topic) + encode_string(encode_payload(will_payload))
+    if username is not None:
+        flags |= 0x80
+        payload += encode_string(username)
+        if password is not None:
+            flags |= 0x40
+            payload += encode_string(password)
+
+    body = encode_string("MQTT") + struct.pack("!BBH", 4, flags, keep_alive) + payload
+    return build_packet(CONNECT, body)
+
+
+def build_publish(topic: str, payload, qos: int, retain: bool, mid: int = 0) -> bytes:
+    """Build a PUBLISH packet."""
+    header = PUBLISH | (qos << 1) | (1 if retain else 0)
+    body = encode_string(topic)
+    if qos:
+        body += struct.pack("!H", mid)
+    return build_packet(header, body + encode_payload(payload))
+
+
+def build_subscribe(mid: int, topics) -> bytes:
+    """Build a SUBSCRIBE packet for a list of ``(topic, qos)`` pairs."""
+    body = struct.pack("!H", mid)
+    for topic, qos in topics:
+        body += encode_string(topic) + bytes([qos])
+    return build_packet(SUBSCRIBE, body)
+
+
+def build_unsubscribe(mid: int, topics) -> bytes:
+    """Build an UNSUBSCRIBE packet for a list of topics."""
+    body = struct.pack("!H", mid)
+    for topic in topics:
+        body += encode_string(topic)
+    return build_packet(UNSUBSCRIBE, body)
+
+
+async def read_packet(reader: asyncio.StreamReader):
+    """Read one control packet and return ``(header, body)``."""
+    header = (await reader.readexactly(1))[0]
+    length = 0
+    multiplier = 1
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+        if multiplier > 128**3:
+            raise MQTTProtocolError("Malformed remaining length")
+    body = await reader.readexactly(length) if length else b""
+    return header, body
+
+
+class MQTTMessage:
+    """Incoming message, mirrors the attributes of paho's MQTTMessage we use."""
+
+    __slots__ = ("topic", "payload", "qos", "retain")
+
+    def __init__(self, topic: str, payload: bytes, qos: int, retain: bool):
+        """Initialize the message."""
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+
+
+class AsyncioMQTTClient(MQTTClientBase):
+    """MQTT client running on the event loop with asyncio streams."""
+
+    def __init__(
+        self,
+        screen_manager,
+        host: str,
+        port: str,
+        username: str,
+        password: str,
+        fallback_brokers=(),
+        will_topic: str = None,
+    ):
+        """Initialize the MQTT client, ``fallback_brokers`` are tried in order after ``host``.
+
+        The broker publishes ``offline`` on ``will_topic`` if we disappear.
+        """
+        super().__init__(screen_manager, host, port, fallback_brokers, will_topic)
+        self.username = username
+        self.password = password
+        self.client_id = f"yamaha_bt-{uuid.uuid4().hex[:12]}"
+        self.keep_alive = KEEP_ALIVE
+
+        self._reader: asyncio.StreamReader = None
+        self._writer: asyncio.StreamWriter = None
+        self._reader_task: asyncio.Task = None
+        self._ping_task: asyncio.Task = None
+        # Loop time of the PINGREQ still waiting for its PINGRESP
+        self._ping_sent: float = None
+        self._drain_task: asyncio.Task = None
+        self._closing = False
+
+        self._mids = itertools.count(1)
+        # QoS 1 publishes waiting for their PUBACK
+        self._pending_acks = set()
+
+        _LOGGER.info("Client Init Complete")
+
+    async def connect(self):
+        """Connect to the MQTT broker."""
+        self._closing = False
+        return await super().connect()
+
+    async def disconnect(self):
+        """Disconnect cleanly, the broker will not publish our last will."""
+        self._closing = True
+        self._reconnector.cancel()
+        for task in (self._ping_task, self._reader_task):
+            if task is not None:
+                task.cancel()
+        self._outbound.stop()
+        if self._writer is not None and self.connected:
+            self._writer.write(build_packet(DISCONNECT, b""))
+            await self._writer.drain()
+        self._connection_lost()
+
+    def _subscribe(self, topics: list):
+        """Write a SUBSCRIBE, the SUBACK is handled by the read loop."""
+        if not self.connected:
+            return MQTT_ERR_NO_CONN, None
+        mid = self._next_mid()
+        self._writer.write(build_subscribe(mid, topics))
+        return MQTT_ERR_SUCCESS, mid
+
+    def _unsubscribe(self, topics: list):
+        """Write an UNSUBSCRIBE, the UNSUBACK is ignored."""
+        if not self.connected:
+            return MQTT_ERR_NO_CONN, None
+        mid = self._next_mid()
+        self._writer.write(build_unsubscribe(mid, topics))
+        return MQTT_ERR_SUCCESS, mid
+
+    def _call_on_loop(self, callback, *args, context=None):
+        """Run ``callback`` right away, packets are already read on the loop."""
+        if context is None:
+            callback(*args)
+        else:
+            context.run(callback, *args)
+
+    def _next_mid(self) -> int:
+        """Return the next packet identifier."""
+        mid = next(self._mids)
+        if mid > 0xFFFF:
+            self._mids = itertools.count(2)
+            mid = 1
+        return mid
+
+    def _send(self, topic: str, payload, qos: int, retain: bool) -> bool:
+        """Write a message to the socket, called from the publish queue writer."""
+        if not self.connected:
+            self._publishes_dropped += 1
+            return False
+
+        mid = self._next_mid() if qos else 0
+        self._writer.write(build_publish(topic, payload, qos, retain, mid))
+        _LOGGER.debug(
+            "Transmitting message on %s: '%s', mid: %s",
+            topic,
+            payload,
+            mid,
+        )
+
+        transport = self._writer.transport
+        if transport.get_write_buffer_size() > WRITE_BUFFER_HIGH_WATER and (
+            self._drain_task is None or self._drain_task.done()
+        ):
+            self._outbound.hold()
+            self._drain_task = self.loop.create_task(self._drain())
+
+        if qos:
+            self._pending_acks.add(mid)
+            return True
+        return False
+
+    async def _drain(self):
+        """Resume the publish queue once the socket buffer has drained."""
+        try:
+            await self._writer.drain()
+        except ConnectionError:
+            return
+        if self.connected:
+            self._outbound.resume()
+
+    async def _open(self, host: str, port: int):
+        """Open the connection to one broker and wait for the CONNACK."""
+        self._reader, self._writer = await asyncio.open_connection(host, port)
+        self._writer.write(
+            build_connect(
+                self.client_id,
+                self.keep_alive,
+                username=self.username,
+                password=self.password,
+                will_topic=self.will_topic,
+                will_payload=PAYLOAD_NOT_AVAILABLE,
+                will_qos=1,
+                will_retain=True,
+            )
+        )
+
+        header, body = await asyncio.wait_for(read_packet(self._reader), self.keep_alive)
+        if header & 0xF0 != CONNACK or len(body) != 2:
+            self._writer.close()
+            raise MQTTProtocolError("Expected CONNACK")
+        if body[1] != CONNACK_ACCEPTED:
+            self._writer.close()
+            message = CONNACK_CODES.get(body[1], "Connection Refused: unknown reason.")
+            _LOGGER.error("Unable to connect to the MQTT broker: %s", message)
+            raise ConnectionRefusedError(message)
+
+        self.connected = True
+        self.host = host
+        self.port = port
+        _LOGGER.info(
+            "Connected to MQTT server %s:%s (%s)",
+            self.host,
+            self.port,
+            body[1],
+        )
+
+        self._ping_sent = None
+        self._reader_task = self.loop.create_task(self._read_loop())
+        self._ping_task = self.loop.create_task(self._ping_loop())
+
+        self._connected()
+
+    async def _read_loop(self):
+        """Read and handle packets until the connection drops."""
+        try:
+            while True:
+                header, body = await read_packet(self._reader)
+                self._handle_packet(header, body)
+        except asyncio.CancelledError:
+            raise
+        except (asyncio.IncompleteReadError, ConnectionError, MQTTProtocolError) as err:
+            _LOGGER.error("Client Got Disconnected: %s", err)
+        except Exception:  # pylint: disable=broad-except
+            # Never end up connected but deaf, reconnect like after any other loss.
+            _LOGGER.exception("Unexpected error reading from the MQTT broker")
+        self._connection_lost()
+        if not self._closing:
+            self._reconnector.schedule()
+
+    def _handle_packet(self, header: int, body: bytes):
+        """Dispatch a single control packet."""
+        packet_type = header & 0xF0
+        if packet_type == PUBLISH:
+            self._handle_publish(header, body)
+        elif packet_type == PUBACK:
+            (mid,) = struct.unpack("!H", body[:2])
+            if mid in self._pending_acks:
+                self._pending_acks.discard(mid)
+                self._outbound.ack()
+        elif packet_type == SUBACK:
+            (mid,) = struct.unpack("!H", body[:2])
+            self._subscribed(mid, body[2:])
+        elif packet_type == PINGRESP:
+            self._ping_sent = None
+        elif packet_type == UNSUBACK:
+            pass
+        else:
+            raise MQTTProtocolError(f"Unexpected packet type {packet_type:#x}")
+
+    def _handle_publish(self, header: int, body: bytes):
+        """Handle an incoming PUBLISH packet."""
+        qos = (header >> 1) & 0x03
+        (topic_len,) = struct.unpack("!H", body[:2])
+        pos = 2 + topic_len
+        topic = body[2:pos].decode(errors="replace")
+        if qos:
+            (mid,) = struct.unpack("!H", body[pos:pos + 2])
+            pos += 2
+            if qos == 1:
+                self._writer.write(build_packet(PUBACK, struct.pack("!H", mid)))
+            else:
+                _LOGGER.warning("QoS 2 is not supported, ignoring message on %s", topic)
+                return
+
+        self._on_message(MQTTMessage(topic, body[pos:], qos, bool(header & 0x01)))
+
+    async def _ping_loop(self):
+        """Keep the connection alive, drop it if the broker stops answering pings."""
+        while True:
+            await asyncio.sleep(self.keep_alive / 2)
+            now = self.loop.time()
+            if self._ping_sent is not None:
+                if now - self._ping_sent >= self.keep_alive:
+                    # Half-open connection, the read loop sees the abort and reconnects.
+                    _LOGGER.error("No PINGRESP within %s seconds, dropping the connection", self.keep_alive)
+                    self._writer.transport.abort()
+                    return
+                continue
+            self._ping_sent = now
+            self._writer.write(build_packet(PINGREQ, b""))
+
+    def _connection_lost(self):
+        """Clean up after the connection dropped."""
+        super()._connection_lost()
+        if self._ping_task is not None:
+            self._ping_task.cancel()
+            self._ping_task = None
+        self._pending_acks.clear()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
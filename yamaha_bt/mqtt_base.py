@@ -0,0 +1,260 @@
+"""MQTT Client Base Module.
+
+What the paho and the asyncio engine have in common: the outbound publish
+queue, the topic router, broker failover, subscription bookkeeping and the
+metrics. The engines only implement how a connection is opened and how
+packets are written, see :class:`yamaha_bt.mqtt.MQTTClient` and
+:class:`yamaha_bt.mqtt_asyncio.AsyncioMQTTClient`.
+"""
+import asyncio
+import logging
+
+from yamaha_bt import tracing
+from yamaha_bt.publish_queue import PublishQueue
+from yamaha_bt.reconnect import ReconnectScheduler
+from yamaha_bt.router import TopicRouter
+
+_LOGGER = logging.getLogger(__name__)
+
+PUBLISH_QUEUE_SIZE = 1000
+PUBLISH_BATCH_SIZE = 100
+# Messages handed to the connection but not yet acknowledged, beyond this they wait in our queue
+PUBLISH_MAX_INFLIGHT = 20
+
+# Result codes, the same values paho uses
+MQTT_ERR_SUCCESS = 0
+MQTT_ERR_NO_CONN = 4
+MQTT_ERR_UNKNOWN = 13
+SUBACK_FAILURE = 0x80
+
+
+class MQTTClientBase:
+    """Engine independent part of the MQTT client.
+
+    Subclasses implement :meth:`_open` (connect to one broker), :meth:`_send`
+    (called by the publish queue writer), :meth:`_subscribe`,
+    :meth:`_unsubscribe`, :meth:`_call_on_loop` and :meth:`disconnect`.
+    """
+
+    def __init__(
+        self,
+        screen_manager,
+        host: str,
+        port: str,
+        fallback_brokers=(),
+        will_topic: str = None,
+    ):
+        """Initialize the client, ``fallback_brokers`` are tried in order after ``host``.
+
+        The broker publishes ``offline`` on ``will_topic`` if we disappear.
+        """
+        self.screen_manager = screen_manager
+        self.loop = self.screen_manager.loop
+
+        self._router = TopicRouter()
+        self.connected = False
+
+        self.host = host
+        self.port = port
+        self.will_topic = will_topic
+
+        self._pending_subscriptions = {}
+        self._outbound = PublishQueue(
+            self._send,
+            maxsize=PUBLISH_QUEUE_SIZE,
+            batch_size=PUBLISH_BATCH_SIZE,
+            max_inflight=PUBLISH_MAX_INFLIGHT,
+        )
+        self._publishes_dropped = 0
+        self._reconnector = ReconnectScheduler(
+            self.loop, self._open, [(host, port), *fallback_brokers]
+        )
+        # Tasks started for on_connect, kept so they are not garbage collected mid-run
+        self._tasks = set()
+
+        self.on_connect = None
+
+    async def connect(self):
+        """Connect to the first reachable MQTT broker."""
+        self._outbound.start()
+        await self._reconnector.connect()
+        return MQTT_ERR_SUCCESS
+
+    async def disconnect(self):
+        """Disconnect cleanly, the broker will not publish our last will."""
+        raise NotImplementedError
+
+    async def _open(self, host: str, port: int):
+        """Connect to one broker, raise if it refuses or cannot be reached."""
+        raise NotImplementedError
+
+    def _send(self, topic: str, payload, qos: int, retain: bool) -> bool:
+        """Hand a message to the connection, see :class:`PublishQueue`."""
+        raise NotImplementedError
+
+    def _subscribe(self, topics: list):
+        """Send one SUBSCRIBE for ``topics``, return ``(result, mid)``."""
+        raise NotImplementedError
+
+    def _unsubscribe(self, topics: list):
+        """Send one UNSUBSCRIBE for ``topics``, return ``(result, mid)``."""
+        raise NotImplementedError
+
+    def _call_on_loop(self, callback, *args, context=None):
+        """Run ``callback`` on the event loop, from wherever the engine receives."""
+        raise NotImplementedError
+
+    @property
+    def reconnects(self) -> int:
+        """Return how often the connection was re-established."""
+        return self._reconnector.reconnects
+
+    @property
+    def time_to_reconnect(self) -> float:
+        """Return how long the last reconnect took, in seconds."""
+        return self._reconnector.time_to_reconnect
+
+    async def perform_subscription(self, topic: str, qos: int):
+        """Perform subscription to the given topic with the specified quality of service."""
+        return await self.perform_subscriptions([(topic, qos)])
+
+    async def perform_subscriptions(self, topics):
+        """Subscribe to a list of ``(topic, qos)`` pairs with a single SUBSCRIBE."""
+        topics = list(topics)
+        if not topics:
+            return MQTT_ERR_SUCCESS
+
+        result, mid = self._subscribe(topics)
+        _LOGGER.info("Subscribing to %d topics, mid: %s", len(topics), mid)
+        if result != MQTT_ERR_SUCCESS:
+            return result
+
+        # The SUBACK is handled on the loop, so it cannot beat us to the future.
+        future = self.loop.create_future()
+        self._pending_subscriptions[mid] = future
+        try:
+            granted = await future
+        except ConnectionError:
+            return MQTT_ERR_NO_CONN
+        refused = [topic for (topic, _qos), code in zip(topics, granted) if code == SUBACK_FAILURE]
+        if refused:
+            _LOGGER.error("Subscription to %s was refused", ", ".join(refused))
+            return MQTT_ERR_UNKNOWN
+        return MQTT_ERR_SUCCESS
+
+    async def perform_unsubscriptions(self, topics):
+        """Unsubscribe from a list of topics with a single UNSUBSCRIBE."""
+        topics = list(topics)
+        if not topics:
+            return MQTT_ERR_SUCCESS
+        result, mid = self._unsubscribe(topics)
+        _LOGGER.info("Unsubscribing from %d topics, mid: %s", len(topics), mid)
+        return result
+
+    def _subscribed(self, mid: int, granted_qos):
+        """Resolve the subscription waiting for ``mid``."""
+        future = self._pending_subscriptions.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(granted_qos)
+
+    async def publish(self, topic: str, payload, qos: int, retain: bool):
+        """Publish a MQTT payload."""
+        tracing.finish("state_published")
+        await self._outbound.put(topic, payload, qos, retain)
+
+    async def flush(self):
+        """Wait until every queued message was handed to the connection."""
+        await self._outbound.join()
+
+    @property
+    def queue_depth(self) -> int:
+        """Return the number of messages waiting in the outbound queue."""
+        return self._outbound.depth
+
+    @property
+    def flush_latency(self) -> float:
+        """Return how long the oldest message of the last batch waited, in seconds."""
+        return self._outbound.flush_latency
+
+    @property
+    def publishes_sent(self) -> int:
+        """Return the number of messages taken from the outbound queue."""
+        return self._outbound.sent
+
+    @property
+    def publishes_dropped(self) -> int:
+        """Return the number of messages refused by the connection or dropped while offline."""
+        return self._publishes_dropped + self._outbound.dropped
+
+    @property
+    def publishes_coalesced(self) -> int:
+        """Return the number of retained messages replaced before they were sent."""
+        return self._outbound.coalesced
+
+    def add_msg_listner(self, func, topic: str = "#") -> bool:
+        """Add a function called for messages on ``topic`` (a filter, may contain wildcards).
+
+        Returns False if ``func`` was already registered for ``topic``.
+        """
+        return self._router.add(topic, func)
+
+    def remove_msg_listner(self, func, topic: str = "#") -> bool:
+        """Remove a function added with :meth:`add_msg_listner`."""
+        return self._router.remove(topic, func)
+
+    @property
+    def listener_count(self) -> int:
+        """Return the number of registered listeners."""
+        return len(self._router)
+
+    def _on_message(self, msg):
+        """Handle an incoming message with ``topic``, ``payload`` (bytes) and ``retain``."""
+        _LOGGER.info(
+            "Received message on %s%s: %s",
+            msg.topic,
+            " (retained)" if msg.retain else "",
+            msg.payload,
+        )
+
+        try:
+            payload = msg.payload.decode()
+        except UnicodeDecodeError:
+            _LOGGER.warning("Ignoring message on %s, payload is not UTF-8", msg.topic)
+            return
+
+        trace = tracing.start_command(msg.topic)
+        if trace is not None:
+            self._call_on_loop(
+                self._dispatch_traced, msg.topic, payload,
+                context=tracing.context_with((trace,)),
+            )
+            return
+        # At most one hop onto the event loop, handlers then run inline there.
+        self._call_on_loop(self._router.dispatch, msg.topic, payload)
+
+    def _dispatch_traced(self, topic: str, payload: str):
+        """Dispatch a traced command, runs in the context carrying its trace."""
+        tracing.mark("dispatched")
+        self._router.dispatch(topic, payload)
+
+    def _connected(self):
+        """Start sending on a fresh connection and tell the owner, runs on the loop."""
+        self._outbound.clear_inflight()
+        self._outbound.resume()
+        if self.on_connect is None:
+            return
+        if asyncio.iscoroutinefunction(self.on_connect):
+            task = self.loop.create_task(self.on_connect())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            self.on_connect()
+
+    def _connection_lost(self):
+        """Hold publishes and fail subscriptions that will never be acknowledged."""
+        self.connected = False
+        self._outbound.pause()
+        for future in self._pending_subscriptions.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Connection lost"))
+        self._pending_subscriptions.clear()
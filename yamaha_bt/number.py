@@ -0,0 +1,77 @@
+"""Number Module."""
+import logging
+
+from yamaha_bt.codec import VOLUME_MAX
+from yamaha_bt.const import DEFAULT_QOS
+from yamaha_bt.entity import Entity
+
+LOGGER = logging.getLogger(__name__)
+
+class NumberEntity(Entity):
+    component = "number"
+
+    async def register(self):
+        self.discovery_msg.update({
+            "command_topic": f"{self.device.base_topic}{self.unique_id}/command",
+            "min": self.min_value,
+            "max": self.max_value,
+            "step": 1,
+            "mode": "slider",
+        })
+        await self.device.discovery.publish(self.discovery_topic, self.discovery_msg)
+
+        self.device.mqtt.add_msg_listner(
+            self._handle_message, self.discovery_msg["command_topic"]
+        )
+        await self.update()
+
+    @property
+    def min_value(self) -> int:
+        return 0
+
+    @property
+    def max_value(self) -> int:
+        return 100
+
+    def _handle_message(self, topic, payload):
+        return self.handle_command(payload)
+
+    def handle_command(self, payload):
+        return
+
+class VolumeNumber(NumberEntity):
+    state_fields = ("volume",)
+
+    def __init__(self, device):
+        super().__init__(device)
+
+    @property
+    def icon(self) -> str:
+        return "mdi:volume-high"
+
+    @property
+    def name(self) -> str:
+        return "Volume Level"
+
+    @property
+    def max_value(self) -> int:
+        return VOLUME_MAX
+
+    async def update(self) -> str:
+        soundbar_state = self.device.yam.state
+        volume = soundbar_state.get("volume")
+        if volume is not None:
+            await self.device.mqtt.publish(self.discovery_msg["state_topic"], volume, DEFAULT_QOS, True)
+
+    def handle_command(self, payload):
+        LOGGER.info("New Command: %s", payload)
+        try:
+            target = round(float(payload))
+        except (ValueError, OverflowError):
+            # OverflowError: inf can't be rounded, nan raises ValueError.
+            LOGGER.warning("Ignoring volume %r, not a number", payload)
+            return
+        target = min(max(target, self.min_value), self.max_value)
+        self.device.optimistic.send(
+            self, "volume", target, str(target), self.device.yam.set_volume(target)
+        )
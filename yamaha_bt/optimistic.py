@@ -0,0 +1,71 @@
+"""Optimistic State Module."""
+import logging
+
+from yamaha_bt import tracing
+from yamaha_bt.const import DEFAULT_QOS
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class OptimisticState:
+    """Publish the state a command should lead to before the soundbar confirms it.
+
+    The status answering the command's burst (the reply to its own poll, not
+    one that was already in flight) is compared with what was published. If the soundbar disagrees (e.g. it ignored the command in
+    standby) the entity publishes the real state again. Only the newest
+    command for a field is reconciled, an older one would compare against a
+    value that was already replaced.
+    """
+
+    def __init__(self, device, enabled: bool):
+        """Initialize the optimistic state of ``device``."""
+        self.device = device
+        self.enabled = enabled
+        self._expected = {}
+        self.mismatches = 0
+
+    def send(self, entity, field: str, value, payload: str, command):
+        """Run ``command``, in optimistic mode publish ``payload`` for ``field`` right away."""
+        loop = self.device.loop
+        if not self.enabled or value is None:
+            loop.create_task(command)
+            return
+
+        token = object()
+        self._expected[field] = token
+        tracing.mark("optimistic_published")
+        # The trace ends with the confirmed publish, not this one.
+        tracing.context_with(()).run(
+            loop.create_task,
+            self.device.mqtt.publish(entity.discovery_msg["state_topic"], payload, DEFAULT_QOS, True),
+        )
+        loop.create_task(self._reconcile(entity, field, value, token, command))
+
+    async def _reconcile(self, entity, field: str, value, token, command):
+        try:
+            state = await command
+        except Exception as err:  # pylint: disable=broad-except
+            _LOGGER.warning("%s: %s=%s failed: %s", self.device.name, field, value, err)
+            state = err
+        if self._expected.get(field) is not token:
+            return
+        del self._expected[field]
+
+        if isinstance(state, Exception):
+            # Show the last known state again, the command may not have arrived.
+            await entity.update()
+            return
+        if state is None:
+            # Nothing to compare with, e.g. after power off dropped the link.
+            return
+        actual = state.get(field)
+        if actual != value:
+            self.mismatches += 1
+            _LOGGER.warning(
+                "%s: published %s=%s but the soundbar reports %s, correcting",
+                self.device.name,
+                field,
+                value,
+                actual,
+            )
+            await entity.update()
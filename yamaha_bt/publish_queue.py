@@ -0,0 +1,175 @@
+"""Outbound Publish Queue Module."""
+import asyncio
+from collections import OrderedDict
+import itertools
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class PublishQueue:
+    """Bounded queue of outbound MQTT messages drained by a single writer task.
+
+    Producers add to the queue and return immediately; the writer wakes up
+    once per burst and hands up to ``batch_size`` messages to ``send`` before
+    yielding back to the event loop.
+
+    Retained messages are keyed by topic, so a newer payload replaces an
+    unsent older one in place (last value wins). The writer only sends while
+    the queue is resumed and fewer than ``max_inflight`` messages are waiting
+    to be acknowledged, which keeps the backlog here, where it can be
+    coalesced, rather than in the client library.
+
+    While the broker is offline nobody waits for the queue: :meth:`join`
+    returns and a full queue drops its oldest message to make room.
+    """
+
+    def __init__(
+        self,
+        send,
+        maxsize: int = 1000,
+        batch_size: int = 100,
+        max_inflight: int = 100,
+    ):
+        """Initialize the queue.
+
+        ``send`` is called as ``send(topic, payload, qos, retain)`` from the
+        event loop, must not block and returns True if the message was
+        accepted; every accepted message must later be confirmed with
+        :meth:`ack`.
+        """
+        self._send = send
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.max_inflight = max_inflight
+
+        self._pending = OrderedDict()
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._writer_task: asyncio.Task = None
+        self._running = False
+        self._online = False
+
+        self.inflight = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    @property
+    def depth(self) -> int:
+        """Return the number of messages waiting to be sent."""
+        return len(self._pending)
+
+    def start(self):
+        """Start the writer task if it is not running yet."""
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = asyncio.create_task(self._writer())
+
+    def stop(self):
+        """Cancel the writer task, pending messages are kept."""
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            self._writer_task = None
+
+    def resume(self):
+        """Allow the writer to send, called once the broker connection is up."""
+        self._running = True
+        self._online = True
+        if self._pending:
+            self._drained.clear()
+        self._wakeup.set()
+
+    def hold(self):
+        """Stop sending for a while, e.g. until the socket buffer drained."""
+        self._running = False
+
+    def pause(self):
+        """Hold messages in the queue, called when the broker connection drops."""
+        self._running = False
+        self._online = False
+        # Release flush() and producers waiting for room, the broker may not come back.
+        self._drained.set()
+        self._not_full.set()
+
+    def clear_inflight(self):
+        """Forget unacknowledged messages of a connection that is gone."""
+        self.inflight = 0
+        self._wakeup.set()
+
+    def ack(self):
+        """Confirm that one accepted message has left the client."""
+        if self.inflight > 0:
+            self.inflight -= 1
+            self._wakeup.set()
+
+    async def join(self):
+        """Wait until every queued message was handed to ``send`` or the broker is offline."""
+        await self._drained.wait()
+
+    async def put(self, topic: str, payload, qos: int, retain: bool):
+        """Queue a message, waiting while the queue is full and the broker online."""
+        loop = asyncio.get_running_loop()
+        if retain and topic in self._pending:
+            queued_at = self._pending[topic][0]
+            self._pending[topic] = (queued_at, topic, payload, qos, retain)
+            self.coalesced += 1
+            return
+
+        while len(self._pending) >= self.maxsize:
+            if not self._online:
+                _key, (_queued_at, dropped_topic, *_rest) = self._pending.popitem(last=False)
+                self.dropped += 1
+                _LOGGER.debug("Queue full while offline, dropped the message on %s", dropped_topic)
+                break
+            self._not_full.clear()
+            await self._not_full.wait()
+
+        key = topic if retain else next(self._seq)
+        self._pending[key] = (loop.time(), topic, payload, qos, retain)
+        if self._online:
+            self._drained.clear()
+        self._wakeup.set()
+
+    async def _writer(self):
+        """Drain the queue in batches."""
+        loop = asyncio.get_running_loop()
+        while True:
+            if not (self._pending and self._running and self.inflight < self.max_inflight):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            self._flush(loop)
+            # Let producers and the network run before the next batch.
+            await asyncio.sleep(0)
+
+    def _flush(self, loop):
+        """Send up to one batch of queued messages."""
+        pending = self._pending
+        count = min(len(pending), self.batch_size, self.max_inflight - self.inflight)
+        oldest = None
+        for _ in range(count):
+            _key, (queued_at, topic, payload, qos, retain) = pending.popitem(last=False)
+            if oldest is None:
+                oldest = queued_at
+            try:
+                accepted = self._send(topic, payload, qos, retain)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Failed to publish on %s", topic)
+                accepted = False
+            if accepted:
+                self.inflight += 1
+            self.sent += 1
+
+        if oldest is not None:
+            self.flush_latency = loop.time() - oldest
+            self.max_flush_latency = max(self.max_flush_latency, self.flush_latency)
+        self._not_full.set()
+        if not pending:
+            self._drained.set()
@@ -0,0 +1,85 @@
+"""Reconnect Scheduler Module."""
+import asyncio
+import logging
+
+from yamaha_bt.backoff import Backoff
+
+_LOGGER = logging.getLogger(__name__)
+
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+
+class ReconnectScheduler:
+    """Reconnect to the first reachable broker, driven from the event loop.
+
+    ``attempt(host, port)`` is awaited for each broker in order and raises on
+    failure. The first round starts right away; once every broker failed the
+    scheduler backs off before the next round, so one policy governs all
+    retries and nothing ever blocks the network thread.
+    """
+
+    def __init__(self, loop, attempt, brokers, backoff: Backoff = None):
+        """Initialize the scheduler with an ordered list of ``(host, port)``."""
+        self.loop = loop
+        self._attempt = attempt
+        self.brokers = list(brokers)
+        self.backoff = backoff or Backoff(RECONNECT_MIN_DELAY, RECONNECT_MAX_DELAY)
+        self._task: asyncio.Task = None
+        self._lost_at = None
+
+        self.current = self.brokers[0]
+        self.reconnects = 0
+        # Seconds from losing the connection until the last reconnect succeeded.
+        self.time_to_reconnect: float = None
+
+    @property
+    def active(self) -> bool:
+        """Return True while reconnecting."""
+        return self._task is not None and not self._task.done()
+
+    async def connect(self):
+        """Try each broker once, raise the last error if none is reachable."""
+        error = None
+        for host, port in self.brokers:
+            try:
+                await self._attempt(host, port)
+            except Exception as err:  # pylint: disable=broad-except
+                _LOGGER.warning("Connecting to MQTT server %s:%s failed: %s", host, port, err)
+                error = err
+                continue
+            if (host, port) != self.current:
+                _LOGGER.warning("Using MQTT server %s:%s", host, port)
+            self.current = (host, port)
+            return
+        raise error
+
+    def schedule(self):
+        """Start reconnecting, does nothing if already reconnecting."""
+        if self.active:
+            return
+        self._lost_at = self.loop.time()
+        self._task = self.loop.create_task(self._run())
+
+    def cancel(self):
+        """Stop reconnecting, e.g. on shutdown."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        """Retry every broker until one accepts us."""
+        self.backoff.reset()
+        while True:
+            try:
+                await self.connect()
+                break
+            except Exception:  # pylint: disable=broad-except
+                pass
+            delay = self.backoff.next()
+            _LOGGER.warning("Retrying in %.1f seconds...", delay)
+            await asyncio.sleep(delay)
+
+        self.reconnects += 1
+        self.time_to_reconnect = self.loop.time() - self._lost_at
+        _LOGGER.info("Reconnected successfully after %.2f seconds", self.time_to_reconnect)
@@ -0,0 +1,126 @@
+"""Topic Router Module."""
+import asyncio
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _Node:
+    """A level in the wildcard subscription tree."""
+
+    __slots__ = ("children", "handlers")
+
+    def __init__(self):
+        self.children = {}
+        self.handlers = []
+
+
+class TopicRouter:
+    """Map incoming topics to the handlers registered for them.
+
+    Filters without wildcards are looked up in a dict, filters containing
+    ``+`` or ``#`` live in a tree walked one topic level at a time, so the
+    cost of dispatching a message does not grow with the number of handlers
+    registered for other topics.
+    """
+
+    def __init__(self):
+        """Initialize the router."""
+        self._exact = {}
+        self._wildcards = _Node()
+        # Tasks of coroutine handlers, kept so they are not garbage collected mid-run
+        self._tasks = set()
+
+    def __len__(self) -> int:
+        """Return the number of registered handlers."""
+        count = sum(len(handlers) for handlers in self._exact.values())
+        stack = [self._wildcards]
+        while stack:
+            node = stack.pop()
+            count += len(node.handlers)
+            stack.extend(node.children.values())
+        return count
+
+    def add(self, topic_filter: str, handler) -> bool:
+        """Register ``handler`` for messages matching ``topic_filter``.
+
+        Adding a handler that is already registered for the filter is a no-op
+        and returns False, so callers can register on every connect.
+        """
+        if "+" not in topic_filter and "#" not in topic_filter:
+            handlers = self._exact.setdefault(topic_filter, [])
+        else:
+            node = self._wildcards
+            for level in topic_filter.split("/"):
+                node = node.children.setdefault(level, _Node())
+            handlers = node.handlers
+
+        if handler in handlers:
+            return False
+        handlers.append(handler)
+        return True
+
+    def remove(self, topic_filter: str, handler) -> bool:
+        """Unregister ``handler``, return False if it was not registered."""
+        if "+" not in topic_filter and "#" not in topic_filter:
+            handlers = self._exact.get(topic_filter, [])
+            if handler not in handlers:
+                return False
+            handlers.remove(handler)
+            if not handlers:
+                del self._exact[topic_filter]
+            return True
+
+        path = [self._wildcards]
+        levels = topic_filter.split("/")
+        for level in levels:
+            node = path[-1].children.get(level)
+            if node is None:
+                return False
+            path.append(node)
+        if handler not in path[-1].handlers:
+            return False
+        path[-1].handlers.remove(handler)
+
+        # Prune levels that no longer lead to a handler.
+        for level, node, parent in zip(reversed(levels), reversed(path[1:]), reversed(path[:-1])):
+            if node.handlers or node.children:
+                break
+            del parent.children[level]
+        return True
+
+    def match(self, topic: str) -> list:
+        """Return the handlers registered for ``topic``."""
+        handlers = list(self._exact.get(topic, ()))
+        if self._wildcards.children:
+            self._match_level(self._wildcards, topic.split("/"), 0, handlers)
+        return handlers
+
+    def _match_level(self, node: _Node, levels, index: int, out: list):
+        """Collect handlers below ``node`` matching ``levels[index:]``."""
+        multi = node.children.get("#")
+        if multi is not None:
+            out.extend(multi.handlers)
+        if index == len(levels):
+            out.extend(node.handlers)
+            return
+        for key in (levels[index], "+"):
+            child = node.children.get(key)
+            if child is not None:
+                self._match_level(child, levels, index + 1, out)
+
+    def dispatch(self, topic: str, payload):
+        """Call every handler for ``topic``, must run on the event loop.
+
+        Plain functions run inline, coroutine functions are scheduled as tasks.
+        """
+        for handler in self.match(topic):
+            try:
+                if asyncio.iscoroutinefunction(handler):
+                    task = asyncio.create_task(handler(topic, payload))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                else:
+                    handler(topic, payload)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Error handling message on %s", topic)
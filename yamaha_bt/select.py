@@ -1,5 +1,5 @@
 """Sensor Module."""
-from yamaha_bt.const import DEVICE_INFO, BASE_TOPIC, DEFAULT_QOS, DEVICE_UNIQUE_ID
+from yamaha_bt.const import DEFAULT_QOS
 from yamaha_bt.util import slugify
 from yamaha_bt.entity import Entity
 import json
@@ -30,24 +30,18 @@ def get_key_by_value(dictionary, target_value):
 
 
 class SelectEntity(Entity):
+    component = "select"
+
     async def register(self):
         self.discovery_msg.update({
-            "command_topic": f"{BASE_TOPIC}{self.unique_id}/command",
+            "command_topic": f"{self.device.base_topic}{self.unique_id}/command",
             "options": self.options,
         })
-        
-        discovery_topic = f"homeassistant/select/{self.unique_id}/config"
-        await self.device.mqtt.publish(
-            discovery_topic, json.dumps(self.discovery_msg), DEFAULT_QOS, True
-        )
+        await self.device.discovery.publish(self.discovery_topic, self.discovery_msg)
 
-        self.device.mqtt.add_msg_listner(self._handle_message)
-        await self.device.mqtt.perform_subscription(
-            self.discovery_msg["command_topic"], DEFAULT_QOS
+        self.device.mqtt.add_msg_listner(
+            self._handle_message, self.discovery_msg["command_topic"]
         )
-
-        await self.send_availability()
-
         await self.update()
     
     @property
@@ -55,13 +49,13 @@ class SelectEntity(Entity):
         return []
     
     def _handle_message(self, topic, payload):
-        if topic == self.discovery_msg["command_topic"]:
-            return self.handle_command(payload)
+        return self.handle_command(payload)
     
     def handle_command(self, payload):
         return 
 
 class InputSelect(SelectEntity):
+    state_fields = ("input",)
 
     def __init__(self, device):
         super().__init__(device)
@@ -84,16 +78,18 @@ class InputSelect(SelectEntity):
         if current_input is not None:
             current_input = INPUT_MAPPING[current_input]
             await self.device.mqtt.publish(self.discovery_msg["state_topic"], current_input, DEFAULT_QOS, True)
-        await self.send_availability()
     
     def handle_command(self, payload):
         LOGGER.info("New Command: %s", payload)
         new_input = get_key_by_value(INPUT_MAPPING, payload)
-        self.device.loop.create_task(self.device.yam.set_input(new_input))
+        self.device.optimistic.send(
+            self, "input", new_input, payload, self.device.yam.set_input(new_input)
+        )
         return 
 
 
 class SurroundSelect(SelectEntity):
+    state_fields = ("surround",)
 
     def __init__(self, device):
         super().__init__(device)
@@ -116,10 +112,11 @@ class SurroundSelect(SelectEntity):
         if current_surround is not None:
             current_surround = SURROUND_MAPPING[current_surround]
             await self.device.mqtt.publish(self.discovery_msg["state_topic"], current_surround, DEFAULT_QOS, True)
-        await self.send_availability()
     
     def handle_command(self, payload):
         LOGGER.info("New Command: %s", payload)
         new_input = get_key_by_value(SURROUND_MAPPING, payload)
-        self.device.loop.create_task(self.device.yam.set_surround(new_input))
+        self.device.optimistic.send(
+            self, "surround", new_input, payload, self.device.yam.set_surround(new_input)
+        )
         return 
\ No newline at end of file
@@ -1,5 +1,5 @@
 """Sensor Module."""
-from yamaha_bt.const import DEVICE_INFO, BASE_TOPIC, DEFAULT_QOS, DEVICE_UNIQUE_ID
+from yamaha_bt.const import DEFAULT_QOS
 from yamaha_bt.util import slugify
 from yamaha_bt.entity import Entity
 import json
@@ -7,18 +7,16 @@ import json
 MAX_VOLUME = 50
 
 class SensorEntity(Entity):
+    component = "sensor"
+
     async def register(self):       
-        discovery_topic = f"homeassistant/sensor/{self.unique_id}/config"
         self.discovery_msg["unit_of_measurement"] = "%"
-        await self.device.mqtt.publish(
-            discovery_topic, json.dumps(self.discovery_msg), DEFAULT_QOS, True
-        )
-
-        await self.send_availability()
+        await self.device.discovery.publish(self.discovery_topic, self.discovery_msg)
 
         await self.update()
 
 class VolumeSensor(SensorEntity):
+    state_fields = ("volume",)
 
     def __init__(self, device):
         super().__init__(device)
@@ -37,5 +35,4 @@ class VolumeSensor(SensorEntity):
         if volume is not None:
             volume_percentage = (volume / MAX_VOLUME)
 
-            await self.device.mqtt.publish(self.discovery_msg["state_topic"], volume_percentage, DEFAULT_QOS, True)
-        await self.send_availability()
\ No newline at end of file
+            await self.device.mqtt.publish(self.discovery_msg["state_topic"], volume_percentage, DEFAULT_QOS, True)
\ No newline at end of file
@@ -0,0 +1,295 @@
+"""Soundbar Simulator Module.
+
+Speaks the ``cc aa`` framing of the YAS-106 over any stream, keeps the state
+that :meth:`SoundBar.parse_device_status` decodes and answers ``0305`` status
+queries. Latency, jitter, split or coalesced writes and dropped replies can
+be configured to reproduce a flaky Bluetooth link.
+
+    python -m yamaha_bt.simulator --tcp 127.0.0.1:7000 --latency 0.03 --jitter 0.01
+
+and run the bridge with ``SOUNDBAR_TRANSPORT=tcp://127.0.0.1:7000``.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tty
+
+from yamaha_bt.codec import (
+    BASS_EXT_FLAG,
+    CLEARVOICE_FLAG,
+    COMMANDS,
+    INPUT_NAMES,
+    STATUS_REPLY_TYPE,
+    SURROUND_NAMES,
+    VOLUME_MAX,
+    FrameDecoder,
+    encode,
+)
+from yamaha_bt.transport import open_fd_streams
+
+_LOGGER = logging.getLogger(__name__)
+
+SUBWOOFER_MAX = 32
+SUBWOOFER_STEP = 4
+
+INPUT_CODES = {name: code for code, name in INPUT_NAMES.items()}
+SURROUND_CODES = {name: code for code, name in SURROUND_NAMES.items()}
+COMMAND_NAMES = {bytes.fromhex(hex_): name for name, hex_ in COMMANDS.items()}
+
+
+class SoundBarSimulator:
+    """A simulated soundbar serving any number of stream connections.
+
+    ``latency`` and ``jitter`` (seconds) delay each status reply, replies are
+    still sent in order. ``split`` writes replies in chunks of that many
+    bytes, ``coalesce`` (seconds) merges replies due within that window into
+    one write and ``drop_rate`` is the share of status queries left
+    unanswered.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        split: int = 0,
+        coalesce: float = 0.0,
+        drop_rate: float = 0.0,
+        seed: int = None,
+    ):
+        """Initialize the simulator powered on, on HDMI."""
+        self.latency = latency
+        self.jitter = jitter
+        self.split = split
+        self.coalesce = coalesce
+        self.drop_rate = drop_rate
+        self._random = random.Random(seed)
+
+        self.power = True
+        self.input = "hdmi"
+        self.mute = False
+        self.volume = 10
+        self.subwoofer = 16
+        self.surround = "stereo"
+        self.bass_ext = False
+        self.clearvoice = False
+        self.bluetooth_standby = False
+        self.dimmer = 0
+
+        self.commands = 0
+        self.status_requests = 0
+        self.replies_dropped = 0
+        self.unknown_frames = 0
+        self._servers = []
+        self._ptys = []
+        self._connections = {}
+
+    def apply(self, name: str) -> bool:
+        """Apply the command ``name`` from COMMANDS, return False if it was ignored."""
+        self.commands += 1
+        if name in ("power_on", "power_off", "power_toggle"):
+            self.power = {"power_on": True, "power_off": False}.get(name, not self.power)
+            return True
+        if not self.power:
+            # Like the real thing, only power commands work in standby.
+            return False
+
+        if name.startswith("set_input_"):
+            self.input = name[len("set_input_"):]
+        elif name.startswith("set_surround_"):
+            self.surround = name[len("set_surround_"):]
+        elif name == "surround_toggle":
+            self.surround = "3d" if self.surround == "movie" else "movie"
+        elif name == "volume_up":
+            self.volume = min(self.volume + 1, VOLUME_MAX)
+        elif name == "volume_down":
+            self.volume = max(self.volume - 1, 0)
+        elif name == "subwoofer_up":
+            self.subwoofer = min(self.subwoofer + SUBWOOFER_STEP, SUBWOOFER_MAX)
+        elif name == "subwoofer_down":
+            self.subwoofer = max(self.subwoofer - SUBWOOFER_STEP, 0)
+        elif name == "bluetooth_standby_toggle":
+            self.bluetooth_standby = not self.bluetooth_standby
+        elif name == "dimmer":
+            self.dimmer = (self.dimmer + 1) % 3
+        else:
+            field, _, action = name.rpartition("_")
+            if field not in ("mute", "clearvoice", "bass_ext"):
+                return False
+            value = {"on": True, "off": False}.get(action, not getattr(self, field))
+            setattr(self, field, value)
+        return True
+
+    def status_payload(self) -> bytes:
+        """Return the payload of a status reply for the current state."""
+        surround = SURROUND_CODES[self.surround]
+        flags = (BASS_EXT_FLAG if self.bass_ext else 0) | (
+            CLEARVOICE_FLAG if self.clearvoice else 0
+        )
+        return bytes(
+            [
+                STATUS_REPLY_TYPE,
+                0x00,
+                int(self.power),
+                INPUT_CODES[self.input],
+                int(self.mute),
+                self.volume,
+                self.subwoofer,
+                0x00,
+                0x00,
+                0x00,
+                surround >> 8,
+                surround & 0xFF,
+                flags,
+            ]
+        )
+
+    def status_frame(self) -> bytes:
+        """Return a framed status reply."""
+        return encode(self.status_payload())
+
+    def handle_frame(self, frame) -> bool:
+        """Apply one received frame, return True if it asks for a status reply."""
+        name = COMMAND_NAMES.get(bytes(frame[3:-1]))
+        if name is None:
+            self.unknown_frames += 1
+            _LOGGER.warning("Unknown frame %s", bytes(frame).hex())
+            return False
+        if name == "report_status":
+            self.status_requests += 1
+            return True
+        self.apply(name)
+        return False
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve one connection until it is closed."""
+        loop = asyncio.get_running_loop()
+        replies = asyncio.Queue()
+        sender = asyncio.create_task(self._send_replies(replies, writer))
+        decoder = FrameDecoder()
+        last_due = 0.0
+        self._connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                data = await reader.read(1024)
+                if not data:
+                    break
+                for frame in decoder.feed(data):
+                    if not self.handle_frame(frame):
+                        continue
+                    if self._random.random() < self.drop_rate:
+                        self.replies_dropped += 1
+                        continue
+                    delay = self.latency + self._random.uniform(0, self.jitter)
+                    # The link is serial, a reply never overtakes an earlier one.
+                    last_due = max(loop.time() + delay, last_due)
+                    replies.put_nowait((last_due, self.status_frame()))
+        except ConnectionError:
+            pass
+        finally:
+            del self._connections[asyncio.current_task()]
+            sender.cancel()
+            writer.close()
+
+    async def _send_replies(self, replies: asyncio.Queue, writer: asyncio.StreamWriter):
+        """Write replies when they are due."""
+        loop = asyncio.get_running_loop()
+        while True:
+            due, data = await replies.get()
+            await asyncio.sleep(max(0.0, due - loop.time()))
+            # Merge everything due within the coalescing window into one write.
+            while self.coalesce and not replies.empty():
+                due, frame = replies._queue[0]  # pylint: disable=protected-access
+                if due - loop.time() > self.coalesce:
+                    break
+                replies.get_nowait()
+                await asyncio.sleep(max(0.0, due - loop.time()))
+                data += frame
+
+            if self.split:
+                for pos in range(0, len(data), self.split):
+                    writer.write(data[pos:pos + self.split])
+                    await writer.drain()
+                    # Give the receiver a chance to read the chunk on its own.
+                    await asyncio.sleep(0.001)
+            else:
+                writer.write(data)
+                await writer.drain()
+
+    async def start_tcp(self, host: str = "127.0.0.1", port: int = 0):
+        """Listen on TCP, return the bound ``(host, port)``."""
+        server = await asyncio.start_server(self.serve, host, port)
+        self._servers.append(server)
+        return server.sockets[0].getsockname()[:2]
+
+    async def start_unix(self, path: str):
+        """Listen on a Unix socket."""
+        server = await asyncio.start_unix_server(self.serve, path)
+        self._servers.append(server)
+
+    async def start_pty(self) -> str:
+        """Serve a new PTY, return the path the bridge should open."""
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        reader, writer, read_transport = await open_fd_streams(master)
+        # Keep the slave open so the PTY survives the bridge reconnecting.
+        task = asyncio.create_task(self.serve(reader, writer))
+        self._ptys.append((slave, read_transport, task))
+        return os.ttyname(slave)
+
+    async def stop(self):
+        """Stop listening."""
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers.clear()
+        # Closing the transport ends the read loop of each connection.
+        for writer in list(self._connections.values()):
+            writer.transport.abort()
+        for _slave, read_transport, _task in self._ptys:
+            read_transport.close()
+        await asyncio.gather(*self._connections, *(task for _, _, task in self._ptys))
+        for slave, _read_transport, _task in self._ptys:
+            os.close(slave)
+        self._ptys.clear()
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Simulated Yamaha soundbar")
+    parser.add_argument("--tcp", help="host:port to listen on")
+    parser.add_argument("--unix", help="Unix socket path to listen on")
+    parser.add_argument("--pty", action="store_true", help="serve a PTY and print its path")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--split", type=int, default=0)
+    parser.add_argument("--coalesce", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    return parser.parse_args()
+
+
+async def run(args):
+    simulator = SoundBarSimulator(
+        latency=args.latency,
+        jitter=args.jitter,
+        split=args.split,
+        coalesce=args.coalesce,
+        drop_rate=args.drop_rate,
+        seed=args.seed,
+    )
+    if args.tcp:
+        host, _, port = args.tcp.rpartition(":")
+        host, port = await simulator.start_tcp(host or "127.0.0.1", int(port))
+        _LOGGER.info("Listening on tcp://%s:%s", host, port)
+    if args.unix:
+        await simulator.start_unix(args.unix)
+        _LOGGER.info("Listening on unix://%s", args.unix)
+    if args.pty:
+        _LOGGER.info("Serving serial://%s", await simulator.start_pty())
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(get_args()))
@@ -1,5 +1,5 @@
 """Sensor Module."""
-from yamaha_bt.const import DEVICE_INFO, BASE_TOPIC, DEFAULT_QOS, DEVICE_UNIQUE_ID
+from yamaha_bt.const import DEFAULT_QOS
 from yamaha_bt.util import slugify
 from yamaha_bt.entity import Entity
 import json
@@ -9,34 +9,28 @@ import asyncio
 LOGGER = logging.getLogger(__name__)
 
 class SwitchEntity(Entity):
+    component = "switch"
+
     async def register(self):
         self.discovery_msg.update({
-            "command_topic": f"{BASE_TOPIC}{self.unique_id}/command",
+            "command_topic": f"{self.device.base_topic}{self.unique_id}/command",
         })
-        
-        discovery_topic = f"homeassistant/switch/{self.unique_id}/config"
-        await self.device.mqtt.publish(
-            discovery_topic, json.dumps(self.discovery_msg), DEFAULT_QOS, True
-        )
+        await self.device.discovery.publish(self.discovery_topic, self.discovery_msg)
 
-        self.device.mqtt.add_msg_listner(self._handle_message)
-        await self.device.mqtt.perform_subscription(
-            self.discovery_msg["command_topic"], DEFAULT_QOS
+        self.device.mqtt.add_msg_listner(
+            self._handle_message, self.discovery_msg["command_topic"]
         )
-
-        await self.send_availability()
-
         await self.update()
     
     
     def _handle_message(self, topic, payload):
-        if topic == self.discovery_msg["command_topic"]:
-            return self.handle_command(payload)
+        return self.handle_command(payload)
     
     def handle_command(self, payload):
         return 
 
 class PowerSwitch(SwitchEntity):
+    state_fields = ("power",)
 
     def __init__(self, device):
         super().__init__(device)
@@ -58,14 +52,17 @@ class PowerSwitch(SwitchEntity):
             else:
                 payload = "OFF"
             await self.device.mqtt.publish(self.discovery_msg["state_topic"], payload, DEFAULT_QOS, True)
-        await self.send_availability()
     
     def handle_command(self, payload):
         LOGGER.info("New Command: %s", payload)
         desired_state = payload == "ON"
-        self.device.loop.create_task(self.device.yam.set_power(desired_state))
+        self.device.optimistic.send(
+            self, "power", desired_state, "ON" if desired_state else "OFF",
+            self.device.yam.set_power(desired_state)
+        )
 
 class MuteSwitch(SwitchEntity):
+    state_fields = ("mute",)
 
     def __init__(self, device):
         super().__init__(device)
@@ -87,14 +84,17 @@ class MuteSwitch(SwitchEntity):
             else:
                 payload = "OFF"
             await self.device.mqtt.publish(self.discovery_msg["state_topic"], payload, DEFAULT_QOS, True)
-        await self.send_availability()
     
     def handle_command(self, payload):
         LOGGER.info("New Command: %s", payload)
         desired_state = payload == "ON"
-        self.device.loop.create_task(self.device.yam.set_mute(desired_state))
+        self.device.optimistic.send(
+            self, "mute", desired_state, "ON" if desired_state else "OFF",
+            self.device.yam.set_mute(desired_state)
+        )
 
 class ClearVoiceSwitch(SwitchEntity):
+    state_fields = ("clearvoice",)
 
     def __init__(self, device):
         super().__init__(device)
@@ -116,14 +116,17 @@ class ClearVoiceSwitch(SwitchEntity):
             else:
                 payload = "OFF"
             await self.device.mqtt.publish(self.discovery_msg["state_topic"], payload, DEFAULT_QOS, True)
-        await self.send_availability()
     
     def handle_command(self, payload):
         LOGGER.info("New Command: %s", payload)
         desired_state = payload == "ON"
-        self.device.loop.create_task(self.device.yam.set_clear_voice(desired_state))
+        self.device.optimistic.send(
+            self, "clearvoice", desired_state, "ON" if desired_state else "OFF",
+            self.device.yam.set_clear_voice(desired_state)
+        )
 
 class BassBoostSwitch(SwitchEntity):
+    state_fields = ("bass_ext",)
 
     def __init__(self, device):
         super().__init__(device)
@@ -145,9 +148,11 @@ class BassBoostSwitch(SwitchEntity):
             else:
                 payload = "OFF"
             await self.device.mqtt.publish(self.discovery_msg["state_topic"], payload, DEFAULT_QOS, True)
-        await self.send_availability()
     
     def handle_command(self, payload):
         LOGGER.info("New Command: %s", payload)
         desired_state = payload == "ON"
-        self.device.loop.create_task(self.device.yam.set_bass_boost(desired_state))
\ No newline at end of file
+        self.device.optimistic.send(
+            self, "bass_ext", desired_state, "ON" if desired_state else "OFF",
+            self.device.yam.set_bass_boost(desired_state)
+        )
\ No newline at end of file
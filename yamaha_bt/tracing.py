@@ -0,0 +1,156 @@
+"""Command Tracing Module.
+
+Follows a command from the MQTT message through the command scheduler,
+the soundbar write and status reply to the state publish. Every stage is
+timestamped on a :class:`Trace` carrying a correlation id, and the time
+between stages is collected in histograms of the metrics registry.
+
+Traces travel with the asyncio context (a ``ContextVar``), so tasks created
+while handling a command inherit them. Where work for several commands is
+merged (the scheduler burst, the status reply) the traces are handed over
+explicitly. While tracing is off every hook returns after a single
+attribute check.
+"""
+from collections import deque
+import contextvars
+import itertools
+import logging
+import time
+
+from yamaha_bt.metrics import registry
+
+_LOGGER = logging.getLogger(__name__)
+
+# Finished traces kept for inspection
+RECENT_TRACES = 100
+# Only messages on command topics start a trace
+COMMAND_TOPIC_SUFFIX = "/command"
+
+_current = contextvars.ContextVar("yamaha_bt_traces", default=())
+
+
+class Trace:
+    """Timestamps of one command, ``stages`` is a list of ``(stage, perf_counter)``."""
+
+    __slots__ = ("id", "name", "stages", "done")
+
+    def __init__(self, trace_id: int, name: str):
+        self.id = trace_id
+        self.name = name
+        self.stages = []
+        self.done = False
+
+    def mark(self, stage: str):
+        self.stages.append((stage, time.perf_counter()))
+
+    def __repr__(self):
+        start = self.stages[0][1] if self.stages else 0
+        steps = " ".join(f"{stage}=+{(at - start) * 1000:.1f}ms" for stage, at in self.stages)
+        return f"trace {self.id} {self.name}: {steps}"
+
+
+class Tracer:
+    """Creates traces and aggregates the finished ones."""
+
+    def __init__(self):
+        self.enabled = False
+        self._ids = itertools.count(1)
+        # Seconds spent reaching each stage from the one before, "total" for the whole trace
+        self.histograms = {}
+        self.recent = deque(maxlen=RECENT_TRACES)
+        self.finished = 0
+
+    def start(self, name: str, stage: str):
+        """Start a trace at ``stage``, returns None while tracing is off."""
+        if not self.enabled:
+            return None
+        trace = Trace(next(self._ids), name)
+        trace.mark(stage)
+        return trace
+
+    def finish(self, trace: Trace, stage: str):
+        """Mark the last stage and record the stage latencies."""
+        if trace.done:
+            return
+        trace.mark(stage)
+        trace.done = True
+        previous = trace.stages[0][1]
+        stages = trace.stages
+        for index in range(1, len(stages)):
+            name, at = stages[index]
+            # A stage repeated in a row (one write per command of a burst) counts once.
+            if index + 1 < len(stages) and stages[index + 1][0] == name:
+                continue
+            self._histogram(name).observe(at - previous)
+            previous = at
+        self._histogram("total").observe(previous - trace.stages[0][1])
+        self.recent.append(trace)
+        self.finished += 1
+        _LOGGER.debug("%r", trace)
+
+    def _histogram(self, stage: str):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = registry.histogram(
+                "yamaha_bt_command_stage_seconds",
+                "Time a traced command took to reach each stage",
+                stage=stage,
+            )
+        return histogram
+
+    def summary(self) -> str:
+        """Return one line per stage for the log."""
+        return "\n".join(
+            f"{stage:16} n={h.count:<6} mean={h.total / h.count * 1000:8.1f}ms "
+            f"p50<={h.quantile(0.5) * 1000:g}ms p99<={h.quantile(0.99) * 1000:g}ms"
+            for stage, h in self.histograms.items()
+        )
+
+    def snapshot(self) -> dict:
+        """Return the histograms of the time spent reaching each stage."""
+        return {stage: histogram.get() for stage, histogram in self.histograms.items()}
+
+
+tracer = Tracer()
+
+
+def start_command(topic: str):
+    """Start a trace for a message on a command topic, None for anything else."""
+    if not tracer.enabled or not topic.endswith(COMMAND_TOPIC_SUFFIX):
+        return None
+    return tracer.start(topic, "mqtt_received")
+
+
+def current() -> tuple:
+    """Return the traces of the running context."""
+    if not tracer.enabled:
+        return ()
+    return _current.get()
+
+
+def activate(traces) -> contextvars.Token:
+    """Make ``traces`` the traces of the running context (and tasks created from it)."""
+    return _current.set(tuple(traces))
+
+
+def context_with(traces) -> contextvars.Context:
+    """Return a copy of the current context carrying ``traces``."""
+    context = contextvars.copy_context()
+    context.run(_current.set, tuple(traces))
+    return context
+
+
+def mark(stage: str):
+    """Mark ``stage`` on the traces of the running context."""
+    if not tracer.enabled:
+        return
+    for trace in _current.get():
+        trace.mark(stage)
+
+
+def finish(stage: str, traces=None):
+    """Finish ``traces`` (default: those of the running context) at ``stage``."""
+    if not tracer.enabled:
+        return
+    for trace in _current.get() if traces is None else traces:
+        tracer.finish(trace, stage)
@@ -0,0 +1,211 @@
+"""Transport Module.
+
+A transport opens the byte stream to the soundbar. The soundbar itself is
+only reachable over Bluetooth RFCOMM, the other transports reach it through
+a gateway (e.g. ser2net or socat) or a simulator, so the bridge can run
+without Bluetooth hardware.
+"""
+import asyncio
+import os
+import socket
+import termios
+import tty
+from urllib.parse import parse_qs, urlsplit
+
+import anyio
+
+RFCOMM_CHANNEL = 1
+# Seconds the blocking RFCOMM connect may take
+RFCOMM_CONNECT_TIMEOUT = 1
+SERIAL_BAUDRATE = 115200
+
+
+class _PipeWriteProtocol(asyncio.streams.FlowControlMixin):
+    """Flow control for the write side of a serial port."""
+
+    def __init__(self):
+        super().__init__()
+        self._closed = asyncio.get_running_loop().create_future()
+
+    def connection_lost(self, exc):
+        super().connection_lost(exc)
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    def _get_close_waiter(self, _stream):
+        return self._closed
+
+
+async def open_fd_streams(fd: int):
+    """Wrap a tty file descriptor in streams.
+
+    Returns ``(reader, writer, read_transport)``, closing the writer leaves
+    the read side open.
+    """
+    loop = asyncio.get_running_loop()
+    # Read and write side each own a descriptor so each transport can close its own.
+    read_file = os.fdopen(fd, "rb", buffering=0)
+    write_file = os.fdopen(os.dup(fd), "wb", buffering=0)
+
+    reader = asyncio.StreamReader()
+    read_transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), read_file
+    )
+    write_transport, protocol = await loop.connect_write_pipe(_PipeWriteProtocol, write_file)
+    writer = asyncio.StreamWriter(write_transport, protocol, reader, loop)
+    return reader, writer, read_transport
+
+
+class Transport:
+    """Base class, subclasses implement :meth:`_open`."""
+
+    def __init__(self):
+        """Initialize the transport."""
+        self.writer: asyncio.StreamWriter = None
+
+    async def open(self):
+        """Open the stream and return a ``(reader, writer)`` pair."""
+        reader, self.writer = await self._open()
+        return reader, self.writer
+
+    async def _open(self):
+        raise NotImplementedError
+
+    def close(self):
+        """Close the stream opened last."""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class RfcommTransport(Transport):
+    """Bluetooth RFCOMM socket to the soundbar."""
+
+    def __init__(self, address: str, channel: int = RFCOMM_CHANNEL):
+        """Initialize the transport for the soundbar at ``address``."""
+        super().__init__()
+        self.address = address
+        self.channel = channel
+
+    def __repr__(self):
+        return f"rfcomm://{self.address}:{self.channel}"
+
+    def _connect_to_socket(self):
+        """Create a connection to the socket."""
+        sock = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+        sock.settimeout(RFCOMM_CONNECT_TIMEOUT)
+        try:
+            sock.connect((self.address, self.channel))
+        except Exception as e:
+            sock.close()
+            raise e
+
+        return sock
+
+    async def _open(self):
+        sock = await anyio.to_thread.run_sync(self._connect_to_socket)
+        return await asyncio.open_connection(sock=sock)
+
+
+class TcpTransport(Transport):
+    """TCP connection to a serial gateway or simulator."""
+
+    def __init__(self, host: str, port: int):
+        """Initialize the transport."""
+        super().__init__()
+        self.host = host
+        self.port = port
+
+    def __repr__(self):
+        return f"tcp://{self.host}:{self.port}"
+
+    async def _open(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            # Commands are a few bytes each, do not let Nagle hold them back.
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return reader, writer
+
+
+class UnixTransport(Transport):
+    """Unix domain socket, e.g. a local simulator."""
+
+    def __init__(self, path: str):
+        """Initialize the transport."""
+        super().__init__()
+        self.path = path
+
+    def __repr__(self):
+        return f"unix://{self.path}"
+
+    async def _open(self):
+        return await asyncio.open_unix_connection(self.path)
+
+
+class SerialTransport(Transport):
+    """Serial port or PTY, put into raw mode."""
+
+    def __init__(self, path: str, baudrate: int = SERIAL_BAUDRATE):
+        """Initialize the transport, raise ValueError for a baud rate termios does not know."""
+        super().__init__()
+        self.path = path
+        self.baudrate = baudrate
+        self._speed = getattr(termios, f"B{baudrate}", None)
+        if self._speed is None:
+            raise ValueError(f"Unsupported serial baud rate {baudrate} for {path}")
+        self._read_transport = None
+
+    def __repr__(self):
+        return f"serial://{self.path}?baud={self.baudrate}"
+
+    def _open_port(self) -> int:
+        """Open the device in raw mode and return its file descriptor."""
+        fd = os.open(self.path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            tty.setraw(fd)
+            attrs = termios.tcgetattr(fd)
+            attrs[4] = attrs[5] = self._speed
+            termios.tcsetattr(fd, termios.TCSANOW, attrs)
+        except Exception:
+            os.close(fd)
+            raise
+        return fd
+
+    async def _open(self):
+        reader, writer, self._read_transport = await open_fd_streams(self._open_port())
+        return reader, writer
+
+    def close(self):
+        """Close both sides of the port."""
+        super().close()
+        if self._read_transport is not None:
+            self._read_transport.close()
+            self._read_transport = None
+
+
+def create_transport(url: str) -> Transport:
+    """Create a transport from a URL.
+
+    Supported forms are ``rfcomm://AA:BB:CC:DD:EE:FF[:channel]``,
+    ``tcp://host:port``, ``unix:///path/to/socket`` and
+    ``serial:///dev/ttyUSB0[?baud=115200]``.
+    """
+    parts = urlsplit(url)
+    if parts.scheme == "rfcomm":
+        # A Bluetooth address contains colons, the channel is the optional 7th field.
+        fields = parts.netloc.split(":")
+        channel = int(fields.pop()) if len(fields) == 7 else RFCOMM_CHANNEL
+        return RfcommTransport(":".join(fields), channel)
+    if parts.scheme == "tcp":
+        if not parts.hostname or not parts.port:
+            raise ValueError(f"TCP transport needs host and port: {url}")
+        return TcpTransport(parts.hostname, parts.port)
+    if parts.scheme == "unix":
+        return UnixTransport(parts.path)
+    if parts.scheme == "serial":
+        baud = parse_qs(parts.query).get("baud", [SERIAL_BAUDRATE])[0]
+        if not str(baud).isdigit():
+            raise ValueError(f"Serial baud rate must be a number: {url}")
+        return SerialTransport(parts.path, int(baud))
+    raise ValueError(f"Unsupported soundbar transport: {url}")
@@ -1,98 +1,78 @@
 """Yamaha Module."""
-import socket
 import asyncio
-import anyio
-from datetime import datetime, timedelta
+from datetime import timedelta
+from enum import Enum
 import logging
+import time
+
+from yamaha_bt import tracing
+from yamaha_bt.backoff import Backoff
+from yamaha_bt.codec import (  # noqa: F401, re-exported for existing imports
+    COMMANDS,
+    INPUT_NAMES,
+    SURROUND_NAMES,
+    VOLUME_MAX,
+    DeviceStatus,
+    FrameDecoder,
+    decode_status,
+    encode,
+    is_status_frame,
+)
+from yamaha_bt.commands import CommandScheduler
+from yamaha_bt.liveness import MISSED_POLLS_LIMIT, LinkMonitor
+from yamaha_bt.metrics import Histogram
+from yamaha_bt.transport import RfcommTransport, Transport
 
 LOGGER = logging.getLogger(__name__)
 
 HEARTBEAT_INTERVAL = timedelta(seconds=1)
+# Polling backs off toward this ceiling while nothing changes
+HEARTBEAT_MAX_INTERVAL = timedelta(seconds=10)
+HEARTBEAT_BACKOFF = 1.5
+
+# How long to wait for the status reply to a command
+STATUS_TIMEOUT = 2.0
+# How often the watchdog checks the link health (seconds)
+WATCHDOG_INTERVAL = 0.25
+
+# Reconnect delays (seconds), growing exponentially with jitter
+CONNECT_MIN_DELAY = 1
+CONNECT_MAX_DELAY = 60
+CONNECT_TIMEOUT = 5
+# A link that stayed up this long resets the backoff (seconds)
+STABLE_LINK_TIME = 30
+# How long a command waits for a link that is being (re)established
+COMMAND_CONNECT_TIMEOUT = 2
+# Extra bursts set_volume sends when the confirmed volume is still off target
+VOLUME_CORRECTIONS = 2
+
+class LinkState(Enum):
+    """State of the connection to the soundbar."""
+
+    DISCONNECTED = "disconnected"
+    CONNECTING = "connecting"
+    CONNECTED = "connected"
+    CLOSING = "closing"
+
+
+class SoundBarNotConnected(ConnectionError):
+    """Raised when a command cannot be sent because the link is down."""
 
-# Mapping of input values to names
-INPUT_NAMES = {
-    0x0: 'hdmi',
-    0xc: 'analog',
-    0x5: 'bluetooth',
-    0x7: 'tv',
-}
-
-# Mapping of surround values to names
-SURROUND_NAMES = {
-    0x0d: '3d',
-    0x0a: 'tv',
-    0x0100: 'stereo',
-    0x03: 'movie',
-    0x08: 'music',
-    0x09: 'sports',
-    0x0c: 'game',
-}
-
-COMMANDS = {
-    # power management
-    'power_toggle': "4078cc",
-    'power_on': "40787e",
-    'power_off': "40787f",
-
-    # input management
-    'set_input_hdmi': "40784a",
-    'set_input_analog': "4078d1",
-    'set_input_bluetooth': "407829",
-    'set_input_tv': "4078df",
-
-    # surround management
-    'set_surround_3d': "4078c9", # -- 3d surround
-    'set_surround_tv': "407ef1", # -- tv program
-    'set_surround_stereo': "407850",
-    'set_surround_movie': "4078d9",
-    'set_surround_music': "4078da",
-    'set_surround_sports': "4078db",
-    'set_surround_game': "4078dc",
-    'surround_toggle': "4078b4", # -- sets surround to `:movie` (or `:"3d"` if already `:movie`)
-    'clearvoice_toggle': "40785c",
-    'clearvoice_on': "407e80",
-    'clearvoice_off': "407e82",
-    'bass_ext_toggle': "40788b",
-    'bass_ext_on': "40786e",
-    'bass_ext_off': "40786f",
-
-    # volume management
-    'subwoofer_up': "40784c",
-    'subwoofer_down': "40784d",
-    'mute_toggle': "40789c",
-    'mute_on': "407ea2",
-    'mute_off': "407ea3",
-    'volume_up': "40781e",
-    'volume_down': "40781f",
-
-    # extra -- IR -- don't use?
-    'bluetooth_standby_toggle': "407834",
-    'dimmer': "4078ba",
-
-    # status report (query, soundbar returns a message)
-    'report_status': "0305"
-}
-
-
-
-def csum(len, pload):
-    return -(len + sum(pload)) & 0xff
-
-def encode(packet) -> bytes:
-    if isinstance(packet, str):
-        pload = bytearray.fromhex(packet)
-        csum_value = csum(len(pload), pload)
-        return bytes([0xcc, 0xaa, len(pload), *pload, csum_value])
-    else:
-        pload = list(packet)
-        csum_value = csum(len(pload), pload)
-        return ''.join([chr(x) for x in [0xcc, 0xaa, len(pload)] + pload + [csum_value]])
 
 class SoundBar:
-    def __init__(self, bt_attr, bt_port=1, loop=None):
+    def __init__(
+        self,
+        bt_attr,
+        bt_port=1,
+        loop=None,
+        heartbeat_max_interval=HEARTBEAT_MAX_INTERVAL,
+        transport: Transport = None,
+    ):
         self.bt_attr = bt_attr
         self.bt_port = bt_port
         self.loop = loop
+        # RFCOMM to bt_attr unless another transport is given
+        self.transport = transport or RfcommTransport(bt_attr, bt_port)
 
         self.reader = None
         self.writer = None
@@ -102,188 +82,434 @@ class SoundBar:
         self.watchdog_task = None
         self.state = {}
         self.state_update_callback = None
-        self.connected = False
-        self.last_recieved = datetime.now()
-        self.heartbeat_event = asyncio.Event()
+        self.connection_callback = None
+        # Running callback tasks, kept so they are not garbage collected mid-run
+        self._callback_tasks = set()
+        self.link_state = LinkState.DISCONNECTED
+        self.backoff = Backoff(CONNECT_MIN_DELAY, CONNECT_MAX_DELAY)
+        self.reconnects = 0
+        self._connect_task = None
+        self._volume_requests = 0
+        self._attempted = asyncio.Event()
+        self._link_up = asyncio.Event()
+        self._link_lost = asyncio.Event()
+        self._connected_at = None
+        self.decoder = FrameDecoder()
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.rtt_histogram = Histogram()
+        self.scheduler = CommandScheduler(
+            self, COMMANDS["volume_up"], COMMANDS["volume_down"]
+        )
 
-        self.sock: socket.socket = None
+        self.heartbeat_min_interval = HEARTBEAT_INTERVAL.total_seconds()
+        self.heartbeat_max_interval = max(
+            heartbeat_max_interval.total_seconds(), self.heartbeat_min_interval
+        )
+        self.poll_interval = self.heartbeat_min_interval
+        self.polls_skipped = 0
+        # Polls happen at least every heartbeat_max_interval, allow a few to go missing.
+        self.monitor = LinkMonitor(
+            max_silence=self.heartbeat_max_interval * (MISSED_POLLS_LIMIT + 1)
+        )
+        self._last_status = 0.0
+        self._activity = asyncio.Event()
     
+    @property
+    def connected(self) -> bool:
+        return self.link_state is LinkState.CONNECTED
+
     async def set_surround(self, surround):
         surround_str = "set_surround_" + surround
         command = COMMANDS.get(surround_str)
         if command is None:
             raise ValueError("Surround not found")
-        await self._send_command(command)
-        await self.report_status()
+        return await self.scheduler.set("surround", command)
     
     async def set_input(self, input):
         input_str = "set_input_" + input
         command = COMMANDS.get(input_str)
         if command is None:
             raise ValueError("Input not found")
-        await self._send_command(command)
-        await self.report_status()
+        return await self.scheduler.set("input", command)
     
     async def set_power(self, power: bool):
         if power is True:
-            command = COMMANDS["power_on"]
+            return await self.scheduler.set("power_on", COMMANDS["power_on"])
         else:
-            command = COMMANDS["power_off"]
-        await self._send_command(command)
-        if power is False:
-            await self.close()
-
-        await self.report_status()
+            # The scheduler closes the link once power off was sent.
+            return await self.scheduler.set("power_off", COMMANDS["power_off"])
     
     async def set_bass_boost(self, state: bool):
         if state is True:
             command = COMMANDS["bass_ext_on"]
         else:
             command = COMMANDS["bass_ext_off"]
-        await self._send_command(command)
-        await self.report_status()
+        return await self.scheduler.set("bass_ext", command)
     
     async def set_clear_voice(self, state: bool):
         if state is True:
             command = COMMANDS["clearvoice_on"]
         else:
             command = COMMANDS["clearvoice_off"]
-        await self._send_command(command)
-        await self.report_status()
+        return await self.scheduler.set("clearvoice", command)
     
     async def set_mute(self, mute: bool):
         if mute is True:
             command = COMMANDS["mute_on"]
         else:
             command = COMMANDS["mute_off"]
-        await self._send_command(command)
-        await self.report_status()
+        return await self.scheduler.set("mute", command)
     
     async def volume_up(self):
-        command = COMMANDS["volume_up"]
-        await self._send_command(command)
-        await self.report_status()
+        return await self.scheduler.step_volume(1)
     
     async def volume_down(self):
-        command = COMMANDS["volume_down"]
-        await self._send_command(command)
-        await self.report_status()
+        return await self.scheduler.step_volume(-1)
     
+    async def set_volume(self, target: int):
+        """Step the volume to ``target`` in one burst confirmed by one status report.
+
+        Steps the soundbar missed are made up by another burst, at most
+        VOLUME_CORRECTIONS times, each worked out from the reply to the poll
+        of the burst before. Returns the confirmed state.
+        """
+        self._volume_requests += 1
+        request = self._volume_requests
+        previous = self.state.get("volume")
+        state = await self.scheduler.set_volume(min(max(int(target), 0), VOLUME_MAX))
+        for _ in range(VOLUME_CORRECTIONS):
+            # Volume taps merged into the burst moved the target, correct
+            # towards that. Taps after it or a newer set_volume take over, and
+            # steps are ignored in standby or without a link (power off drops it).
+            target = self.scheduler.volume_target
+            if (
+                target is None
+                or request != self._volume_requests
+                or state is None
+                or not state.get("power")
+                or state.get("volume") == target
+            ):
+                break
+            volume = state.get("volume")
+            if (
+                previous is not None
+                and volume is not None
+                and abs(volume - target) > abs(previous - target)
+            ):
+                # More steps would make it worse, e.g. someone else turns the volume.
+                LOGGER.warning(
+                    "Volume went from %s to %s, away from %s, not correcting", previous, volume, target
+                )
+                break
+            LOGGER.info("Volume is %s instead of %s, correcting", volume, target)
+            previous = volume
+            state = await self.scheduler.set_volume(target)
+        return state
+
     async def toggle_bl_standby(self):
-        command = COMMANDS["bluetooth_standby_toggle"]
-        await self._send_command(command)
-        await self.report_status()
+        return await self.scheduler.toggle(COMMANDS["bluetooth_standby_toggle"])
     
-    async def report_status(self):
-        command = COMMANDS["report_status"]
-        await self._send_command(command)
+    async def report_status(self, future=None):
+        """Ask for a status report, ``future`` gets the state from the reply to it."""
+        traces = tracing.current()
+        if traces:
+            tracing.mark("status_requested")
+        # The reply confirms the commands traced in this context.
+        request = (future, traces) if future is not None or traces else None
+        await self._send_command(COMMANDS["report_status"], request)
+
+    async def request_status(self, timeout=STATUS_TIMEOUT):
+        """Ask for a status report and return the parsed state from its reply.
+
+        Replies come in the order of the requests, so a poll that was still
+        in flight does not answer this one with an older state. Raises
+        ``asyncio.TimeoutError`` if the reply does not arrive within
+        ``timeout`` seconds.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.report_status(future)
+        return await asyncio.wait_for(future, timeout)
+
+    @property
+    def round_trips(self):
+        """Return the most recent status round trip times in seconds."""
+        return self.monitor.round_trips
+
+    @property
+    def last_rtt(self):
+        """Return the round trip time of the last status exchange in seconds."""
+        return self.round_trips[-1] if self.round_trips else None
+
+    def _status_received(self, state) -> tuple:
+        """Answer the oldest outstanding request with ``state``, return its traces."""
+        self._last_status = time.monotonic()
+        rtt, request = self.monitor.status_received()
+        if rtt is not None:
+            self.rtt_histogram.observe(rtt)
+        if request is None:
+            return ()
+        future, traces = request
+        if future is not None and not future.done():
+            future.set_result(state)
+        return traces
+
+    @staticmethod
+    def _fail_status_requests(requests, err: Exception, stage: str):
+        """Fail requests that will not be answered."""
+        for request in requests:
+            if request is None:
+                continue
+            future, traces = request
+            if future is not None and not future.done():
+                future.set_exception(err)
+            tracing.finish(stage, traces)
     
+    def _poll_activity(self):
+        """Poll quickly again, called after a command or a state change."""
+        self.poll_interval = self.heartbeat_min_interval
+        self._activity.set()
+
     async def _heartbeat(self):
+        """Poll the status, backing off while nothing happens.
+
+        A status frame that arrived for any other reason counts as a poll, so
+        the soundbar is still heard from at least every
+        ``heartbeat_max_interval`` seconds.
+        """
+        self.poll_interval = self.heartbeat_min_interval
+        last_poll = 0.0
         while True:
-            await self.report_status()
-            await asyncio.sleep(HEARTBEAT_INTERVAL.seconds)
+            last_heard = max(self._last_status, last_poll)
+            since = time.monotonic() - last_heard
+            polled = since >= self.poll_interval
+            if polled:
+                try:
+                    await self.report_status()
+                except SoundBarNotConnected:
+                    return
+                last_poll = time.monotonic()
+                since = 0
+            elif time.monotonic() - last_poll >= self.poll_interval:
+                # A status frame arrived anyway, no need to ask.
+                self.polls_skipped += 1
+
+            self._activity.clear()
+            try:
+                await asyncio.wait_for(self._activity.wait(), self.poll_interval - since)
+                # Commands are followed by their own status request, start the
+                # fast polling from here.
+                last_poll = time.monotonic()
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            # A whole interval passed without a command or state change.
+            if not polled:
+                continue
+            if self.state.get("power") is False:
+                self.poll_interval = self.heartbeat_max_interval
+            else:
+                self.poll_interval = min(
+                    self.poll_interval * HEARTBEAT_BACKOFF, self.heartbeat_max_interval
+                )
     
     async def _watchdog(self):
+        """Reconnect once the link monitor declares the link dead."""
         while True:
-            try:
-                with anyio.fail_after(HEARTBEAT_INTERVAL.seconds*3):
-                    await self.heartbeat_event.wait()
-            except Exception as e:
-                LOGGER.info(e)
-                break
-            await self.reconnect()
-            
+            await asyncio.sleep(WATCHDOG_INTERVAL)
+            missed = self.monitor.expire()
+            if missed:
+                self._fail_status_requests(
+                    missed, asyncio.TimeoutError("Status request went unanswered"), "failed"
+                )
+                # Chase a lost reply with fast polls before giving up on the link.
+                self._poll_activity()
+            if self.monitor.is_dead():
+                self._connection_lost(f"link looks dead {self.monitor.metrics()}")
+                return
     
     async def handle_recieved(self):
         while True:
-            data = await self.reader.read(1024)
-            LOGGER.debug("Received", data.hex())
-            self.last_recieved = datetime.now()
-            self.state = self.parse_device_status(data)
-            if self.state_update_callback is not None:
-                asyncio.create_task(self.state_update_callback(self.state))
-    
-    def _connect_to_socket(self):
-        """Create a connection to the socket."""
-        sock = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
-        sock.settimeout(1)
-        try:
-            sock.connect((self.bt_attr, self.bt_port))
-        except Exception as e:
-            sock.close()
-            raise e
+            try:
+                data = await self.reader.read(1024)
+            except ConnectionError as err:
+                self._connection_lost(f"read failed: {err}")
+                return
+            if not data:
+                self._connection_lost("soundbar closed the connection")
+                return
+            LOGGER.debug("Received %s", data.hex())
+            self.monitor.received()
 
-        return sock
+            new_state = None
+            traces = []
+            for frame in self.decoder.feed(data):
+                self.frames_received += 1
+                if is_status_frame(frame):
+                    new_state = self.parse_device_status(frame)
+                    traces.extend(self._status_received(new_state))
+                else:
+                    LOGGER.debug("Ignoring frame %s", frame.hex())
+
+            if new_state is None:
+                continue
+            if new_state != self.state:
+                self._poll_activity()
+            self.state = new_state
+            if self.state_update_callback is None:
+                continue
+            if traces:
+                for trace in traces:
+                    trace.mark("status_received")
+                # The state update and its publishes run on behalf of the confirmed commands.
+                tracing.context_with(traces).run(
+                    self._start_callback, self.state_update_callback(self.state)
+                )
+            else:
+                self._start_callback(self.state_update_callback(self.state))
     
-    async def connect(self, forground_retry=False):
-        while self.connected is False:
-            LOGGER.info("Trying to connect to Soundbar.")
+    def _start_callback(self, coro):
+        """Run a callback coroutine as a task in the current context."""
+        task = asyncio.create_task(coro)
+        self._callback_tasks.add(task)
+        task.add_done_callback(self._callback_tasks.discard)
+
+    def _set_state(self, link_state):
+        if link_state is not self.link_state:
+            LOGGER.debug("Soundbar link %s -> %s", self.link_state.value, link_state.value)
+            self.link_state = link_state
+
+    async def connect(self):
+        """Start the connection state machine and wait for the first attempt.
+
+        If that attempt fails, connecting continues in the background with
+        exponential backoff; the same task also re-establishes lost links.
+        """
+        if self._connect_task is None or self._connect_task.done():
+            self._attempted.clear()
+            self._connect_task = asyncio.create_task(self._run_connection())
+        await self._attempted.wait()
+
+    async def _run_connection(self):
+        """Connect, wait until the link is lost, back off and repeat."""
+        self.backoff.reset()
+        while True:
+            self._set_state(LinkState.CONNECTING)
+            LOGGER.info("Trying to connect to Soundbar via %s.", self.transport)
             try:
-                async with anyio.fail_after(1):
-                    self.sock = await anyio.to_thread.run_sync(self._connect_to_socket)
-                    self.reader, self.writer = await asyncio.open_connection(sock=self.sock)
-                    self.connected = True
+                self.reader, self.writer = await asyncio.wait_for(
+                    self.transport.open(), CONNECT_TIMEOUT
+                )
             except Exception as e:
-                LOGGER.debug(str(e))
-                await asyncio.sleep(1)
-                
-                if forground_retry is False:
-                    LOGGER.info("re-trying in background task.")
-                    asyncio.create_task(self.connect(True))
-                    return
+                self._set_state(LinkState.DISCONNECTED)
+                self._attempted.set()
+                delay = self.backoff.next()
+                LOGGER.info("Connecting to Soundbar failed (%s), retrying in %.1f seconds.", e, delay)
+                await asyncio.sleep(delay)
+                continue
+
+            self._on_connected()
+            self._attempted.set()
+            await self._link_lost.wait()
 
+            self.reconnects += 1
+            if time.monotonic() - self._connected_at >= STABLE_LINK_TIME:
+                self.backoff.reset()
+            delay = self.backoff.next()
+            LOGGER.info("Reconnecting to Soundbar in %.1f seconds.", delay)
+            await asyncio.sleep(delay)
 
-        self.heartbeat_event.set()
+    def _on_connected(self):
+        """Start the tasks serving a fresh link."""
+        self._set_state(LinkState.CONNECTED)
+        self._connected_at = time.monotonic()
+        self._link_lost.clear()
+        self._link_up.set()
+        self.monitor.reset()
+        self.decoder.reset()
         LOGGER.info("Connected to Soundbar.")
+
+        if self.connection_callback is not None:
+            self._start_callback(self.connection_callback(True))
+        # The heartbeat polls the status right away.
         self.reader_task = asyncio.create_task(self.handle_recieved())
         self.heartbeat_task = asyncio.create_task(self._heartbeat())
-        
-        if self.watchdog_task is None:
-            self.watchdog_task = asyncio.create_task(self._watchdog())
-        await self.report_status()
-    
+        self.watchdog_task = asyncio.create_task(self._watchdog())
+
+    def _connection_lost(self, reason):
+        """Tear the link down and let the connection task reconnect."""
+        if self.link_state is not LinkState.CONNECTED:
+            return
+        LOGGER.warning("Lost connection to Soundbar: %s", reason)
+        self._teardown()
+        self._link_lost.set()
+
+    def _teardown(self):
+        """Close the transport and stop the tasks of the current link."""
+        self._set_state(LinkState.CLOSING)
+        self._link_up.clear()
+        self._fail_status_requests(
+            self.monitor.abandon(), ConnectionError("Soundbar disconnected"), "link_lost"
+        )
+        self.transport.close()
+        self.reader = self.writer = None
+
+        for task in (self.reader_task, self.heartbeat_task, self.watchdog_task):
+            if task is not None:
+                task.cancel()
+        self.reader_task = self.heartbeat_task = self.watchdog_task = None
+
+        # The state is unknown until the next link reports it. Entities must not
+        # republish the old one, it would undo e.g. an optimistic power OFF.
+        self.state = {}
+        if self.state_update_callback is not None:
+            self._start_callback(self.state_update_callback({}))
+        if self.connection_callback is not None:
+            self._start_callback(self.connection_callback(False))
+        self._set_state(LinkState.DISCONNECTED)
+
     async def close(self):
-        self.connected = False
-        if self.writer:
-            self.writer.close()
-        if self.sock:
-            await anyio.to_thread.run_sync(self.sock.close)
-
-        asyncio.create_task(self.state_update_callback({}))
-        
-        if self.reader_task is not None:
-            self.reader_task.cancel()
-            self.reader_task = None
-        
-        if self.heartbeat_task is not None:
-            self.heartbeat_task.cancel()
-            self.heartbeat_task = None
+        """Close the link for good, it is not re-established."""
+        if self._connect_task is not None:
+            self._connect_task.cancel()
+            self._connect_task = None
+        if self.link_state is LinkState.CONNECTED:
+            self._teardown()
+        self._set_state(LinkState.DISCONNECTED)
     
     async def reconnect(self):
-        await self.close()
-        await self.connect()
+        """Drop the current link, the connection task brings it back with backoff."""
+        self._connection_lost("reconnect requested")
+
+    async def _wait_connected(self):
+        """Wait briefly for a link that is being established, or fail fast."""
+        if self._connect_task is None or self._connect_task.done():
+            raise SoundBarNotConnected("Soundbar connection is closed")
+        try:
+            await asyncio.wait_for(self._link_up.wait(), COMMAND_CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise SoundBarNotConnected(f"Soundbar is {self.link_state.value}") from None
     
-    async def _send_command(self, command):
-        self.heartbeat_event.set()
+    async def _send_command(self, command, status_request=None):
+        if self.link_state is not LinkState.CONNECTED:
+            await self._wait_connected()
+        if command != COMMANDS["report_status"]:
+            self._poll_activity()
         packet = encode(command)
         self.writer.write(packet)
+        self.frames_sent += 1
+        if command == COMMANDS["report_status"]:
+            # Queued once written, a reply that arrives before is not this one's.
+            self.monitor.request_sent(status_request)
         try:
             await self.writer.drain()
-        except:
-            await self.reconnect()
+        except ConnectionError as err:
+            self._connection_lost(f"write failed: {err}")
+            raise SoundBarNotConnected("Soundbar connection lost") from err
+        if command != COMMANDS["report_status"]:
+            tracing.mark("bt_write")
     
     @staticmethod
-    def parse_device_status(pkt):
-        pkt = pkt[3:]
-        # remove the first 4 bytes, which is <ccaa><length><type>
-        params = {}
-        params['power'] = pkt[2] != 0
-        params['input'] = INPUT_NAMES.get(pkt[3])
-        params['mute'] = pkt[4] != 0
-        params['volume'] = pkt[5]
-        params['subwoofer'] = pkt[6]
-        srd = (pkt[10] << 8) + pkt[11]
-        params['surround'] = SURROUND_NAMES.get(srd, srd)
-        params['bass_ext'] = not (pkt[12] & 0x20 == 0)
-        params['clearvoice'] = not (pkt[12] & 0x4 == 0)
-        return params
+    def parse_device_status(pkt) -> DeviceStatus:
+        return decode_status(pkt)